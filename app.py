@@ -1,11 +1,32 @@
+import logging
+import logging.handlers
 import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import streamlit as st
 import pandas as pd
-import duckdb
+import pyarrow as pa
 from dotenv import load_dotenv
-import requests
 import plotly.express as px
-from functools import lru_cache
+
+from candidates import candidate_temperature, first_valid_candidate
+from conversation import ConversationMemory
+from engine import SharedEngine
+from exports import EXPORT_FORMATS
+from gemini import GeminiClient, StreamInterrupted, sql_statement_complete
+from governor import QueryKilled, page_sql
+from llm_cache import ResponseCache
+from pipeline import (build_fix_prompt, build_insight_prompt, build_sql_prompt, inline_max_purchase_ts,
+                      is_sql_reply, normalize_sql, portable_sql, table_preview)
+from rollup import DEMO_QUERIES, dashboard_filter, filtered_dashboard_queries
+from router import FOLLOW_UP, results_agree
+from schema_index import retrieve_schema
+from semantic_cache import SemanticCache
+from sql_repair import explain_error, repair_sql
+from storage import CACHE_DIR, duckdb_config, folder_signature
+from tracing import in_current_trace, serve_metrics, span, traced, tracer
 
 # ---------------------------
 # Page / theme / CSS
@@ -220,6 +241,38 @@ render_sidebar_logo()
 # ---------------------------
 GEMINI_API_KEY = st.secrets["GEMINI_API_KEY"]
 MODEL_NAME = st.secrets.get("MODEL_NAME", "gemini-2.0-flash")
+DATA_CACHE_DIR = st.secrets.get("DATA_CACHE_DIR", CACHE_DIR)
+MATERIALIZE_SALES = st.secrets.get("MATERIALIZE_SALES", True)
+MAX_CONCURRENT_QUERIES = int(st.secrets.get("MAX_CONCURRENT_QUERIES", 4))
+QUERY_QUEUE_TIMEOUT = float(st.secrets.get("QUERY_QUEUE_TIMEOUT", 120))
+RESULT_CACHE_MAX_MB = float(st.secrets.get("RESULT_CACHE_MAX_MB", 256))
+QUERY_TIMEOUT = float(st.secrets.get("QUERY_TIMEOUT", 60))
+INTERACTIVE_ROW_CAP = int(st.secrets.get("INTERACTIVE_ROW_CAP", 10000))
+DUCKDB_MEMORY_LIMIT = st.secrets.get("DUCKDB_MEMORY_LIMIT", None)
+DUCKDB_THREADS = st.secrets.get("DUCKDB_THREADS", None)
+DUCKDB_TEMP_DIR = st.secrets.get("DUCKDB_TEMP_DIR", None)
+DUCKDB_MAX_TEMP_SIZE = st.secrets.get("DUCKDB_MAX_TEMP_SIZE", None)
+OUT_OF_CORE = st.secrets.get("OUT_OF_CORE", False)
+SALES_PARTITIONING = st.secrets.get("SALES_PARTITIONING", None) or None
+RESULT_PAGE_SIZE = int(st.secrets.get("RESULT_PAGE_SIZE", 100))
+GEMINI_BASE_URL = st.secrets.get("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com")
+GEMINI_STREAM = st.secrets.get("GEMINI_STREAM", True)
+GEMINI_MAX_RETRIES = int(st.secrets.get("GEMINI_MAX_RETRIES", 3))
+GEMINI_CONNECT_TIMEOUT = float(st.secrets.get("GEMINI_CONNECT_TIMEOUT", 5))
+GEMINI_READ_TIMEOUT = float(st.secrets.get("GEMINI_READ_TIMEOUT", 60))
+LLM_CACHE_ENABLED = st.secrets.get("LLM_CACHE", True)
+LLM_CACHE_TTL = float(st.secrets.get("LLM_CACHE_TTL", 7 * 24 * 3600))
+LLM_CACHE_MAX_MB = float(st.secrets.get("LLM_CACHE_MAX_MB", 50))
+SQL_CANDIDATES = int(st.secrets.get("SQL_CANDIDATES", 1))
+SCHEMA_TOKEN_BUDGET = int(st.secrets.get("SCHEMA_TOKEN_BUDGET", 1200))
+MEMORY_TOKEN_BUDGET = int(st.secrets.get("MEMORY_TOKEN_BUDGET", 600))
+ROUTER_ENABLED = st.secrets.get("INTENT_ROUTER", True)
+ROUTER_MIN_CONFIDENCE = float(st.secrets.get("ROUTER_MIN_CONFIDENCE", 0.75))
+ROUTER_SHADOW_RATE = float(st.secrets.get("ROUTER_SHADOW_RATE", 0.1))
+SEMANTIC_CACHE_ENABLED = st.secrets.get("SEMANTIC_CACHE", True)
+SEMANTIC_CACHE_THRESHOLD = float(st.secrets.get("SEMANTIC_CACHE_THRESHOLD", 0.9))
+TRACE_LOG = st.secrets.get("TRACE_LOG", True)
+METRICS_PORT = int(st.secrets.get("METRICS_PORT", 0))
 
 
 # ---------------------------
@@ -233,150 +286,188 @@ tab_chat, tab_dashboard, tab_lab = st.tabs(["💬 Chat", "📊 Dashboard", "🧪
 # ---------------------------
 # Memory / Schema / Guardrails
 # ---------------------------
-def get_chat_memory():
-    if "chat_memory" not in st.session_state:
-        st.session_state["chat_memory"] = []
+def get_chat_memory() -> ConversationMemory:
+    if not isinstance(st.session_state.get("chat_memory"), ConversationMemory):
+        st.session_state["chat_memory"] = ConversationMemory(MEMORY_TOKEN_BUDGET)
     return st.session_state["chat_memory"]
 
-def append_memory(role: str, content: str):
-    mem = get_chat_memory()
-    mem.append({"role": role, "content": content})
-    if len(mem) > 15:
-        mem.pop(0)
-
-def summarize_memory() -> str:
-    mem = get_chat_memory()
-    return "\n".join([f"{m['role'].capitalize()}: {m['content']}" for m in mem[-6:]])
-
-@lru_cache(maxsize=1)
-def get_schema(conn):
-    tables = conn.execute("SHOW TABLES").fetchdf()["name"].tolist()
-    out = []
-    for t in tables:
-        cols = conn.execute(f"PRAGMA table_info({t})").fetchdf()
-        out.append(f"- {t}({', '.join(cols['name'].tolist()[:10])})")
-    return "\n".join(out)
-
-def normalize_sql(sql: str) -> str:
-    """
-    Cleans Gemini output by:
-    - removing reasoning lines (# ...)
-    - removing markdown code fences
-    - preserving all valid SQL clauses
-    - fixing incomplete SQL by falling back safely
-    """
-    if not sql:
-        return "SELECT 'Error: Empty SQL from model' AS message;"
-
-    # Remove markdown wrappers and stray characters
-    cleaned = (
-        sql.replace("```sql", "")
-           .replace("```", "")
-           .replace("`", "")
-           .strip()
-    )
-
-    # List of allowed SQL beginnings
-    valid_starts = (
-        "select", "with", "from", "where", "group by",
-        "order by", "having", "join", "left join",
-        "right join", "inner join", "limit"
-    )
-
-    extracted_lines = []
-    for line in cleaned.splitlines():
-        stripped = line.strip().lower()
+def summarize_memory(include_current: bool = True) -> str:
+    return get_chat_memory().render(include_current)
 
-        # Skip reasoning or explanation lines
-        if stripped.startswith("#"):
-            continue
-
-        # Keep any line starting with a valid SQL keyword
-        if any(stripped.startswith(start) for start in valid_starts):
-            extracted_lines.append(line)
-            continue
-
-    # If nothing was captured, fallback to safe default
-    if not extracted_lines:
-        return "SELECT * FROM sales_enriched LIMIT 20;"
-
-    # Reconstruct SQL
-    final_sql = "\n".join(extracted_lines).strip()
-
-    # Ensure the query ends with a semicolon
-    if not final_sql.endswith(";"):
-        final_sql += ";"
-
-    return final_sql
+# ---------------------------
+# Gemini call
+# ---------------------------
+@st.cache_resource(show_spinner=False)
+def get_llm_cache() -> ResponseCache:
+    return ResponseCache(os.path.join(DATA_CACHE_DIR, "llm_responses.sqlite"),
+                         LLM_CACHE_TTL, int(LLM_CACHE_MAX_MB * 1024 * 1024))
+
+@st.cache_resource(show_spinner=False)
+def get_semantic_cache():
+    # Optional: without chromadb (or with a broken store) chat simply skips this step.
+    try:
+        return SemanticCache(os.path.join(DATA_CACHE_DIR, "semantic_cache"), threshold=SEMANTIC_CACHE_THRESHOLD)
+    except Exception as e:
+        logging.getLogger("maer.semantic_cache").warning("Semantic cache disabled: %s", e)
+        return None
+
+@st.cache_resource(show_spinner=False)
+def get_gemini() -> GeminiClient:
+    # One pooled client per process; keep-alive connections are reused across sessions.
+    return GeminiClient(GEMINI_API_KEY, MODEL_NAME, GEMINI_BASE_URL,
+                        cache=get_llm_cache() if LLM_CACHE_ENABLED else None,
+                        max_retries=GEMINI_MAX_RETRIES,
+                        connect_timeout=GEMINI_CONNECT_TIMEOUT,
+                        read_timeout=GEMINI_READ_TIMEOUT)
 
+def ask_gemini(prompt:str)->str:
+    with span("ask_gemini", prompt_chars=len(prompt)) as attrs:
+        text = get_gemini().generate(prompt)
+        attrs["response_chars"] = len(text)
+        return text
 
+def stream_sql_from_gemini(prompt:str)->str:
+    """
+    Streams the reply into a live placeholder and stops reading as soon as the
+    SQL statement is complete, so execution can start without waiting for the tail.
+    """
+    live=st.empty()
+    text=""
+    with span("ask_gemini", prompt_chars=len(prompt), streamed=True) as attrs:
+        t0 = time.perf_counter()
+        try:
+            for chunk in get_gemini().stream(prompt):
+                if not text:
+                    attrs["first_chunk_ms"] = round((time.perf_counter() - t0) * 1000, 3)
+                text+=chunk
+                live.code(text, language="sql")
+                if sql_statement_complete(text):
+                    break
+        except StreamInterrupted as e:
+            # A cut-off statement would only fail later; report it like any other Gemini error.
+            text = f"Error: {e}"[:400]
+        attrs["response_chars"] = len(text)
+    live.empty()
+    return text
+
+@st.cache_resource(show_spinner=False)
+def get_background_pool() -> ThreadPoolExecutor:
+    # Background LLM work (Executive Insight) so it never blocks result display.
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="maer-bg")
+
+def generate_sql_candidates(prompt: str, k: int):
+    """
+    Asks for k SQL candidates at once and validates each on its own cursor as it
+    arrives. Returns (winner_index, raw_text, sql, repair_rules, error).
+    """
+    client = get_gemini()
 
-# ---------------------------
-# Data loading
-# ---------------------------
-def load_data_into_duckdb(data_path="data/olist"):
-    conn = duckdb.connect(database=":memory:")
-    for f in os.listdir(data_path):
-        if f.endswith(".csv"):
-            name = os.path.splitext(f)[0]
-            conn.execute(
-                f"CREATE OR REPLACE VIEW {name} AS "
-                f"SELECT * FROM read_csv_auto('{os.path.join(data_path,f)}', HEADER=TRUE)"
-            )
-    conn.execute("""
-        CREATE OR REPLACE VIEW sales_enriched AS
-        SELECT oi.order_id,oi.product_id,p.product_category_name AS category,
-               CAST(oi.price AS DOUBLE) AS price,CAST(oi.freight_value AS DOUBLE) AS freight_value,
-               o.order_status,o.order_purchase_timestamp,o.order_delivered_customer_date,
-               c.customer_city,c.customer_state,pay.payment_type,
-               CAST(pay.payment_value AS DOUBLE) AS payment_value,
-               CAST(r.review_score AS DOUBLE) AS review_score
-        FROM olist_order_items_dataset oi
-        JOIN olist_orders_dataset o ON oi.order_id=o.order_id
-        LEFT JOIN olist_products_dataset p ON oi.product_id=p.product_id
-        LEFT JOIN olist_customers_dataset c ON o.customer_id=c.customer_id
-        LEFT JOIN olist_order_payments_dataset pay ON o.order_id=pay.order_id
-        LEFT JOIN olist_order_reviews_dataset r ON o.order_id=r.order_id;
-    """)
-    return conn
+    def validate(raw):
+        if not is_sql_reply(raw):
+            # An error or prose reply would otherwise "validate" as normalize_sql's fallback query.
+            return None, [], (raw if raw.startswith("Error") else "Model reply has no SQL statement")[:400]
+        cur = engine.cursor()
+        try:
+            cleaned = inline_max_purchase_ts(normalize_sql(raw), cur)
+            checked, rules, error = repair_sql(cur, cleaned, raw, engine.schema_names)
+            return (inline_max_purchase_ts(checked, cur) if rules else cleaned), rules, error
+        finally:
+            cur.close()
+
+    def generate(i):
+        with span("ask_gemini", prompt_chars=len(prompt), candidate=i) as attrs:
+            text = client.generate(prompt, candidate_temperature(i))
+            attrs["response_chars"] = len(text)
+            return text
+
+    return first_valid_candidate(in_current_trace(generate), in_current_trace(validate), k, get_background_pool())
+
+def log_background_failure(future):
+    # Fire-and-forget work still reports what went wrong.
+    if future.exception() is not None:
+        logging.getLogger("maer.background").warning("Background task failed: %r", future.exception())
+
+def shadow_check_route(prompt: str, routed_table):
+    """Asks the LLM the same question in the background and records whether both answers agree."""
+    raw = get_gemini().generate(prompt)
+    cur = engine.cursor()
+    try:
+        sql, _, error = repair_sql(cur, inline_max_purchase_ts(normalize_sql(raw), cur), raw, engine.schema_names)
+        if error is not None or raw.startswith("Error"):
+            outcome = "error"
+        else:
+            table = engine.query_arrow(cur, inline_max_purchase_ts(sql, cur))
+            outcome = "agree" if results_agree(routed_table, table) else "disagree"
+    except Exception:
+        outcome = "error"
+    finally:
+        cur.close()
+    engine.router.stats.record_check(outcome)
+
+def timed_generate(client: GeminiClient, prompt: str):
+    t0 = time.perf_counter()
+    with span("insight", prompt_chars=len(prompt)) as attrs:
+        text = client.generate(prompt)
+        attrs["response_chars"] = len(text)
+    return text, (time.perf_counter() - t0) * 1000
+
+@contextmanager
+def timed(timings: dict, stage: str):
+    # Every per-turn stage is also a tracing span.
+    t0 = time.perf_counter()
+    try:
+        with span(stage):
+            yield
+    finally:
+        timings[stage] = (time.perf_counter() - t0) * 1000
 
 # ---------------------------
-# KPI helpers
+# Shared engine (one per dataset, cursors per session)
 # ---------------------------
-def kpi_df(conn):
-    return conn.execute("""
-        SELECT COUNT(DISTINCT order_id) AS total_orders,
-               SUM(payment_value) AS total_revenue,
-               COUNT(DISTINCT customer_city) AS unique_customers,
-               AVG(review_score) AS avg_rating
-        FROM sales_enriched
-    """).fetchdf()
-
-def monthly_revenue_df(conn):
-    return conn.execute("""
-        SELECT strftime(order_purchase_timestamp,'%Y-%m') AS month,
-               SUM(price) AS revenue
-        FROM sales_enriched GROUP BY month ORDER BY month
-    """).fetchdf()
-
-def top_categories_df(conn,limit=10):
-    return conn.execute(f"""
-        SELECT COALESCE(category,'unknown') AS category,SUM(price) AS total_sales
-        FROM sales_enriched GROUP BY category ORDER BY total_sales DESC LIMIT {int(limit)}
-    """).fetchdf()
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_engine(data_path: str, signature: tuple) -> SharedEngine:
+    # signature changes whenever a CSV is added, removed or touched → fresh engine
+    return SharedEngine(data_path, DATA_CACHE_DIR, MATERIALIZE_SALES,
+                        MAX_CONCURRENT_QUERIES, QUERY_QUEUE_TIMEOUT,
+                        int(RESULT_CACHE_MAX_MB * 1024 * 1024), QUERY_TIMEOUT,
+                        INTERACTIVE_ROW_CAP, DUCKDB_MEMORY_LIMIT, ROUTER_MIN_CONFIDENCE,
+                        duckdb_config(None, DUCKDB_THREADS, DUCKDB_TEMP_DIR, DUCKDB_MAX_TEMP_SIZE,
+                                      OUT_OF_CORE, DATA_CACHE_DIR),
+                        partition_by=SALES_PARTITIONING)
+
+@st.cache_resource(show_spinner=False)
+def setup_query_log() -> str:
+    # Timed-out and cancelled queries (with their SQL) end up here.
+    os.makedirs(DATA_CACHE_DIR, exist_ok=True)
+    path = os.path.join(DATA_CACHE_DIR, "killed_queries.log")
+    handler = logging.FileHandler(path)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    governor_log = logging.getLogger("maer.governor")
+    governor_log.addHandler(handler)
+    governor_log.setLevel(logging.INFO)
+    return path
+
+@st.cache_resource(show_spinner=False)
+def setup_tracing():
+    # Spans as JSON lines (rotated), plus an optional Prometheus /metrics endpoint.
+    if TRACE_LOG:
+        os.makedirs(DATA_CACHE_DIR, exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(
+            os.path.join(DATA_CACHE_DIR, "traces.jsonl"), maxBytes=20 * 1024 * 1024, backupCount=3)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        trace_log = logging.getLogger("maer.tracing")
+        trace_log.addHandler(handler)
+        trace_log.setLevel(logging.INFO)
+        trace_log.propagate = False
+    if METRICS_PORT:
+        try:
+            return serve_metrics(METRICS_PORT)
+        except OSError as e:
+            logging.getLogger("maer.tracing").warning("Metrics endpoint not started: %s", e)
+    return None
 
-# ---------------------------
-# Gemini call
-# ---------------------------
-def ask_gemini(prompt:str)->str:
-    if not GEMINI_API_KEY:
-        return "Error: Missing GEMINI_API_KEY"
-    url=f"https://generativelanguage.googleapis.com/v1beta/models/{MODEL_NAME}:generateContent?key={GEMINI_API_KEY}"
-    res=requests.post(url,json={"contents":[{"parts":[{"text":prompt}]}]},timeout=60)
-    try:
-        return res.json()["candidates"][0]["content"]["parts"][0]["text"]
-    except Exception:
-        return "Error: "+str(res.text)[:400]
+setup_query_log()
+setup_tracing()
 
 # ---------------------------
 # Sidebar setup / controls
@@ -386,50 +477,222 @@ with st.sidebar:
     data_path = st.text_input("Dataset folder", value="data/olist")
     if st.button("Load Dataset", type="primary"):
         with st.spinner("Loading dataset…"):
-            st.session_state["conn"]=load_data_into_duckdb(data_path)
+            engine=get_engine(data_path, folder_signature(data_path))
+            st.session_state["engine"]=engine
+            st.session_state["conn"]=engine.cursor()
         st.success("✅ Dataset loaded successfully!")
 
     st.markdown("---")
     st.subheader("🧠 Agent Controls")
     if st.button("🧹 Reset Memory"):
-        st.session_state["chat_memory"] = []
+        st.session_state["chat_memory"] = ConversationMemory(MEMORY_TOKEN_BUDGET)
         st.success("Conversation memory cleared!")
+    mem_stats = get_chat_memory().stats()
+    if mem_stats["turns"]:
+        st.caption(f"🧠 Memory: {mem_stats['full_turns']} recent + {mem_stats['summarized']} summarized turns "
+                   f"• ~{mem_stats['tokens']} tokens")
+    if LLM_CACHE_ENABLED:
+        llm_stats = get_llm_cache().stats()
+        st.caption(f"🗄️ LLM cache: {llm_stats['hits']} hits • {llm_stats['misses']} misses • {llm_stats['entries']} stored")
+    if st.button("⏹️ Cancel running query"):
+        st.toast("Query cancelled.")
     show_reason = st.toggle("🤖 Show Agent Reasoning", value=False, key="show_reasoning")
 
     st.markdown("---")
     st.subheader("🎬 Demo queries")
-    demo = st.radio("Pick one:",[
-        "Top 5 categories by total sales",
-        "Monthly revenue trend",
-        "Best states by average review score",
-        "Payment methods share"],index=None)
+    demo = st.radio("Pick one:",list(DEMO_QUERIES),index=None)
     if demo and "conn" in st.session_state:
-        qmap={
-            "Top 5 categories by total sales":"SELECT category,SUM(price) AS total_sales FROM sales_enriched GROUP BY category ORDER BY total_sales DESC LIMIT 5",
-            "Monthly revenue trend":"SELECT strftime(order_purchase_timestamp,'%Y-%m') AS month,SUM(price) AS revenue FROM sales_enriched GROUP BY month ORDER BY month",
-            "Best states by average review score":"SELECT customer_state,AVG(review_score) AS avg_score FROM sales_enriched GROUP BY customer_state HAVING COUNT(*)>50 ORDER BY avg_score DESC LIMIT 10",
-            "Payment methods share":"SELECT payment_type,SUM(payment_value) AS total_value FROM sales_enriched GROUP BY payment_type ORDER BY total_value DESC"
-        }
-        st.session_state["preset_query"]=qmap[demo]
+        st.session_state["preset_query"]=demo
 
 # If dataset not loaded yet
 if "conn" not in st.session_state:
     st.info("⬅️ Load the dataset from the sidebar to begin.")   # ← Arrow to left sidebar
     st.stop()
 conn=st.session_state["conn"]
+engine=st.session_state["engine"]
+answers=engine.answers
+def run_query(sql: str):
+    """
+    Governed, row-capped query for on-screen results, returned as Arrow
+    (table, truncated). Shows a live timer while it runs; a timeout or cancel
+    surfaces as an error and an empty table.
+    """
+    status = st.empty()
+    def tick(elapsed):
+        status.caption(f"⏳ Running query… {elapsed:.1f}s — ⏹️ Cancel in the sidebar stops it")
+    try:
+        return engine.run_interactive(conn, sql, on_tick=tick)
+    except QueryKilled as e:
+        st.error(f"⏱️ {e} — the query was stopped and logged.")
+        return pa.table({}), False
+    finally:
+        status.empty()
+
+def read_export(sql: str, fmt: str) -> bytes:
+    # Streamlit keeps downloads in memory, so the file is read once, not chunked and joined.
+    path = engine.export(sql, fmt)
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(path)
+
+@st.fragment
+def export_controls(sql: str, key: str, base_name: str):
+    """
+    Format picker + download. The export re-runs the SQL with DuckDB COPY only
+    when the button is clicked, so the on-screen preview is never re-serialized.
+    """
+    fmt_col, dl_col = st.columns([0.4, 0.6])
+    fmt = fmt_col.selectbox("Export format", list(EXPORT_FORMATS), key=f"{key}_fmt",
+                            label_visibility="collapsed")
+    suffix, mime, _ = EXPORT_FORMATS[fmt]
+    dl_col.download_button(
+        f"⬇️ Download {fmt}",
+        data=lambda: read_export(sql, fmt),
+        file_name=f"{base_name}{suffix}",
+        mime=mime,
+        key=f"{key}_download",
+        on_click="ignore",
+        use_container_width=True,
+    )
+
+@st.fragment
+def show_result(table, truncated: bool, sql: str, key: str):
+    """
+    Paginated viewer: only the current page is converted to pandas and sent to
+    the browser. Pages inside the capped Arrow result are zero-copy slices;
+    pages past the cap are fetched on demand with LIMIT/OFFSET.
+    """
+    page_key = f"{key}_page"
+    page = st.session_state.get(page_key, 0)
+    start = page * RESULT_PAGE_SIZE
+    if start + RESULT_PAGE_SIZE <= table.num_rows or (not truncated and start < table.num_rows):
+        view = table.slice(start, RESULT_PAGE_SIZE)
+    else:
+        try:
+            view = engine.query_arrow(conn, page_sql(sql, RESULT_PAGE_SIZE, start))
+        except QueryKilled as e:
+            st.error(f"⏱️ {e} — the query was stopped and logged.")
+            return
+    st.dataframe(view.to_pandas(), use_container_width=True, hide_index=True)
+
+    has_next = start + RESULT_PAGE_SIZE < table.num_rows or (truncated and view.num_rows == RESULT_PAGE_SIZE)
+    prev_col, info_col, next_col = st.columns([1, 4, 1])
+    if prev_col.button("◀ Prev", key=f"{key}_prev", disabled=page == 0, use_container_width=True):
+        st.session_state[page_key] = page - 1
+        st.rerun(scope="fragment")
+    total = f"{table.num_rows:,}+" if truncated else f"{table.num_rows:,}"
+    info_col.caption(f"Rows {start + 1:,}–{start + view.num_rows:,} of {total}")
+    if next_col.button("Next ▶", key=f"{key}_next", disabled=not has_next, use_container_width=True):
+        st.session_state[page_key] = page + 1
+        st.rerun(scope="fragment")
+
+with st.sidebar:
+    gate=engine.gate.stats()
+    st.caption(f"⚡ Queries running: {gate['running']}/{gate['limit']} • queued: {gate['queued']}")
+    cached = engine.results.stats()
+    repairs = engine.repairs.summary()
+    if repairs["repaired_locally"] or repairs["llm_fallback"]:
+        st.caption(f"🛠️ Local SQL repair: {repairs['local_repair_rate']:.0%} of failures fixed without Gemini "
+                   f"({repairs['repaired_locally']} local • {repairs['llm_fallback']} via LLM)")
+    routing = engine.router.stats.summary()
+    if routing["routed"] or routing["llm"]:
+        accuracy = f"{routing['accuracy']:.0%} agree in {routing['checked']} checks" if routing["checked"] else "not checked yet"
+        st.caption(f"⚡ Router: {routing['hit_rate']:.0%} answered locally ({routing['routed']}/{routing['routed'] + routing['llm']}) • {accuracy}")
+    semantic_cache = get_semantic_cache() if SEMANTIC_CACHE_ENABLED else None
+    if semantic_cache is not None:
+        sem = semantic_cache.stats()
+        st.caption(f"🔁 Semantic cache: {sem['hit_rate']:.0%} hit rate • {sem['entries']} questions • {sem['evictions']} evicted")
+    picks = engine.candidates.summary()
+    if picks["rounds"]:
+        shares = " • ".join(f"#{i + 1} {share:.0%}" for i, share in picks["win_share"].items())
+        st.caption(f"🎯 SQL candidates: {shares or 'none valid'} ({picks['no_valid_candidate']}/{picks['rounds']} without a valid one)")
+    st.caption(f"♻️ Result cache: {cached['hits']} hits • {cached['entries']} results • {cached['bytes'] / 1e6:,.1f} MB")
+    latency = tracer.summary()
+    if latency:
+        with st.expander("📈 Latency by stage"):
+            st.dataframe(pd.DataFrame([{"stage": name, **stats} for name, stats in latency.items()]).round(1),
+                         use_container_width=True, hide_index=True)
 
 # ---------------------------
 # Dashboard (safe + verified)
 # ---------------------------
-with tab_dashboard:
+def build_dashboard_figures(answers: dict) -> dict:
+    """Plotly specs for the dashboard's category and monthly revenue charts."""
+    figures = {"top_categories": None, "monthly_revenue": None}
+    cat_df = answers["top_categories"]
+    if not cat_df.empty:
+        fig = px.bar(cat_df, x="category", y="total_sales", title="Top 10 Categories by Sales")
+        fig.update_traces(hovertemplate="<b>%{x}</b><br>Total: %{y:,.0f}<extra></extra>")
+        fig.update_layout(
+            paper_bgcolor='rgba(0,0,0,0)',
+            plot_bgcolor='rgba(0,0,0,0)',
+            font_color="#DCE8F7",
+            xaxis_title=None, yaxis_title="Total Sales",
+            margin=dict(l=10, r=10, t=60, b=10),
+            transition_duration=500
+        )
+        figures["top_categories"] = fig.to_dict()
+    rev_df = answers["monthly_revenue"]
+    if not rev_df.empty:
+        fig2 = px.line(rev_df, x="month", y="revenue", markers=True, title="Monthly Revenue Trend")
+        fig2.update_traces(hovertemplate="<b>%{x}</b><br>Revenue: %{y:,.0f}<extra></extra>")
+        fig2.update_layout(
+            paper_bgcolor='rgba(0,0,0,0)',
+            plot_bgcolor='rgba(0,0,0,0)',
+            font_color="#DCE8F7",
+            xaxis_title=None, yaxis_title="Revenue",
+            margin=dict(l=10, r=10, t=60, b=10),
+            transition_duration=600
+        )
+        figures["monthly_revenue"] = fig2.to_dict()
+    return figures
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def dashboard_figures(version: str, _answers: dict) -> dict:
+    """Plotly specs for the dashboard, built once per dataset version and shared by every session."""
+    return build_dashboard_figures(_answers)
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def dashboard_filter_options(version: str):
+    """(first purchase date, last purchase date, states) for the dashboard filters."""
+    cur = engine.cursor()
+    try:
+        first, last = cur.execute("SELECT min_purchase_ts, max_purchase_ts FROM sales_enriched_stats").fetchone()
+        states = [r[0] for r in cur.execute(
+            "SELECT DISTINCT customer_state FROM sales_rollup WHERE customer_state IS NOT NULL ORDER BY 1"
+        ).fetchall()]
+    finally:
+        cur.close()
+    return (first.date() if first else None), (last.date() if last else None), states
+
+@st.fragment
+@traced("dashboard")
+def dashboard_tab():
     try:
-        # Check if the key view exists before running any SQL
-        views = conn.execute("SHOW TABLES").fetchdf()["name"].tolist()
-        if "sales_enriched" not in views:
+        # Table list comes from the engine (read once at load) — no query per rerun.
+        if "sales_enriched" not in engine.schema_names[0]:
             st.warning("⚠️ 'sales_enriched' view not found in DuckDB. Please reload your dataset.")
             st.stop()
 
-        kpis = kpi_df(conn)
+        # Date range / state filters. Unfiltered views come from the precomputed
+        # cube answers; filtered ones query sales_enriched for just that slice.
+        first, last, states = dashboard_filter_options(engine.version)
+        view = answers
+        if first is not None:
+            f1, f2 = st.columns([1.2, 1])
+            dates = f1.date_input("📅 Purchase date range", value=(first, last), min_value=first,
+                                  max_value=last, key="dash_dates")
+            picked = f2.multiselect("📍 Customer state", states, key="dash_states")
+            # Mid-pick the widget returns only the start date: open-ended until the end is chosen.
+            start, end = (dates[0], dates[1] if len(dates) > 1 else last) if dates else (first, last)
+            if (start, end) != (first, last) or picked:
+                where = dashboard_filter(start if start != first else None, end if end != last else None, picked)
+                view = {name: engine.query_df(conn, sql)
+                        for name, sql in filtered_dashboard_queries(where).items()}
+
+        kpis = view["kpis"]
 
         if not kpis.empty:
             c1, c2, c3, c4 = st.columns(4)
@@ -446,35 +709,15 @@ with tab_dashboard:
 
         left, right = st.columns([1.1, 1])
         with left:
-            cat_df = top_categories_df(conn)
-            if not cat_df.empty:
-                fig = px.bar(cat_df, x="category", y="total_sales", title="Top 10 Categories by Sales")
-                fig.update_traces(hovertemplate="<b>%{x}</b><br>Total: %{y:,.0f}<extra></extra>")
-                fig.update_layout(
-                    paper_bgcolor='rgba(0,0,0,0)',
-                    plot_bgcolor='rgba(0,0,0,0)',
-                    font_color="#DCE8F7",
-                    xaxis_title=None, yaxis_title="Total Sales",
-                    margin=dict(l=10, r=10, t=60, b=10),
-                    transition_duration=500
-                )
-                st.plotly_chart(fig, use_container_width=True, config={"displayModeBar": False})
+            figures = (dashboard_figures(engine.version, answers) if view is answers
+                       else build_dashboard_figures(view))
+            if figures["top_categories"] is not None:
+                st.plotly_chart(figures["top_categories"], use_container_width=True, config={"displayModeBar": False})
             else:
                 st.info("ℹ️ No category data available yet.")
         with right:
-            rev_df = monthly_revenue_df(conn)
-            if not rev_df.empty:
-                fig2 = px.line(rev_df, x="month", y="revenue", markers=True, title="Monthly Revenue Trend")
-                fig2.update_traces(hovertemplate="<b>%{x}</b><br>Revenue: %{y:,.0f}<extra></extra>")
-                fig2.update_layout(
-                    paper_bgcolor='rgba(0,0,0,0)',
-                    plot_bgcolor='rgba(0,0,0,0)',
-                    font_color="#DCE8F7",
-                    xaxis_title=None, yaxis_title="Revenue",
-                    margin=dict(l=10, r=10, t=60, b=10),
-                    transition_duration=600
-                )
-                st.plotly_chart(fig2, use_container_width=True, config={"displayModeBar": False})
+            if figures["monthly_revenue"] is not None:
+                st.plotly_chart(figures["monthly_revenue"], use_container_width=True, config={"displayModeBar": False})
             else:
                 st.info("ℹ️ No monthly revenue trend data available yet.")
 
@@ -498,173 +741,238 @@ with tab_dashboard:
     except Exception as e:
         st.error(f"🚨 Dashboard Error: {e}")
 
+with tab_dashboard:
+    dashboard_tab()
 
 
 # ---------------------------
 # CHAT TAB (with reasoning + safe fallback for tabulate)
 # ---------------------------
-with tab_chat:
+@st.fragment
+def chat_tab():
     st.markdown("### 💬 Ask MAER.AI")
     user_query = st.chat_input("Ask something about the Olist dataset…")
     preset_query = st.session_state.get("preset_query")
 
     if preset_query:
         st.chat_message("assistant").markdown("**SQL Generated (preset):**")
-        st.code(preset_query, language="sql")
+        st.code(DEMO_QUERIES[preset_query], language="sql")
         try:
-            df = conn.execute(preset_query).fetchdf()
-            st.dataframe(df, use_container_width=True)
+            if preset_query in answers:
+                st.dataframe(answers[preset_query], use_container_width=True)
+            else:
+                table, truncated = run_query(DEMO_QUERIES[preset_query])
+                st.session_state["preset_result_page"] = 0
+                show_result(table, truncated, DEMO_QUERIES[preset_query], "preset_result")
         except Exception as e:
             st.error(f"Error: {e}")
         st.session_state["preset_query"] = None
 
     if user_query:
-        append_memory("user", user_query)
-        st.chat_message("user").markdown(user_query)
-
-        # ---------------------------
-        # UPDATED PROMPT (date-safe)
-        # ---------------------------
-        with st.spinner("Reasoning and generating SQL with Gemini…"):
-            schema_text = get_schema(conn)
-            reasoning_context = summarize_memory()
-
-            prompt = f"""
-You are MAER.AI, a senior data analyst for an ecommerce platform using DuckDB.
-
-IMPORTANT DATE RULES (strict):
-- The Olist dataset contains historical timestamps (2016–2018).
-- NEVER use CURRENT_DATE, NOW(), TODAY(), or system time.
-- ALL date comparisons MUST be relative to:
-    (SELECT MAX(order_purchase_timestamp) FROM sales_enriched)
-
-Examples you MUST follow:
-- "last month" →
-    DATE_TRUNC('month', order_purchase_timestamp)
-    = DATE_TRUNC('month', (SELECT MAX(order_purchase_timestamp) FROM sales_enriched) - INTERVAL 1 MONTH)
-
-- "this month" →
-    DATE_TRUNC('month', order_purchase_timestamp)
-    = DATE_TRUNC('month', (SELECT MAX(order_purchase_timestamp) FROM sales_enriched))
-
-- "last 3 months" →
-    order_purchase_timestamp >= 
-    (SELECT MAX(order_purchase_timestamp) FROM sales_enriched) - INTERVAL 3 MONTH
-
-- "last week" →
-    order_purchase_timestamp >=
-    (SELECT MAX(order_purchase_timestamp) FROM sales_enriched) - INTERVAL 7 DAY
-
-- NEVER assume today's real date.
-
-Now, as usual:
-First, provide reasoning in 3–5 lines prefixed with '#'.
-Then output ONLY the final valid DuckDB SQL query.
-
-Schema:
-{schema_text}
-
-Conversation memory:
-{reasoning_context}
-
-User question:
-{user_query}
-"""
-
-            sql_text = ask_gemini(prompt)
-
-        cleaned = normalize_sql(sql_text)
-        reasoning_lines = [l for l in sql_text.splitlines() if l.strip().startswith('#')]
-
-        # --- Show reasoning trace if toggle enabled ---
-        if show_reason and reasoning_lines:
-            st.markdown("#### 🧩 Agent Reasoning Trace")
-            st.code("\n".join(reasoning_lines), language="text")
-
-        # --- Show SQL ---
-        st.chat_message("assistant").markdown("**SQL Generated:**")
-        st.code(cleaned, language="sql")
-
-        try:
-            df = conn.execute(cleaned).fetchdf()
-        except Exception as e:
-            error_msg = str(e)
-            st.warning(f"⚠️ SQL Error: {error_msg}")
-            st.info("🔄 Retrying with SQL correction…")
-
-            fix_prompt = f"""
-Fix this SQL for DuckDB.
-
-Schema:
-{schema_text}
-
-Original SQL:
-{cleaned}
-
-Error:
-{error_msg}
-
-Return ONLY valid SQL.
-"""
-            fixed_sql = normalize_sql(ask_gemini(fix_prompt))
-            st.code(fixed_sql, language="sql")
-            df = conn.execute(fixed_sql).fetchdf()
-            append_memory("assistant", f"Fixed SQL: {fixed_sql}")
-
-        append_memory("assistant", f"SQL: {cleaned}")
-
-        if not df.empty:
-            st.dataframe(df, use_container_width=True)
-            st.download_button(
-                "⬇️ Download CSV",
-                data=df.to_csv(index=False).encode("utf-8"),
-                file_name="maer_ai_results.csv",
-                mime="text/csv"
-            )
-
-            try:
+        with span("chat_turn", question_chars=len(user_query)) as turn_attrs:
+            turn_start = time.perf_counter()
+            timings = {}
+            memory = get_chat_memory()
+            memory.begin_turn(user_query)
+            st.chat_message("user").markdown(user_query)
+
+            # ---------------------------
+            # UPDATED PROMPT (date-safe)
+            # ---------------------------
+            # Only the tables/columns relevant to this question, within the token budget.
+            schema_text = retrieve_schema(engine.schema_index, user_query, SCHEMA_TOKEN_BUDGET)
+            reasoning_context = summarize_memory(include_current=False) or "(none yet)"
+            prompt = build_sql_prompt(user_query, schema_text, reasoning_context)
+
+            route = None
+            if ROUTER_ENABLED:
+                with timed(timings, "routing"):
+                    route = engine.router.route(user_query)
+            semantic = get_semantic_cache() if SEMANTIC_CACHE_ENABLED and not FOLLOW_UP.search(user_query) else None
+            semantic_hit = None
+            if route is None and semantic is not None:
+                with timed(timings, "semantic_lookup"):
+                    semantic_hit = semantic.lookup(user_query, engine.schema_version, engine.literal_values)
+                    if semantic_hit is not None:
+                        # Reused SQL must still validate; otherwise the entry is dropped and Gemini answers.
+                        reused = inline_max_purchase_ts(semantic_hit[1], conn)
+                        if explain_error(conn, reused) is None:
+                            semantic.record_hit()
+                        else:
+                            semantic.evict(semantic_hit[0])
+                            semantic_hit = None
+            failure = None
+            if route is not None:
+                # Fast path: a vetted template answers without a Gemini round trip.
+                sql_text = cleaned = route["sql"]
+                repair_rules, preflight_error = [], None
+            elif semantic_hit is not None:
+                sql_text = cleaned = reused
+                repair_rules, preflight_error = [], None
+            else:
+                with st.spinner("Reasoning and generating SQL with Gemini…"), timed(timings, "sql_generation"):
+                    if SQL_CANDIDATES > 1:
+                        # Several candidates race; the first that validates locally is executed.
+                        winner, sql_text, cleaned, repair_rules, preflight_error = generate_sql_candidates(prompt, SQL_CANDIDATES)
+                        engine.candidates.record(winner)
+                    else:
+                        sql_text = stream_sql_from_gemini(prompt) if GEMINI_STREAM else ask_gemini(prompt)
+
+                if not is_sql_reply(sql_text):
+                    # An API error or a prose reply is reported, not swapped for normalize_sql's fallback query.
+                    failure = sql_text if sql_text.startswith("Error") else "Model reply has no SQL statement"
+                elif SQL_CANDIDATES <= 1:
+                    cleaned = inline_max_purchase_ts(normalize_sql(sql_text), conn)
+
+                    # --- Local pre-flight: EXPLAIN + deterministic repair before any LLM retry ---
+                    with timed(timings, "local_validation"):
+                        checked, repair_rules, preflight_error = repair_sql(conn, cleaned, sql_text, engine.schema_names)
+                    if repair_rules:
+                        cleaned = inline_max_purchase_ts(checked, conn)
+                elif cleaned is None:
+                    cleaned = inline_max_purchase_ts(normalize_sql(sql_text), conn)
+
+            if failure is None:
+                reasoning_lines = [l for l in sql_text.splitlines() if l.strip().startswith('#')]
+
+                # --- Show reasoning trace if toggle enabled ---
+                if show_reason and reasoning_lines:
+                    st.markdown("#### 🧩 Agent Reasoning Trace")
+                    st.code("\n".join(reasoning_lines), language="text")
+
+                # --- Show SQL ---
+                st.chat_message("assistant").markdown("**SQL Generated:**")
+                st.code(cleaned, language="sql")
+                if route is not None:
+                    params = ", ".join(f"{k}={v}" for k, v in route["params"].items() if k != "confidence")
+                    st.caption(f"⚡ Answered by the local router ({params}) — no LLM call")
+                elif semantic_hit is not None:
+                    st.caption(f"🔁 Reused SQL from a similar earlier question ({semantic_hit[2]:.0%} similar) — no LLM call")
+                if repair_rules and preflight_error is None:
+                    st.caption(f"🛠️ Repaired locally: {', '.join(r.replace('_', ' ') for r in repair_rules)}")
+
+                exec_start = time.perf_counter()
                 try:
-                    preview = df.head(10).to_markdown(index=False)
-                except Exception:
-                    preview = df.head(10).to_string(index=False)
-
-                insight_prompt = f"""
-You are a senior business analyst.
-Summarize this table into 2–3 actionable insights considering previous chat memory:
-{summarize_memory()}
-
-Table:
-{preview}
-"""
-
-                insight = ask_gemini(insight_prompt)
-                if insight and not insight.startswith("Error"):
-                    st.markdown(f"🧠 **Executive Insight**\n\n{insight}")
-                    append_memory("assistant", f"Insight: {insight}")
-
-            except Exception as e:
-                st.warning(f"Insight generation skipped ({e})")
-        else:
-            st.warning("No results returned.")
+                    if preflight_error:
+                        raise RuntimeError(preflight_error)
+                    final_sql, final_reply = cleaned, sql_text
+                    table, truncated = run_query(final_sql)
+                    engine.repairs.record("repaired" if repair_rules else "valid", repair_rules)
+                except Exception as e:
+                    error_msg = str(e)
+                    st.warning(f"⚠️ SQL Error: {error_msg}")
+                    st.info("🔄 Retrying with SQL correction…")
+
+                    fix_prompt = build_fix_prompt(schema_text, cleaned, error_msg)
+                    engine.repairs.record("llm_fallback", repair_rules)
+                    final_reply = ask_gemini(fix_prompt)
+                    if not is_sql_reply(final_reply):
+                        failure = error_msg
+                    else:
+                        final_sql = inline_max_purchase_ts(normalize_sql(final_reply), conn)
+                        st.code(final_sql, language="sql")
+                        try:
+                            table, truncated = run_query(final_sql)
+                        except Exception as e2:
+                            failure = str(e2)
+                timings["sql_execution"] = (time.perf_counter() - exec_start) * 1000
+
+            if failure is None:
+                if semantic is not None and route is None and semantic_hit is None and is_sql_reply(final_reply):
+                    # The SQL ran and came from a real model answer, so the pair is verified; stored off the hot path.
+                    get_background_pool().submit(
+                        semantic.store, user_query, portable_sql(final_sql, conn), engine.schema_version,
+                        engine.literal_values).add_done_callback(log_background_failure)
+
+                memory.record_sql(final_sql)
+                memory.record_result(table, truncated)
+                if route is not None and not truncated and random.random() < ROUTER_SHADOW_RATE:
+                    # Accuracy tracking: a sample of routed questions is also answered by the LLM, off the hot path.
+                    get_background_pool().submit(shadow_check_route, prompt, table).add_done_callback(log_background_failure)
+
+                if table.num_rows:
+                    # Kick off the insight first so it runs while the table renders.
+                    insight_future = None
+                    try:
+                        insight_prompt = build_insight_prompt(summarize_memory(), table_preview(table))
+                        insight_future = get_background_pool().submit(in_current_trace(timed_generate), get_gemini(), insight_prompt)
+                    except Exception as e:
+                        st.warning(f"Insight generation skipped ({e})")
+
+                    with timed(timings, "render_result"):
+                        st.session_state["chat_result_page"] = 0
+                        show_result(table, truncated, final_sql, "chat_result")
+                        export_controls(final_sql, "chat_export", "maer_ai_results")
+                    timings["time_to_result"] = (time.perf_counter() - turn_start) * 1000
+
+                    insight_slot = st.empty()
+                    if insight_future is not None:
+                        with insight_slot.container():
+                            with st.spinner("🧠 Writing Executive Insight…"):
+                                try:
+                                    insight, timings["insight_generation"] = insight_future.result()
+                                except Exception as e:
+                                    insight = f"Error: {e}"
+                        if insight and not insight.startswith("Error"):
+                            insight_slot.markdown(f"🧠 **Executive Insight**\n\n{insight}")
+                            memory.record_insight(insight)
+                        else:
+                            insight_slot.empty()
+                else:
+                    st.warning("No results returned.")
+                    timings["time_to_result"] = (time.perf_counter() - turn_start) * 1000
+            else:
+                st.error(f"❌ Could not answer: {failure}")
+                timings["time_to_result"] = (time.perf_counter() - turn_start) * 1000
+
+            turn_attrs["path"] = "router" if route is not None else "semantic_cache" if semantic_hit is not None else "llm"
+            turn_attrs["rows"] = table.num_rows if failure is None else 0
+            chat_timings = st.session_state.setdefault("chat_timings", [])
+            chat_timings.append(timings)
+            del chat_timings[:-50]
+            st.caption(
+                "⏱️ " + " • ".join(f"{stage.replace('_', ' ')} {ms:,.0f} ms" for stage, ms in timings.items())
+            )
 
     st.caption("MAER.AI • Chat • © Anvitha Anand")
 
+with tab_chat:
+    chat_tab()
+
 
 # ---------------------------
 # SQL LAB TAB (safe + branded)
 # ---------------------------
-with tab_lab:
+def show_profile(summary, operators):
+    """Operator table from EXPLAIN ANALYZE, slowest operators highlighted by their share of the time."""
+    if summary is None:
+        st.code(operators, language="text")  # plain-text profile (older DuckDB)
+        return
+    st.success(f"✅ Profiled — {summary['latency_ms']:,.1f} ms total • {summary['cpu_ms']:,.1f} ms CPU • "
+               f"{summary['rows_scanned'] or 0:,} rows scanned • peak buffer {summary['peak_buffer_mb']:,.1f} MB")
+    profile = pd.DataFrame(operators, columns=["operator", "time_ms", "share", "rows", "rows_scanned", "details"])
+    profile["share"] *= 100
+    st.dataframe(
+        profile,
+        use_container_width=True, hide_index=True,
+        column_config={
+            "operator": st.column_config.TextColumn("Operator", width="medium"),
+            "time_ms": st.column_config.NumberColumn("Time (ms)", format="%.2f"),
+            "share": st.column_config.ProgressColumn("Share", min_value=0, max_value=100, format="%.0f%%"),
+            "rows": st.column_config.NumberColumn("Rows out"),
+            "rows_scanned": st.column_config.NumberColumn("Rows scanned"),
+            "details": st.column_config.TextColumn("Details", width="large"),
+        },
+    )
+
+@st.fragment
+def sql_lab_tab():
     st.markdown("### 🧪 SQL Lab")
     st.info("Write, run, and test custom DuckDB SQL queries on your loaded dataset.", icon="🧠")
 
     # Check for active dataset connection
-    try:
-        views = conn.execute("SHOW TABLES").fetchdf()["name"].tolist()
-        if not views:
-            st.warning("⚠️ No tables found. Please load a dataset from the sidebar first.")
-            st.stop()
-    except Exception as e:
-        st.error(f"🚨 Connection Error: {e}")
+    if not engine.schema_names[0]:
+        st.warning("⚠️ No tables found. Please load a dataset from the sidebar first.")
         st.stop()
 
     # SQL input area
@@ -679,26 +987,28 @@ with tab_lab:
         height=140,
     )
 
+    explain = st.toggle("🔬 Explain Analyze", key="lab_explain",
+                        help="Run the query under EXPLAIN ANALYZE and show DuckDB's per-operator profile instead of the rows.")
+
     # Action buttons
     run_col, clear_col = st.columns([0.25, 0.25])
     with run_col:
         if st.button("▶️ Run SQL", use_container_width=True):
             try:
-                df = conn.execute(sql_manual).fetchdf()
-                if df.empty:
-                    st.warning("No rows returned — try a different query.")
+                if explain:
+                    show_profile(*engine.explain_analyze(conn, sql_manual))
                 else:
-                    st.success(f"✅ Query executed successfully — {len(df)} rows fetched.")
-                    st.dataframe(df, use_container_width=True)
-
-                    # Optional download
-                    st.download_button(
-                        label="⬇️ Download CSV",
-                        data=df.to_csv(index=False).encode("utf-8"),
-                        file_name="sql_lab_results.csv",
-                        mime="text/csv",
-                        use_container_width=True,
-                    )
+                    table, truncated = run_query(sql_manual)
+                    if not table.num_rows:
+                        st.warning("No rows returned — try a different query.")
+                    else:
+                        fetched = f"{table.num_rows:,}+" if truncated else f"{table.num_rows:,}"
+                        st.success(f"✅ Query executed successfully — {fetched} rows fetched.")
+                        st.session_state["lab_result_page"] = 0
+                        show_result(table, truncated, sql_manual, "lab_result")
+
+                        # Optional download
+                        export_controls(sql_manual, "lab_export", "sql_lab_results")
 
             except Exception as e:
                 st.error(f"❌ SQL Execution Error:\n\n{e}")
@@ -716,6 +1026,9 @@ with tab_lab:
         unsafe_allow_html=True,
     )
 
+with tab_lab:
+    sql_lab_tab()
+
 
 # ---------------------------
 # Footer Branding
@@ -0,0 +1,170 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+from engine import SharedEngine
+from gemini import DEFAULT_BASE_URL, GeminiClient
+from llm_cache import ResponseCache
+from pipeline import Pipeline
+from storage import CACHE_DIR, PARTITION_COLUMNS, duckdb_config
+
+# ---------------------------
+# Batch question runner
+# ---------------------------
+# Answers a file of questions (one per line, or JSONL with a "question" field)
+# headlessly, e.g. for nightly executive reports. The parent process ingests /
+# refreshes the dataset once; a pool of worker processes then opens the same
+# DuckDB file read-only and runs Pipeline.ask concurrently. One output row per
+# question — path, SQL, result preview, insight, error and per-stage timings —
+# written as Parquet or JSONL (by file extension).
+_pipeline = None
+
+
+def read_questions(path: str) -> list:
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if path.endswith(".jsonl"):
+                record = json.loads(line)
+                items.append({"id": str(record.get("id", len(items) + 1)), "question": record["question"]})
+            else:
+                items.append({"id": str(len(items) + 1), "question": line})
+    return items
+
+
+def _init_worker(settings: dict):
+    global _pipeline
+    engine = SharedEngine(settings["data_path"], settings["cache_dir"], row_cap=settings["row_cap"],
+                          query_timeout=settings["query_timeout"], db_config=settings["db_config"],
+                          read_only=True)
+    cache = None
+    if settings["llm_cache"]:
+        cache = ResponseCache(os.path.join(settings["cache_dir"], "llm_responses.sqlite"))
+    gemini = GeminiClient(settings["api_key"], settings["model"], settings["base_url"], cache=cache)
+    _pipeline = Pipeline(engine, gemini, settings["schema_token_budget"],
+                         use_router=settings["use_router"], insights=settings["insights"])
+
+
+def _answer(item: dict, preview_rows: int, results_dir) -> dict:
+    res = _pipeline.ask(item["question"])
+    table = res["table"]
+    row = {
+        "id": item["id"],
+        "question": item["question"],
+        "path": res["path"],
+        "sql": res["sql"],
+        "repair_rules": res["repair_rules"],
+        "rows": table.num_rows if table is not None else None,
+        "truncated": res["truncated"],
+        "columns": [f.name for f in table.schema] if table is not None else [],
+        "preview": (json.dumps(table.slice(0, preview_rows).to_pylist(), default=str)
+                    if table is not None else None),
+        "insight": res["insight"],
+        "error": res["error"],
+        "worker": os.getpid(),
+    }
+    for stage in ("routing", "sql_generation", "local_validation", "sql_execution", "llm_fix",
+                  "insight_generation", "total"):
+        row[f"{stage}_ms"] = round(res["timings"][stage], 3) if stage in res["timings"] else None
+    if results_dir and table is not None:
+        pq.write_table(table, os.path.join(results_dir, f"{item['id']}.parquet"))
+    return row
+
+
+def write_rows(rows: list, path: str):
+    if path.endswith(".jsonl"):
+        with open(path, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, default=str, ensure_ascii=False) + "\n")
+    else:
+        pq.write_table(pa.Table.from_pylist(rows), path, compression="zstd")
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Answer a file of questions with MAER.AI, headless.")
+    parser.add_argument("questions", help=".txt (one question per line) or .jsonl with id/question")
+    parser.add_argument("--data-path", default="data/olist")
+    parser.add_argument("--cache-dir", default=os.environ.get("DATA_CACHE_DIR", CACHE_DIR))
+    parser.add_argument("--out", default="batch_results.parquet", help=".parquet or .jsonl")
+    parser.add_argument("--results-dir", help="also write each full (row-capped) result as <id>.parquet here")
+    parser.add_argument("--workers", type=int, default=max(1, min(8, os.cpu_count() or 1)))
+    parser.add_argument("--row-cap", type=int, default=10000)
+    parser.add_argument("--preview-rows", type=int, default=20)
+    parser.add_argument("--query-timeout", type=float, default=300)
+    parser.add_argument("--memory-limit", help="DuckDB memory_limit per worker, e.g. 2GB")
+    parser.add_argument("--partitioning", choices=sorted(PARTITION_COLUMNS),
+                        default=os.environ.get("SALES_PARTITIONING") or None,
+                        help="sales_enriched layout; match the app's SALES_PARTITIONING so the cache is not rebuilt")
+    parser.add_argument("--no-insights", action="store_true")
+    parser.add_argument("--no-router", action="store_true")
+    parser.add_argument("--no-llm-cache", action="store_true")
+    args = parser.parse_args()
+
+    items = read_questions(args.questions)
+    if not items:
+        sys.exit("No questions found.")
+    api_key = os.environ.get("GEMINI_API_KEY", "")
+    if not api_key:
+        print("GEMINI_API_KEY is not set; only routed questions will be answered.", file=sys.stderr)
+
+    t0 = time.perf_counter()
+    # Ingest / refresh once with a writable connection, then release the file for the workers.
+    SharedEngine(args.data_path, args.cache_dir, partition_by=args.partitioning).conn.close()
+    prepare_s = time.perf_counter() - t0
+
+    workers = max(1, min(args.workers, len(items)))
+    settings = {
+        "data_path": args.data_path,
+        "cache_dir": args.cache_dir,
+        "row_cap": args.row_cap,
+        "query_timeout": args.query_timeout,
+        # Workers split the cores instead of each starting one DuckDB thread per core.
+        "db_config": duckdb_config(args.memory_limit, max(1, (os.cpu_count() or 1) // workers)),
+        "llm_cache": not args.no_llm_cache,
+        "api_key": api_key,
+        "model": os.environ.get("MODEL_NAME", "gemini-2.0-flash"),
+        "base_url": os.environ.get("GEMINI_BASE_URL", DEFAULT_BASE_URL),
+        "schema_token_budget": int(os.environ.get("SCHEMA_TOKEN_BUDGET", 1200)),
+        "use_router": not args.no_router,
+        "insights": not args.no_insights,
+    }
+    if args.results_dir:
+        os.makedirs(args.results_dir, exist_ok=True)
+
+    rows = []
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_worker, initargs=(settings,)) as pool:
+        futures = {pool.submit(_answer, item, args.preview_rows, args.results_dir): item for item in items}
+        for done, future in enumerate(as_completed(futures), 1):
+            item = futures[future]
+            try:
+                rows.append(future.result())
+            except Exception as e:
+                rows.append({"id": item["id"], "question": item["question"], "error": f"{type(e).__name__}: {e}"})
+            print(f"[{done}/{len(items)}] {item['question'][:70]}", file=sys.stderr)
+
+    order = {item["id"]: i for i, item in enumerate(items)}
+    rows.sort(key=lambda r: order[r["id"]])
+    # Failed questions have fewer fields; every row gets every column.
+    keys = list(dict.fromkeys(k for row in rows for k in row))
+    rows = [{k: row.get(k) for k in keys} for row in rows]
+    write_rows(rows, args.out)
+    failed = sum(1 for r in rows if r.get("error"))
+    print(f"{len(rows)} questions in {time.perf_counter() - t0:.1f}s (prepare {prepare_s:.1f}s, "
+          f"{workers} workers, {failed} failed) → {args.out}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import duckdb
+
+import synthetic_olist
+from engine import SharedEngine
+from governor import fetch_arrow
+from pipeline import Pipeline
+from rollup import (DEMO_QUERIES, KPI_SQL, MONTHLY_REVENUE_SQL, TOP_CATEGORIES_SQL, dashboard_filter,
+                    filtered_dashboard_queries)
+from storage import PARTITION_COLUMNS, add_partition_filters, duckdb_config, load_data_into_duckdb
+
+# ---------------------------
+# Scale-factor benchmark
+# ---------------------------
+# For each scale factor: generate (or reuse) a synthetic Olist folder, then in
+# a fresh child process time a cold and a warm load_data_into_duckdb, the
+# SharedEngine start-up (rollup, precomputed answers, schema index), the
+# dashboard KPI queries, a filtered (one month x one state) dashboard, the
+# demo queries and a set of chat questions (through pipeline.Pipeline, as the
+# chat tab and batch.py answer them), and record the child's peak RSS.
+# Gemini is replaced by recorded replies (benchmark_responses.json) so runs
+# are reproducible and offline. Results are printed / written as JSON for
+# regression tracking.
+RESPONSES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_responses.json")
+
+
+class RecordedGemini:
+    """Stands in for GeminiClient: answers from a {question: raw reply} file."""
+
+    def __init__(self, path: str = RESPONSES):
+        with open(path, encoding="utf-8") as f:
+            self.responses = json.load(f)
+        self.calls = 0
+
+    @staticmethod
+    def question(prompt: str) -> str:
+        m = re.search(r"User question:\s*(.+?)\s*$", prompt, re.DOTALL)
+        return m.group(1) if m else prompt.strip()
+
+    def generate(self, prompt: str, temperature=None) -> str:
+        self.calls += 1
+        return self.responses.get(self.question(prompt), "Error: no recorded response")
+
+    def stream(self, prompt: str):
+        yield self.generate(prompt)
+
+
+def _median_ms(fn, repeat: int):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return round(statistics.median(samples), 2), result
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def _chat(pipeline: Pipeline, question: str, repeat: int) -> dict:
+    """One question through the headless chat pipeline, then its final SQL re-timed on a plain cursor."""
+    answer = pipeline.ask(question)
+    row = {"question": question, "path": answer["path"], "repair_rules": answer["repair_rules"],
+           **{f"{stage}_ms": round(ms, 2) for stage, ms in answer["timings"].items()}}
+    if answer["error"] is not None:
+        row["error"] = answer["error"].splitlines()[0]
+        return row
+    row["rows"] = answer["table"].num_rows
+    engine = pipeline.engine
+    cur = engine.cursor()
+    try:
+        sql = add_partition_filters(cur, answer["sql"]) if engine.partitioned else answer["sql"]
+        row["execute_ms"], _ = _median_ms(lambda: fetch_arrow(cur.execute(sql)), repeat)
+    finally:
+        cur.close()
+    return row
+
+
+def run_scale(data_path: str, repeat: int = 3, use_router: bool = True, db_settings=None,
+              partition_by=None) -> dict:
+    """Runs every measurement against one data folder. Meant to run in its own process."""
+    cache_dir = tempfile.mkdtemp(prefix="maer_bench_")
+    config = duckdb_config(cache_dir=cache_dir, **(db_settings or {}))
+    out = {"duckdb_config": config, "partitioning": partition_by}
+    try:
+        t0 = time.perf_counter()
+        conn = load_data_into_duckdb(data_path, cache_dir, config=config, partition_by=partition_by)
+        out["load_cold_s"] = round(time.perf_counter() - t0, 3)
+        out["rows"] = dict(conn.execute(
+            "SELECT table_name, estimated_size FROM duckdb_tables() WHERE schema_name = 'main' ORDER BY 1"
+        ).fetchall())
+        conn.close()
+
+        t0 = time.perf_counter()
+        load_data_into_duckdb(data_path, cache_dir, config=config, partition_by=partition_by).close()
+        out["load_warm_s"] = round(time.perf_counter() - t0, 3)
+
+        t0 = time.perf_counter()
+        engine = SharedEngine(data_path, cache_dir, db_config=config, partition_by=partition_by)
+        out["engine_init_s"] = round(time.perf_counter() - t0, 3)
+
+        cur = engine.cursor()
+        queries = {"kpis": KPI_SQL, "monthly_revenue": MONTHLY_REVENUE_SQL,
+                   "top_categories": TOP_CATEGORIES_SQL.format(limit=10)}
+        out["dashboard_ms"] = {name: _median_ms(lambda sql=sql: cur.execute(sql).fetchall(), repeat)[0]
+                               for name, sql in queries.items()}
+        out["demo_queries_ms"] = {label: _median_ms(lambda sql=sql: fetch_arrow(cur.execute(sql)), repeat)[0]
+                                  for label, sql in DEMO_QUERIES.items()}
+        # Filtered dashboard: latest month, one state, read from sales_enriched (partition pruning when partitioned).
+        latest = cur.execute("SELECT max_purchase_ts FROM sales_enriched_stats").fetchone()[0]
+        if latest is not None:
+            where = dashboard_filter(latest.date().replace(day=1), latest.date(), ["SP"])
+            prune = (lambda sql: add_partition_filters(cur, sql)) if engine.partitioned else (lambda sql: sql)
+            out["filtered_dashboard_ms"] = {
+                name: _median_ms(lambda sql=prune(sql): fetch_arrow(cur.execute(sql)), repeat)[0]
+                for name, sql in filtered_dashboard_queries(where).items()
+            }
+        cur.close()
+
+        gemini = RecordedGemini()
+        pipeline = Pipeline(engine, gemini, use_router=use_router, insights=False)
+        out["chat"] = [_chat(pipeline, q, repeat) for q in gemini.responses]
+        out["router_hit_rate"] = engine.router.stats.summary()["hit_rate"]
+        engine.conn.close()
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    out["peak_rss_mb"] = _peak_rss_mb()
+    return out
+
+
+def _child(results, data_path, repeat, use_router, db_settings, partition_by):
+    try:
+        results.put(run_scale(data_path, repeat, use_router, db_settings, partition_by))
+    except Exception as e:
+        results.put({"error": f"{type(e).__name__}: {e}"})
+
+
+def _wait_for_result(proc, results, poll_s: float = 1.0) -> dict:
+    """The child's report, or an error once it has died without sending one (crash, OOM kill)."""
+    while True:
+        try:
+            return results.get(timeout=poll_s)
+        except queue.Empty:
+            if not proc.is_alive():
+                # One last look: the report may have landed just before the exit.
+                try:
+                    return results.get(timeout=poll_s)
+                except queue.Empty:
+                    return {"error": f"child exited with code {proc.exitcode}"}
+
+
+def ensure_dataset(data_dir: str, scale: float, seed: int):
+    """Generates the scale's folder unless an identical one (same scale + seed) exists. Returns (path, seconds)."""
+    path = os.path.join(data_dir, f"scale_{scale:g}_seed_{seed}")
+    marker = os.path.join(path, ".synthetic.json")
+    if os.path.exists(marker):
+        return path, 0.0
+    shutil.rmtree(path, ignore_errors=True)
+    t0 = time.perf_counter()
+    rows = synthetic_olist.generate(path, scale, seed)
+    with open(marker, "w") as f:
+        json.dump({"scale": scale, "seed": seed, "rows": rows}, f)
+    return path, round(time.perf_counter() - t0, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MAER.AI at several data scale factors.")
+    parser.add_argument("--scales", type=float, nargs="+", default=[1, 10])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per query; the median is reported")
+    parser.add_argument("--data-dir", default="bench_data")
+    parser.add_argument("--no-router", action="store_true", help="send every chat question through the stub LLM")
+    parser.add_argument("--memory-limit", help='DuckDB memory_limit, e.g. "1GB"')
+    parser.add_argument("--threads", type=int)
+    parser.add_argument("--out-of-core", action="store_true", help="spill to disk past the memory limit")
+    parser.add_argument("--partitioning", choices=sorted(PARTITION_COLUMNS),
+                        help="store sales_enriched as Hive-partitioned Parquet")
+    parser.add_argument("--out", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+    db_settings = {"memory_limit": args.memory_limit, "threads": args.threads, "out_of_core": args.out_of_core}
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "duckdb": duckdb.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "results": [],
+    }
+    ctx = multiprocessing.get_context("spawn")
+    for scale in args.scales:
+        path, generate_s = ensure_dataset(args.data_dir, scale, args.seed)
+        print(f"scale {scale:g}: running…", file=sys.stderr)
+        results = ctx.Queue()
+        proc = ctx.Process(target=_child, args=(results, path, args.repeat, not args.no_router, db_settings,
+                                                args.partitioning))
+        proc.start()
+        result = _wait_for_result(proc, results)
+        proc.join()
+        report["results"].append({"scale": scale, "generate_s": generate_s, **result})
+
+    text = json.dumps(report, indent=2, default=str)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import threading
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, wait
+
+# ---------------------------
+# Multi-candidate SQL generation
+# ---------------------------
+# K prompts go out concurrently (candidate 0 at a low temperature, the others
+# progressively warmer so they differ). Each worker validates its own
+# candidate with EXPLAIN as soon as the text arrives, and the first one that
+# binds wins. Queued candidates are cancelled; in-flight HTTP calls finish in
+# the background but skip validation. Tail latency is therefore the fastest
+# good candidate, not generation + LLM fix + second execution.
+
+
+def candidate_temperature(index: int) -> float:
+    return 0.2 if index == 0 else round(0.5 + 0.2 * index, 2)
+
+
+class CandidateStats:
+    def __init__(self):
+        self.wins = Counter()
+        self.rounds = 0
+        self.no_valid = 0
+        self._lock = threading.Lock()
+
+    def record(self, winner):
+        with self._lock:
+            self.rounds += 1
+            if winner is None:
+                self.no_valid += 1
+            else:
+                self.wins[winner] += 1
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "rounds": self.rounds,
+                "no_valid_candidate": self.no_valid,
+                "win_share": {i: n / self.rounds for i, n in sorted(self.wins.items())} if self.rounds else {},
+            }
+
+
+def first_valid_candidate(generate, validate, k: int, pool):
+    """
+    generate(index) -> raw LLM text; validate(raw) -> (sql, rules, error).
+    Returns (index, raw, sql, rules, error) for the first candidate whose error
+    is None. If none validates, returns candidate 0's attempt (error set) and
+    index None.
+    """
+    stop = threading.Event()
+
+    def task(i):
+        raw = generate(i)
+        if stop.is_set():
+            return i, raw, None, [], "cancelled"
+        return (i, raw) + tuple(validate(raw))
+
+    pending = {pool.submit(task, i) for i in range(max(1, k))}
+    attempts = {}
+    try:
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                try:
+                    i, raw, sql, rules, error = fut.result()
+                except Exception:
+                    continue
+                attempts[i] = (i, raw, sql, rules, error)
+                if error is None:
+                    return attempts[i]
+    finally:
+        stop.set()
+        for fut in pending:
+            fut.cancel()
+    fallback = attempts.get(0) or next(iter(attempts.values()), (0, "", None, [], "No candidate returned"))
+    return (None,) + fallback[1:]
@@ -0,0 +1,115 @@
+import re
+
+from schema_index import estimate_tokens
+
+# ---------------------------
+# Conversation memory
+# ---------------------------
+# Each chat turn is kept as a structured record (question, final SQL, result
+# shape, first sentence of the insight) rather than raw text. The most recent
+# turns are rendered in full, newest SQL verbatim so follow-ups like "now by
+# state" can edit it. When the rendered memory exceeds the token budget the
+# oldest turn is folded into the running summary as a one-line digest; the
+# summary is only ever appended to (and trimmed from the front), never
+# regenerated.
+_TABLES = re.compile(r"\b(?:FROM|JOIN)\s+([A-Za-z_][\w.]*)", re.IGNORECASE)
+
+
+def _first_sentence(text: str, limit: int = 200) -> str:
+    text = " ".join((text or "").split())
+    m = re.search(r"(?<=[.!?])\s", text)
+    text = text[:m.start()] if m else text
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+def _shape(turn: dict) -> str:
+    if turn.get("rows") is None:
+        return "no result"
+    rows = f"{turn['rows']:,}{'+' if turn.get('truncated') else ''} rows"
+    return f"{rows} × ({', '.join(turn['columns'])})"
+
+
+class ConversationMemory:
+    def __init__(self, token_budget: int = 600):
+        self.token_budget = token_budget
+        self.summary = []
+        self.turns = []
+        self.count = 0
+
+    def begin_turn(self, question: str):
+        self.count += 1
+        self.turns.append({"n": self.count, "question": question.strip(), "sql": None,
+                           "rows": None, "columns": [], "truncated": False, "insight": None})
+        self._compress()
+
+    def _current(self):
+        return self.turns[-1] if self.turns else None
+
+    def record_sql(self, sql: str):
+        if self._current() is not None:
+            self._current()["sql"] = sql.strip()
+            self._compress()
+
+    def record_result(self, table, truncated: bool = False):
+        turn = self._current()
+        if turn is not None:
+            turn["rows"] = table.num_rows
+            turn["columns"] = [f"{f.name} {f.type}" for f in table.schema]
+            turn["truncated"] = truncated
+            self._compress()
+
+    def record_insight(self, text: str):
+        if self._current() is not None:
+            self._current()["insight"] = _first_sentence(text)
+            self._compress()
+
+    # ---------------------------
+    # Rendering + compression
+    # ---------------------------
+    @staticmethod
+    def _digest(turn: dict) -> str:
+        tables = sorted({t.lower() for t in _TABLES.findall(turn["sql"] or "")})
+        source = f" via {', '.join(tables)}" if tables else ""
+        return f"- Q{turn['n']} \"{_first_sentence(turn['question'], 120)}\"{source} → {_shape(turn)}"
+
+    @staticmethod
+    def _full(turn: dict) -> str:
+        lines = [f"[Q{turn['n']}] User: {turn['question']}"]
+        if turn["sql"]:
+            lines.append("SQL:\n" + turn["sql"])
+        lines.append(f"Result: {_shape(turn)}")
+        if turn["insight"]:
+            lines.append(f"Insight: {turn['insight']}")
+        return "\n".join(lines)
+
+    def _trim_summary(self):
+        # The summary gets at most a third of the budget; the oldest digests go first.
+        while self.summary and sum(estimate_tokens(s) for s in self.summary) > self.token_budget // 3:
+            self.summary.pop(0)
+
+    def _compress(self):
+        # Summary and full turns share the budget, so the whole rendered memory stays within it.
+        while len(self.turns) > 1 and self._tokens() > self.token_budget:
+            self.summary.append(self._digest(self.turns.pop(0)))
+            self._trim_summary()
+        # A single long turn keeps its SQL verbatim; the digests give way instead.
+        while self.summary and self._tokens() > self.token_budget:
+            self.summary.pop(0)
+
+    def _tokens(self) -> int:
+        text = self.render()
+        return estimate_tokens(text) if text else 0
+
+    def render(self, include_current: bool = True) -> str:
+        turns = self.turns if include_current else self.turns[:-1]
+        parts = []
+        if self.summary:
+            parts.append("Earlier turns:\n" + "\n".join(self.summary))
+        if turns:
+            parts.append("Recent turns (the last SQL is the one follow-ups refer to):\n"
+                         + "\n\n".join(self._full(t) for t in turns))
+        return "\n\n".join(parts)
+
+    def stats(self) -> dict:
+        return {"turns": self.count, "full_turns": len(self.turns),
+                "summarized": len(self.summary), "tokens": self._tokens()}
@@ -0,0 +1,181 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import duckdb
+
+from candidates import CandidateStats
+from exports import copy_query_to_file
+from governor import cap_rows, ensure_read_only, explain_analyze_sql, parse_profile, run_governed
+from result_cache import ResultCache, canonicalize_sql, is_cacheable
+from rollup import build_sales_rollup, precompute_answers
+from router import IntentRouter
+from schema_index import build_schema_index, literal_values, load_schema_index, schema_version
+from sql_repair import RepairStats, schema_names
+from storage import (CACHE_DIR, META_SCHEMA, add_partition_filters, cache_db_path, dataset_version,
+                     load_data_into_duckdb)
+from tracing import span
+
+# ---------------------------
+# Shared engine
+# ---------------------------
+# One DuckDB database per dataset path is shared by every session in the
+# process. Sessions get their own cursor (a lightweight connection to the same
+# database), so their queries run concurrently on DuckDB's thread pool. A FIFO
+# gate caps how many queries run at once; the rest wait their turn.
+
+
+class QueryGate:
+    def __init__(self, limit: int = 4):
+        self.limit = max(1, int(limit))
+        self.running = 0
+        self._queue = deque()
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def slot(self, timeout=None):
+        ticket = object()
+        with self._cond:
+            self._queue.append(ticket)
+            admitted = self._cond.wait_for(
+                lambda: self._queue[0] is ticket and self.running < self.limit, timeout
+            )
+            if not admitted:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+                raise TimeoutError(f"Query waited more than {timeout}s for a free slot")
+            self._queue.popleft()
+            self.running += 1
+            self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.running -= 1
+                self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"running": self.running, "queued": len(self._queue), "limit": self.limit}
+
+
+class SharedEngine:
+    def __init__(self, data_path: str, cache_dir: str = CACHE_DIR, materialize: bool = True,
+                 max_concurrent_queries: int = 4, queue_timeout=None,
+                 result_cache_bytes: int = 256 * 1024 * 1024, query_timeout=None,
+                 row_cap: int = 10000, memory_limit=None, router_min_confidence: float = 0.75,
+                 db_config=None, read_only: bool = False, partition_by=None):
+        self.data_path = data_path
+        # Settings are per database, i.e. shared by every session's cursor.
+        config = dict(db_config or {})
+        if memory_limit:
+            config.setdefault("memory_limit", str(memory_limit))
+        if read_only:
+            # Batch workers: another process has already built everything, and any
+            # number of processes may share the file read-only. Nothing is (re)built.
+            self.conn = duckdb.connect(cache_db_path(data_path, cache_dir), read_only=True, config=config)
+            self.answers = {}
+        else:
+            self.conn = load_data_into_duckdb(data_path, cache_dir, materialize, config, partition_by)
+            build_sales_rollup(self.conn)
+            self.answers = precompute_answers(self.conn)
+        self.version = dataset_version(self.conn)
+        self.results = ResultCache(result_cache_bytes)
+        self.schema_names = schema_names(self.conn)
+        # Hive-partitioned sales_enriched (also seen by read-only workers, whatever partition_by says).
+        self.partitioned = "purchase_year" in self.schema_names[1]
+        self.schema_index = load_schema_index(self.conn) if read_only else build_schema_index(self.conn)
+        self.schema_version = schema_version(self.schema_index)
+        self.literal_values = literal_values(self.schema_index)
+        self.repairs = RepairStats()
+        self.candidates = CandidateStats()
+        self.router = IntentRouter(self.conn, router_min_confidence)
+        self.gate = QueryGate(max_concurrent_queries)
+        self.queue_timeout = queue_timeout
+        self.query_timeout = query_timeout
+        self.row_cap = row_cap
+
+    def cursor(self):
+        return self.conn.cursor()
+
+    def query_arrow(self, cursor, sql: str, on_tick=None, max_rows=None):
+        with span("query") as attrs:
+            ensure_read_only(sql)
+            canonical = canonicalize_sql(sql)
+            if max_rows is not None:
+                canonical += f"\x00max_rows={int(max_rows)}"
+            # Keyed by the database's current version, not self.version: after a reload an
+            # older engine's sessions read the new data through the same database.
+            version = self._results_version(cursor) if is_cacheable(canonical) else None
+            cacheable = version is not None
+            if cacheable:
+                table = self.results.get(version, canonical)
+                if table is not None:
+                    attrs.update(cached=True, rows=table.num_rows)
+                    return table
+            if self.partitioned:
+                pruned = add_partition_filters(cursor, sql)
+                attrs["partition_filters"] = pruned != sql
+                sql = pruned
+            t0 = time.perf_counter()
+            with self.gate.slot(self.queue_timeout):
+                attrs["queued_ms"] = round((time.perf_counter() - t0) * 1000, 3)
+                table = run_governed(cursor, sql, self.query_timeout, on_tick, max_rows=max_rows)
+            if cacheable:
+                self.results.put(version, canonical, table)
+            attrs.update(cached=False, rows=table.num_rows)
+            return table
+
+    @staticmethod
+    def _results_version(cursor):
+        """dataset_version, or None while a reload is still rebuilding (the schema index is built last)."""
+        version = dataset_version(cursor)
+        row = cursor.execute(
+            f"SELECT source_version FROM {META_SCHEMA}.derived_state WHERE name = 'schema_index'"
+        ).fetchone()
+        return version if row is not None and row[0] == version else None
+
+    def query_df(self, cursor, sql: str, on_tick=None):
+        return self.query_arrow(cursor, sql, on_tick).to_pandas()
+
+    def run_interactive(self, cursor, sql: str, on_tick=None):
+        """Row-capped query for on-screen views. Returns (arrow table, truncated)."""
+        # LIMIT lets DuckDB stop early; streaming bounds memory for statements LIMIT cannot wrap.
+        max_rows = self.row_cap + 1 if self.row_cap else None
+        table = self.query_arrow(cursor, cap_rows(sql, self.row_cap), on_tick, max_rows)
+        if self.row_cap and table.num_rows > self.row_cap:
+            return table.slice(0, self.row_cap), True
+        return table, False
+
+    def explain_analyze(self, cursor, sql: str):
+        """
+        Runs sql under EXPLAIN ANALYZE (governed, never cached). Returns
+        (summary, operators) from the JSON profile, or (None, plan_text) on a
+        DuckDB without FORMAT JSON support.
+        """
+        ensure_read_only(sql)
+        if self.partitioned:
+            sql = add_partition_filters(cursor, sql)
+        with span("explain_analyze", sql_chars=len(sql)), self.gate.slot(self.queue_timeout):
+            try:
+                table = run_governed(cursor, explain_analyze_sql(sql), self.query_timeout)
+                return parse_profile(table.column(table.num_columns - 1)[0].as_py())
+            except duckdb.ParserException:
+                table = run_governed(cursor, explain_analyze_sql(sql, "text"), self.query_timeout)
+                return None, table.column(table.num_columns - 1)[0].as_py()
+
+    def export(self, sql: str, fmt: str, export_dir=None) -> str:
+        """
+        Re-runs sql with a governed COPY ... TO on its own cursor (safe to call
+        from a download thread). Returns the temp file path; the caller removes it.
+        """
+        ensure_read_only(sql)
+        cursor = self.cursor()
+        try:
+            if self.partitioned:
+                sql = add_partition_filters(cursor, sql)
+            with span("export", fmt=fmt), self.gate.slot(self.queue_timeout):
+                return copy_query_to_file(cursor, sql, fmt, export_dir, self.query_timeout)
+        finally:
+            cursor.close()
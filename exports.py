@@ -0,0 +1,32 @@
+import os
+import tempfile
+
+from governor import run_governed
+from storage import quote_literal
+
+# ---------------------------
+# Exports
+# ---------------------------
+# Downloads re-run the SQL through DuckDB's COPY ... TO, which streams the
+# result straight into a temp file (optionally compressed) without building a
+# DataFrame or a CSV string first. The COPY is governed like any other query;
+# the caller reads the file once and removes it.
+EXPORT_FORMATS = {
+    "CSV": (".csv", "text/csv", "FORMAT CSV, HEADER"),
+    "CSV (gzip)": (".csv.gz", "application/gzip", "FORMAT CSV, HEADER, COMPRESSION gzip"),
+    "CSV (zstd)": (".csv.zst", "application/zstd", "FORMAT CSV, HEADER, COMPRESSION zstd"),
+    "Parquet": (".parquet", "application/vnd.apache.parquet", "FORMAT PARQUET, COMPRESSION zstd"),
+}
+
+
+def copy_query_to_file(cursor, sql: str, fmt: str, export_dir=None, timeout=None) -> str:
+    suffix, _, options = EXPORT_FORMATS[fmt]
+    fd, path = tempfile.mkstemp(prefix="maer_export_", suffix=suffix, dir=export_dir)
+    os.close(fd)
+    body = sql.strip().rstrip(";").rstrip()
+    try:
+        run_governed(cursor, f"COPY (\n{body}\n) TO {quote_literal(path)} ({options})", timeout)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
@@ -0,0 +1,162 @@
+import json
+import random
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# ---------------------------
+# Gemini client
+# ---------------------------
+# One pooled requests.Session (keep-alive) shared by every call. Rate limits
+# (429) and server errors (5xx) are retried a bounded number of times with
+# full-jitter exponential backoff, honouring Retry-After when the server sends
+# one. stream() uses streamGenerateContent (SSE) and yields text as it arrives.
+# Failures are returned as "Error: ..." text, like the rest of the app expects;
+# a stream that breaks after text was yielded raises StreamInterrupted instead,
+# since the caller already holds a partial reply.
+DEFAULT_BASE_URL = "https://generativelanguage.googleapis.com"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class StreamInterrupted(requests.RequestException):
+    """The connection failed part-way through a streamed reply."""
+
+
+class GeminiClient:
+    def __init__(self, api_key: str, model: str, base_url: str = DEFAULT_BASE_URL, cache=None,
+                 max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 8.0,
+                 connect_timeout: float = 5.0, read_timeout: float = 60.0, pool_size: int = 8):
+        self.api_key = api_key
+        self.model = model
+        self.base_url = base_url.rstrip("/")
+        self.cache = cache
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _url(self, method: str) -> str:
+        url = f"{self.base_url}/v1beta/models/{self.model}:{method}?key={self.api_key}"
+        return url + "&alt=sse" if method == "streamGenerateContent" else url
+
+    def _sleep_before_retry(self, attempt: int, res=None):
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if res is not None and res.headers.get("Retry-After", "").isdigit():
+            delay = min(self.backoff_max, float(res.headers["Retry-After"]))
+        time.sleep(delay)
+
+    def _post(self, method: str, payload: dict, stream: bool = False):
+        """POST with bounded retries. Returns the final response, or raises the last network error."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                res = self.session.post(self._url(method), json=payload, timeout=self.timeout, stream=stream)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                self._sleep_before_retry(attempt)
+                continue
+            if res.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                return res
+            res.close()
+            self._sleep_before_retry(attempt, res)
+
+    @staticmethod
+    def _payload(prompt: str, temperature=None) -> dict:
+        payload = {"contents": [{"parts": [{"text": prompt}]}]}
+        if temperature is not None:
+            payload["generationConfig"] = {"temperature": temperature}
+        return payload
+
+    def _cache_model(self, temperature) -> str:
+        return self.model if temperature is None else f"{self.model}@t={temperature}"
+
+    @staticmethod
+    def _text(body: dict) -> str:
+        parts = body["candidates"][0]["content"].get("parts", [])
+        return "".join(p.get("text", "") for p in parts)
+
+    def generate(self, prompt: str, temperature=None) -> str:
+        if self.cache is not None:
+            hit = self.cache.get(self._cache_model(temperature), prompt)
+            if hit is not None:
+                return hit
+        if not self.api_key:
+            return "Error: Missing GEMINI_API_KEY"
+        try:
+            res = self._post("generateContent", self._payload(prompt, temperature))
+        except requests.RequestException as e:
+            return f"Error: {e}"[:400]
+        try:
+            text = self._text(res.json())
+        except Exception:
+            return "Error: " + str(res.text)[:400]
+        if self.cache is not None:
+            self.cache.put(self._cache_model(temperature), prompt, text)
+        return text
+
+    def stream(self, prompt: str):
+        """
+        Yields text chunks as Gemini produces them. If the caller stops early
+        once the SQL statement is complete the connection is closed and what
+        was received so far is cached. Partial replies are never cached.
+        """
+        if self.cache is not None:
+            hit = self.cache.get(self.model, prompt)
+            if hit is not None:
+                yield hit
+                return
+        if not self.api_key:
+            yield "Error: Missing GEMINI_API_KEY"
+            return
+        try:
+            res = self._post("streamGenerateContent", self._payload(prompt), stream=True)
+        except requests.RequestException as e:
+            yield f"Error: {e}"[:400]
+            return
+        if res.status_code != 200:
+            yield "Error: " + str(res.text)[:400]
+            return
+
+        received, completed, failed = [], False, False
+        try:
+            for line in res.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                try:
+                    chunk = self._text(json.loads(line[5:]))
+                except Exception:
+                    continue
+                if chunk:
+                    received.append(chunk)
+                    yield chunk
+            completed = True
+        except requests.RequestException as e:
+            failed = True
+            if not received:
+                yield f"Error: {e}"[:400]
+                return
+            raise StreamInterrupted(f"Gemini stream interrupted after {sum(map(len, received))} characters: {e}") from e
+        finally:
+            res.close()
+            text = "".join(received)
+            if text and self.cache is not None and not failed and (completed or sql_statement_complete(text)):
+                self.cache.put(self.model, prompt, text)
+
+
+def sql_statement_complete(text: str) -> bool:
+    """True once the streamed text holds a SQL statement terminated by ';'."""
+    started = False
+    for line in text.splitlines():
+        stripped = line.strip().lower().lstrip("`")
+        if not stripped or stripped.startswith("#"):
+            continue
+        if stripped.startswith(("select", "with")):
+            started = True
+        if started and stripped.rstrip("`").endswith(";"):
+            return True
+    return False
@@ -0,0 +1,178 @@
+import json
+import logging
+import re
+import threading
+import time
+
+import duckdb
+import pyarrow as pa
+
+import tracing
+
+# ---------------------------
+# Query governor
+# ---------------------------
+# Every user-facing query runs on a worker thread while the caller polls it.
+# That keeps three escape hatches open: a wall-clock timeout that calls
+# DuckDB's interrupt(), cancellation when the caller goes away (a Streamlit
+# rerun raised from on_tick, e.g. the Cancel button), and a row cap for
+# interactive views. Killed queries are logged with their SQL. Sessions share
+# one database file, so user and LLM SQL must be a single read-only SELECT.
+log = logging.getLogger("maer.governor")
+
+_SELECT_LIKE = re.compile(r"^\s*(select|with|from)\b", re.IGNORECASE)
+
+
+class QueryKilled(Exception):
+    def __init__(self, reason: str, elapsed: float, sql: str):
+        super().__init__(f"Query {reason} after {elapsed:.1f}s")
+        self.reason = reason
+        self.elapsed = elapsed
+        self.sql = sql
+
+
+def ensure_read_only(sql: str):
+    """Raises duckdb.PermissionException unless sql is one SELECT (WITH, FROM-first, DESCRIBE, SHOW, ...)."""
+    statements = duckdb.extract_statements(sql)
+    if len(statements) != 1 or statements[0].type != duckdb.StatementType.SELECT:
+        kinds = ", ".join(s.type.name for s in statements) or "no statement"
+        raise duckdb.PermissionException(
+            f"Only a single read-only SELECT can run on the shared dataset (got {kinds})."
+        )
+
+
+def fetch_arrow(result):
+    """Arrow table from a DuckDB result (to_arrow_table on newer DuckDB, fetch_arrow_table before)."""
+    fetch = getattr(result, "to_arrow_table", None) or result.fetch_arrow_table
+    return fetch()
+
+
+def fetch_arrow_capped(result, max_rows: int, batch_rows: int = 65536):
+    """
+    Streams record batches and stops after max_rows, so a result far larger
+    than memory is never materialized (DuckDB produces the rest lazily, if at all).
+    """
+    reader = (getattr(result, "to_arrow_reader", None) or result.fetch_record_batch)(batch_rows)
+    batches, rows = [], 0
+    for batch in reader:
+        batches.append(batch)
+        rows += batch.num_rows
+        if rows >= max_rows:
+            break
+    return pa.Table.from_batches(batches, schema=reader.schema).slice(0, max_rows)
+
+
+def cap_rows(sql: str, max_rows: int) -> str:
+    """Wraps a SELECT so at most max_rows + 1 rows come back (the extra row flags truncation)."""
+    if not max_rows or not _SELECT_LIKE.match(sql):
+        return sql
+    body = sql.strip().rstrip(";").rstrip()
+    return f"SELECT * FROM (\n{body}\n) AS capped LIMIT {int(max_rows) + 1}"
+
+
+def page_sql(sql: str, limit: int, offset: int) -> str:
+    """Offset pagination straight from DuckDB for pages past the in-memory window."""
+    body = sql.strip().rstrip(";").rstrip()
+    return f"SELECT * FROM (\n{body}\n) AS paged LIMIT {int(limit)} OFFSET {int(offset)}"
+
+
+def run_governed(cursor, sql: str, timeout=None, on_tick=None, poll_interval: float = 0.1, max_rows=None):
+    """Runs sql on a worker thread under the timeout; with max_rows only that many rows are fetched."""
+    box = {}
+
+    def work():
+        try:
+            t0 = time.perf_counter()
+            result = cursor.execute(sql)
+            box["execute_s"] = time.perf_counter() - t0
+            box["table"] = fetch_arrow(result) if max_rows is None else fetch_arrow_capped(result, max_rows)
+            box["fetch_s"] = time.perf_counter() - t0 - box["execute_s"]
+        except BaseException as e:
+            box["error"] = e
+
+    worker = threading.Thread(target=work, name="maer-query", daemon=True)
+    t0 = time.perf_counter()
+    worker.start()
+    try:
+        while worker.is_alive():
+            worker.join(poll_interval)
+            elapsed = time.perf_counter() - t0
+            if not worker.is_alive():
+                break
+            if timeout and elapsed > timeout:
+                cursor.interrupt()
+                worker.join()
+                log.warning("Query timed out after %.1fs (limit %ss):\n%s", elapsed, timeout, sql)
+                raise QueryKilled("timed out", elapsed, sql)
+            if on_tick is not None:
+                on_tick(elapsed)
+    finally:
+        if worker.is_alive():
+            # The caller stopped waiting (cancel button / rerun) — don't leave the query running.
+            cursor.interrupt()
+            worker.join(5)
+            log.warning("Query cancelled after %.1fs:\n%s", time.perf_counter() - t0, sql)
+
+    # Spans are recorded here, on the caller's thread, so they join the caller's trace.
+    if "execute_s" in box:
+        tracing.record("execute", box["execute_s"], sql_chars=len(sql))
+    if "error" in box:
+        raise box["error"]
+    tracing.record("fetch", box["fetch_s"], rows=box["table"].num_rows, bytes=box["table"].nbytes)
+    return box["table"]
+
+
+# ---------------------------
+# Query profiles
+# ---------------------------
+def explain_analyze_sql(sql: str, fmt: str = "json") -> str:
+    body = sql.strip().rstrip(";").rstrip()
+    return f"EXPLAIN (ANALYZE, FORMAT {fmt})\n{body}" if fmt != "text" else f"EXPLAIN ANALYZE\n{body}"
+
+
+def _extra_info(info) -> str:
+    if not isinstance(info, dict):
+        return str(info or "")
+    parts = []
+    for key, value in info.items():
+        value = ", ".join(map(str, value)) if isinstance(value, list) else str(value)
+        parts.append(f"{key}: {value}")
+    text = " | ".join(parts)
+    return text if len(text) <= 120 else text[:119] + "…"
+
+
+def parse_profile(plan_json: str):
+    """
+    Flattens DuckDB's JSON profile into (summary, operators), operators listed
+    top-down with their depth, own time, output rows and rows scanned.
+    """
+    plan = json.loads(plan_json)
+    operators = []
+
+    def walk(node, depth):
+        name = node.get("operator_name") or node.get("operator_type")
+        if name == "EXPLAIN_ANALYZE":
+            depth -= 1
+        else:
+            operators.append({
+                "operator": "· " * depth + str(name).strip(),
+                "time_ms": round(float(node.get("operator_timing") or 0) * 1000, 3),
+                "rows": node.get("operator_cardinality"),
+                "rows_scanned": node.get("operator_rows_scanned"),
+                "details": _extra_info(node.get("extra_info")),
+            })
+        for child in node.get("children", []):
+            walk(child, depth + 1)
+
+    for child in plan.get("children", []):
+        walk(child, 0)
+    total = sum(op["time_ms"] for op in operators) or 1.0
+    for op in operators:
+        op["share"] = op["time_ms"] / total
+    summary = {
+        "latency_ms": round(float(plan.get("latency") or 0) * 1000, 3),
+        "cpu_ms": round(float(plan.get("cpu_time") or 0) * 1000, 3),
+        "peak_buffer_mb": round((plan.get("system_peak_buffer_memory") or 0) / 1e6, 2),
+        "rows_scanned": plan.get("cumulative_rows_scanned"),
+    }
+    return summary, operators
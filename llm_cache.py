@@ -0,0 +1,104 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+# ---------------------------
+# LLM response cache
+# ---------------------------
+# Gemini answers are stored on disk keyed by model name + sha256(prompt), so a
+# byte-identical prompt (same question, schema and memory, or the same fix
+# prompt for the same error) skips the network entirely. Entries expire after
+# ttl_seconds and the least recently used ones are evicted once the stored
+# responses exceed max_bytes.
+
+
+class ResponseCache:
+    def __init__(self, path: str, ttl_seconds: float = 7 * 24 * 3600, max_bytes: int = 50 * 1024 * 1024):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT,
+                size INTEGER,
+                created_at REAL,
+                last_access REAL,
+                hit_count INTEGER DEFAULT 0
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses(last_access)")
+
+    @staticmethod
+    def key(model: str, prompt: str) -> str:
+        return hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def get(self, model: str, prompt: str):
+        k, now = self.key(model, prompt), time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", [k]
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self._db.execute("DELETE FROM responses WHERE key = ?", [k])
+                self.misses += 1
+                return None
+            self._db.execute(
+                "UPDATE responses SET last_access = ?, hit_count = hit_count + 1 WHERE key = ?", [now, k]
+            )
+            self.hits += 1
+            return row[0]
+
+    def put(self, model: str, prompt: str, response: str):
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [self.key(model, prompt), model, response, size, now, now],
+            )
+            self._evict(now)
+
+    def _evict(self, now: float):
+        self._db.execute("DELETE FROM responses WHERE created_at < ?", [now - self.ttl_seconds])
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute(
+            "SELECT key, size FROM responses ORDER BY last_access"
+        ).fetchall():
+            self._db.execute("DELETE FROM responses WHERE key = ?", [key])
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
@@ -0,0 +1,290 @@
+import re
+import time
+
+import duckdb
+
+from governor import QueryKilled
+from router import FOLLOW_UP
+from schema_index import retrieve_schema
+from sql_repair import MAX_TS, repair_sql
+from tracing import span, traced
+
+# ---------------------------
+# Headless NL → SQL → result pipeline
+# ---------------------------
+# Prompt builders, SQL cleanup and one-question orchestration with no
+# Streamlit dependency: the chat tab uses the helpers, and the batch runner
+# (batch.py) drives Pipeline.ask over a file of questions. Pipeline.ask
+# follows the chat path — local router, Gemini SQL, local repair, governed
+# execution, one LLM fix on failure, Executive Insight — and reports
+# per-stage timings.
+
+
+def build_sql_prompt(user_query: str, schema_text: str, reasoning_context: str) -> str:
+    return f"""
+You are MAER.AI, a senior data analyst for an ecommerce platform using DuckDB.
+
+IMPORTANT DATE RULES (strict):
+- The Olist dataset contains historical timestamps (2016–2018).
+- NEVER use CURRENT_DATE, NOW(), TODAY(), or system time.
+- The latest order timestamp is precomputed in sales_enriched_stats.max_purchase_ts.
+- ALL date comparisons MUST be relative to:
+    (SELECT max_purchase_ts FROM sales_enriched_stats)
+
+Examples you MUST follow:
+- "last month" →
+    order_purchase_timestamp >= DATE_TRUNC('month', (SELECT max_purchase_ts FROM sales_enriched_stats)) - INTERVAL 1 MONTH
+    AND order_purchase_timestamp < DATE_TRUNC('month', (SELECT max_purchase_ts FROM sales_enriched_stats))
+
+- "this month" →
+    order_purchase_timestamp >= DATE_TRUNC('month', (SELECT max_purchase_ts FROM sales_enriched_stats))
+
+- "last 3 months" →
+    order_purchase_timestamp >= 
+    (SELECT max_purchase_ts FROM sales_enriched_stats) - INTERVAL 3 MONTH
+
+- "last week" →
+    order_purchase_timestamp >=
+    (SELECT max_purchase_ts FROM sales_enriched_stats) - INTERVAL 7 DAY
+
+- NEVER assume today's real date.
+
+DATA NOTES:
+- sales_enriched has exactly one row per order item.
+- payment_value is the item's share of its order's payment, so SUM(payment_value) is the amount paid.
+- payment_type is the order's main payment method; full detail is in order_payments_summary
+  and olist_order_payments_dataset.
+
+PERFORMANCE RULES:
+- sales_rollup is pre-aggregated by month ('YYYY-MM'), category, customer_state and payment_type
+  with item_count, revenue, freight, payment_value, review_sum and review_count.
+  Prefer it whenever the question only needs those dimensions and measures
+  (average review = SUM(review_sum)/SUM(review_count)).
+- Use sales_enriched only when a question needs finer grain (individual orders, products, cities, days).
+- Compare order_purchase_timestamp directly (no functions around the column) so date filters can skip data.
+
+Now, as usual:
+First, provide reasoning in 3–5 lines prefixed with '#'.
+Then output ONLY the final valid DuckDB SQL query.
+
+Schema:
+{schema_text}
+
+Conversation memory (for a follow-up such as "now by state", adapt the last SQL):
+{reasoning_context}
+
+User question:
+{user_query}
+"""
+
+
+def build_fix_prompt(schema_text: str, sql: str, error: str) -> str:
+    return f"""
+Fix this SQL for DuckDB.
+
+Schema:
+{schema_text}
+
+Original SQL:
+{sql}
+
+Error:
+{error}
+
+Return ONLY valid SQL.
+"""
+
+
+def build_insight_prompt(memory_text: str, preview: str) -> str:
+    return f"""
+You are a senior business analyst.
+Summarize this table into 2–3 actionable insights considering previous chat memory:
+{memory_text}
+
+Table:
+{preview}
+"""
+
+
+def table_preview(table, rows: int = 10) -> str:
+    head = table.slice(0, rows).to_pandas()
+    try:
+        return head.to_markdown(index=False)
+    except Exception:  # tabulate not installed
+        return head.to_string(index=False)
+
+
+# Lines starting with one of these are kept as SQL; everything else is prose.
+SQL_LINE_STARTS = (
+    "select", "with", "from", "where", "group by",
+    "order by", "having", "join", "left join",
+    "right join", "inner join", "limit"
+)
+FALLBACK_SQL = "SELECT * FROM sales_enriched LIMIT 20;"
+
+
+def _sql_lines(sql: str) -> list:
+    # Markdown fences and reasoning lines (# ...) are dropped.
+    cleaned = sql.replace("```sql", "").replace("```", "").replace("`", "").strip()
+    return [line for line in cleaned.splitlines()
+            if not line.strip().startswith("#") and line.strip().lower().startswith(SQL_LINE_STARTS)]
+
+
+@traced("normalize_sql")
+def normalize_sql(sql: str) -> str:
+    """
+    Cleans Gemini output by:
+    - removing reasoning lines (# ...)
+    - removing markdown code fences
+    - preserving all valid SQL clauses
+    - fixing incomplete SQL by falling back safely
+    """
+    if not sql:
+        return "SELECT 'Error: Empty SQL from model' AS message;"
+
+    extracted_lines = _sql_lines(sql)
+
+    # If nothing was captured, fallback to safe default
+    if not extracted_lines:
+        return FALLBACK_SQL
+
+    # Reconstruct SQL
+    final_sql = "\n".join(extracted_lines).strip()
+
+    # Ensure the query ends with a semicolon
+    if not final_sql.endswith(";"):
+        final_sql += ";"
+
+    return final_sql
+
+
+def is_sql_reply(raw: str) -> bool:
+    """True when raw is a model answer with a SQL statement in it, not an error or something normalize_sql replaces."""
+    return bool(raw) and not raw.lstrip().startswith("Error") and bool(_sql_lines(raw))
+
+
+MAX_TS_SUBQUERY = re.compile(
+    r"\(\s*SELECT\s+(?:MAX\s*\(\s*order_purchase_timestamp\s*\)\s+FROM\s+sales_enriched"
+    r"|max_purchase_ts\s+FROM\s+sales_enriched_stats)\s*\)",
+    re.IGNORECASE,
+)
+
+
+def inline_max_purchase_ts(sql: str, conn) -> str:
+    """
+    Replaces the "latest order" subquery with a TIMESTAMP literal so date filters
+    fold to constants and get pushed into the sales_enriched scan (row-group pruning).
+    """
+    if not MAX_TS_SUBQUERY.search(sql):
+        return sql
+    max_ts = conn.execute("SELECT max_purchase_ts FROM sales_enriched_stats").fetchone()[0]
+    if max_ts is None:
+        return sql
+    return MAX_TS_SUBQUERY.sub(f"TIMESTAMP '{max_ts}'", sql)
+
+
+def portable_sql(sql: str, conn) -> str:
+    """Undoes inline_max_purchase_ts so stored SQL stays correct after new data arrives."""
+    max_ts = conn.execute("SELECT max_purchase_ts FROM sales_enriched_stats").fetchone()[0]
+    return sql if max_ts is None else sql.replace(f"TIMESTAMP '{max_ts}'", MAX_TS)
+
+
+class Pipeline:
+    def __init__(self, engine, gemini, schema_token_budget: int = 1200, use_router: bool = True,
+                 insights: bool = True):
+        self.engine = engine
+        self.gemini = gemini
+        self.schema_token_budget = schema_token_budget
+        self.use_router = use_router
+        self.insights = insights
+
+    def _generate(self, prompt: str) -> str:
+        with span("ask_gemini", prompt_chars=len(prompt)) as attrs:
+            text = self.gemini.generate(prompt)
+            attrs["response_chars"] = len(text)
+            return text
+
+    def ask(self, question: str, memory_text: str = "(none yet)") -> dict:
+        """
+        Answers one question. Returns {question, path, sql, repair_rules, table,
+        truncated, error, insight, timings}; table is None when nothing ran.
+        Follow-up questions are not routed: there is no previous turn here
+        beyond memory_text.
+        """
+        out = {"question": question, "path": None, "sql": None, "repair_rules": [], "table": None,
+               "truncated": False, "error": None, "insight": None, "timings": {}}
+        timings = out["timings"]
+        turn_start = time.perf_counter()
+        cur = self.engine.cursor()
+
+        def lap(stage, t0):
+            timings[stage] = (time.perf_counter() - t0) * 1000
+
+        try:
+            with span("pipeline_question", question_chars=len(question)) as attrs:
+                schema_text = retrieve_schema(self.engine.schema_index, question, self.schema_token_budget)
+                route = None
+                if self.use_router and not FOLLOW_UP.search(question):
+                    t0 = time.perf_counter()
+                    route = self.engine.router.route(question)
+                    lap("routing", t0)
+                preflight_error = None
+                if route is not None:
+                    out["path"], sql = "router", route["sql"]
+                else:
+                    out["path"] = "llm"
+                    t0 = time.perf_counter()
+                    raw = self._generate(build_sql_prompt(question, schema_text, memory_text))
+                    lap("sql_generation", t0)
+                    if not is_sql_reply(raw):
+                        out["error"] = raw if raw.startswith("Error") else "Model reply has no SQL statement"
+                        return out
+                    t0 = time.perf_counter()
+                    sql = inline_max_purchase_ts(normalize_sql(raw), cur)
+                    checked, out["repair_rules"], preflight_error = repair_sql(cur, sql, raw, self.engine.schema_names)
+                    if out["repair_rules"]:
+                        sql = inline_max_purchase_ts(checked, cur)
+                    lap("local_validation", t0)
+
+                t0 = time.perf_counter()
+                try:
+                    if preflight_error:
+                        raise RuntimeError(preflight_error)
+                    table, truncated = self.engine.run_interactive(cur, sql)
+                    self.engine.repairs.record("repaired" if out["repair_rules"] else "valid", out["repair_rules"])
+                except (duckdb.Error, RuntimeError) as e:
+                    lap("sql_execution", t0)
+                    # One LLM correction round, as in the chat tab.
+                    self.engine.repairs.record("llm_fallback", out["repair_rules"])
+                    t0 = time.perf_counter()
+                    fix = self._generate(build_fix_prompt(schema_text, sql, str(e)))
+                    lap("llm_fix", t0)
+                    if not is_sql_reply(fix):
+                        out["sql"], out["error"] = sql, str(e)
+                        return out
+                    sql = inline_max_purchase_ts(normalize_sql(fix), cur)
+                    t0 = time.perf_counter()
+                    try:
+                        table, truncated = self.engine.run_interactive(cur, sql)
+                    except (duckdb.Error, QueryKilled) as e2:
+                        out["sql"], out["error"] = sql, str(e2)
+                        return out
+                except QueryKilled as e:
+                    out["sql"], out["error"] = sql, str(e)
+                    return out
+                lap("sql_execution", t0)
+                out.update(sql=sql, table=table, truncated=truncated)
+                attrs.update(path=out["path"], rows=table.num_rows)
+
+                if self.insights and table.num_rows:
+                    t0 = time.perf_counter()
+                    with span("insight") as insight_attrs:
+                        insight = self.gemini.generate(build_insight_prompt(memory_text, table_preview(table)))
+                        insight_attrs["response_chars"] = len(insight)
+                    lap("insight_generation", t0)
+                    if not insight.startswith("Error"):
+                        out["insight"] = insight
+                return out
+        finally:
+            cur.close()
+            timings["total"] = (time.perf_counter() - turn_start) * 1000
@@ -0,0 +1,93 @@
+import re
+import threading
+from collections import OrderedDict
+
+# ---------------------------
+# SQL result cache
+# ---------------------------
+# Results are kept as Arrow tables keyed by (dataset version, canonical SQL).
+# Canonicalisation ignores whitespace, keyword/identifier case and trailing
+# semicolons but leaves quoted literals (including $$dollar-quoted$$ strings)
+# untouched, so the sidebar demos, the
+# SQL Lab default query and word-for-word regenerated chat SQL all share one
+# entry. Entries are evicted least-recently-used once max_bytes is exceeded,
+# and a new dataset version drops everything cached for the old one.
+_TOKENS = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|(\$\w*\$)[\s\S]*?\1|--[^\n]*|\s+|[^'\"$\s-]+|[-$]")
+_VOLATILE = re.compile(r"\b(random|uuid|gen_random_uuid|now|current_date|current_time|current_timestamp|today)\b")
+
+
+def canonicalize_sql(sql: str) -> str:
+    out = []
+    for match in _TOKENS.finditer(sql or ""):
+        tok = match.group()
+        if tok.startswith(("'", '"')) or match.group(1):
+            out.append(tok)
+        elif tok.startswith("--"):
+            continue
+        elif tok.isspace():
+            if out and out[-1] != " ":
+                out.append(" ")
+        else:
+            out.append(tok.lower())
+    text = "".join(out).strip()
+    while text.endswith(";"):
+        text = text[:-1].rstrip()
+    return text
+
+
+def is_cacheable(canonical_sql: str) -> bool:
+    """Only read-only, deterministic statements are worth caching."""
+    return canonical_sql.startswith(("select", "with", "from")) and not _VOLATILE.search(canonical_sql)
+
+
+class ResultCache:
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.version = None
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _switch_version(self, version: str):
+        if version != self.version:
+            self._entries.clear()
+            self.bytes = 0
+            self.version = version
+
+    def get(self, version: str, canonical_sql: str):
+        with self._lock:
+            self._switch_version(version)
+            table = self._entries.get(canonical_sql)
+            if table is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(canonical_sql)
+            self.hits += 1
+            return table
+
+    def put(self, version: str, canonical_sql: str, table):
+        size = table.nbytes
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._switch_version(version)
+            old = self._entries.pop(canonical_sql, None)
+            if old is not None:
+                self.bytes -= old.nbytes
+            self._entries[canonical_sql] = table
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "entries": len(self._entries), "bytes": self.bytes}
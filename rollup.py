@@ -0,0 +1,200 @@
+from storage import (DELTA_ORDERS, SALES_ENRICHED_SQL, dataset_version, delta_applies, ensure_derived_state,
+                     is_fresh, mark_built, quote_literal, relation_exists)
+from tracing import span
+
+# ---------------------------
+# Rollup cube
+# ---------------------------
+# sales_rollup pre-aggregates sales_enriched at month x category x state x
+# payment_type. Sums and counts roll up by plain SUM; distinct counts are kept
+# as KMV sketches (the K smallest 64-bit hashes per cell), which merge by
+# union + truncate and are exact below K distinct values.
+SKETCH_K = 4096
+
+
+def rollup_sql(where: str = "") -> str:
+    """The cube query; where (a full WHERE line) limits it to some months of sales_enriched."""
+    return f"""
+    SELECT strftime(order_purchase_timestamp,'%Y-%m') AS month,
+           category, customer_state, payment_type,
+           COUNT(*) AS item_count,
+           SUM(price) AS revenue,
+           SUM(freight_value) AS freight,
+           SUM(payment_value) AS payment_value,
+           SUM(review_score) AS review_sum,
+           COUNT(review_score) AS review_count,
+           list_sort(list_distinct(list(hash(order_id))))[1:{SKETCH_K}] AS order_sketch,
+           list_sort(list_distinct(list(hash(customer_city))))[1:{SKETCH_K}] AS city_sketch
+    FROM sales_enriched
+{where}    GROUP BY ALL
+"""
+
+
+ROLLUP_SQL = rollup_sql()
+# Months (as in sales_rollup.month) of the orders in the pending delta.
+DELTA_MONTHS_SQL = f"""
+    SELECT DISTINCT strftime(order_purchase_timestamp,'%Y-%m') AS month
+    FROM olist_orders_dataset WHERE order_id IN ({DELTA_ORDERS})
+"""
+
+
+def _month_filter(months: list) -> tuple:
+    """(WHERE line for sales_enriched, predicate on sales_rollup.month) covering months; None is the NULL month."""
+    ranges = [f"order_purchase_timestamp >= TIMESTAMP '{m}-01' "
+              f"AND order_purchase_timestamp < TIMESTAMP '{m}-01' + INTERVAL 1 MONTH"
+              for m in months if m is not None]
+    listed = ", ".join(f"'{m}'" for m in months if m is not None)
+    source = [f"({r})" for r in ranges]
+    target = [f"month IN ({listed})"] if listed else []
+    if None in months:
+        source.append("order_purchase_timestamp IS NULL")
+        target.append("month IS NULL")
+    return f"    WHERE {' OR '.join(source)}\n", " OR ".join(target)
+
+
+def build_sales_rollup(conn):
+    version = dataset_version(conn)
+    definition = SALES_ENRICHED_SQL + ROLLUP_SQL
+    ensure_derived_state(conn)
+    # kmv_distinct(sketch) merges the sketches of a group and estimates its distinct count.
+    conn.execute(f"""
+        CREATE OR REPLACE MACRO kmv_estimate(s) AS
+            CASE WHEN len(s) < {SKETCH_K} THEN len(s)
+                 ELSE ({SKETCH_K} - 1) / (CAST(s[{SKETCH_K}] AS DOUBLE) / 18446744073709551616.0)
+            END
+    """)
+    conn.execute(f"""
+        CREATE OR REPLACE MACRO kmv_distinct(s) AS
+            kmv_estimate(list_sort(list_distinct(flatten(list(s))))[1:{SKETCH_K}])
+    """)
+    # derived_state alone is not enough: the table itself may have been dropped.
+    exists = relation_exists(conn, "sales_rollup")
+    if exists and is_fresh(conn, "sales_rollup", version, definition):
+        return
+    if exists and delta_applies(conn, "sales_rollup", definition):
+        # Only the months the appended orders fall in are re-aggregated.
+        months = [r[0] for r in conn.execute(DELTA_MONTHS_SQL).fetchall()]
+        if months:
+            where, target = _month_filter(months)
+            conn.execute(f"DELETE FROM sales_rollup WHERE {target}")
+            conn.execute(f"INSERT INTO sales_rollup {rollup_sql(where)} ORDER BY month")
+    else:
+        conn.execute(f"CREATE OR REPLACE TABLE sales_rollup AS {ROLLUP_SQL} ORDER BY month")
+    mark_built(conn, "sales_rollup", version, definition)
+
+
+# ---------------------------
+# Dashboard + demo queries (served from the cube)
+# ---------------------------
+KPI_SQL = """
+    SELECT kmv_distinct(order_sketch) AS total_orders,
+           SUM(payment_value) AS total_revenue,
+           kmv_distinct(city_sketch) AS unique_customers,
+           SUM(review_sum) / SUM(review_count) AS avg_rating
+    FROM sales_rollup
+"""
+
+MONTHLY_REVENUE_SQL = """
+    SELECT month, SUM(revenue) AS revenue
+    FROM sales_rollup WHERE month IS NOT NULL GROUP BY month ORDER BY month
+"""
+
+TOP_CATEGORIES_SQL = """
+    SELECT COALESCE(category,'unknown') AS category, SUM(revenue) AS total_sales
+    FROM sales_rollup GROUP BY 1 ORDER BY total_sales DESC LIMIT {limit}
+"""
+
+DEMO_QUERIES = {
+    "Top 5 categories by total sales":
+        "SELECT category,SUM(revenue) AS total_sales FROM sales_rollup GROUP BY category ORDER BY total_sales DESC LIMIT 5",
+    "Monthly revenue trend":
+        "SELECT month,SUM(revenue) AS revenue FROM sales_rollup WHERE month IS NOT NULL GROUP BY month ORDER BY month",
+    "Best states by average review score":
+        "SELECT customer_state,SUM(review_sum)/SUM(review_count) AS avg_score FROM sales_rollup GROUP BY customer_state HAVING SUM(item_count)>50 ORDER BY avg_score DESC LIMIT 10",
+    "Payment methods share":
+        "SELECT payment_type,SUM(payment_value) AS total_value FROM sales_rollup GROUP BY payment_type ORDER BY total_value DESC",
+}
+
+
+# The headline counts are shown as exact numbers, so the precomputed answer
+# replaces the sketch estimates with one sales_enriched scan per dataset version.
+EXACT_DISTINCT_SQL = """
+    SELECT COUNT(DISTINCT order_id) AS total_orders, COUNT(DISTINCT customer_city) AS unique_customers
+    FROM sales_enriched
+"""
+
+
+def kpi_df(conn):
+    return conn.execute(KPI_SQL).fetchdf()
+
+
+def exact_kpi_df(conn):
+    kpis = kpi_df(conn)
+    kpis["total_orders"], kpis["unique_customers"] = conn.execute(EXACT_DISTINCT_SQL).fetchone()
+    return kpis
+
+
+def monthly_revenue_df(conn):
+    return conn.execute(MONTHLY_REVENUE_SQL).fetchdf()
+
+
+def top_categories_df(conn, limit=10):
+    return conn.execute(TOP_CATEGORIES_SQL.format(limit=int(limit))).fetchdf()
+
+
+# ---------------------------
+# Filtered dashboard (served from sales_enriched)
+# ---------------------------
+# With a date range or states picked, the dashboard numbers are computed from
+# sales_enriched instead of the cube. The bounds are constants on
+# order_purchase_timestamp / customer_state, so the scan skips row groups of
+# the time-sorted table, or whole partitions of the partitioned layout.
+FILTERED_KPI_SQL = """
+    SELECT COUNT(DISTINCT order_id) AS total_orders,
+           SUM(payment_value) AS total_revenue,
+           COUNT(DISTINCT customer_city) AS unique_customers,
+           AVG(review_score) AS avg_rating
+    FROM sales_enriched {where}
+"""
+
+FILTERED_MONTHLY_REVENUE_SQL = """
+    SELECT strftime(order_purchase_timestamp,'%Y-%m') AS month, SUM(price) AS revenue
+    FROM sales_enriched {where} GROUP BY month HAVING month IS NOT NULL ORDER BY month
+"""
+
+FILTERED_TOP_CATEGORIES_SQL = """
+    SELECT COALESCE(category,'unknown') AS category, SUM(price) AS total_sales
+    FROM sales_enriched {where} GROUP BY 1 ORDER BY total_sales DESC LIMIT {limit}
+"""
+
+
+def dashboard_filter(start=None, end=None, states=()) -> str:
+    """WHERE clause for purchases from start to end (dates, both inclusive) in states."""
+    conditions = []
+    if start is not None:
+        conditions.append(f"order_purchase_timestamp >= TIMESTAMP '{start}'")
+    if end is not None:
+        conditions.append(f"order_purchase_timestamp < TIMESTAMP '{end}' + INTERVAL 1 DAY")
+    if states:
+        conditions.append(f"customer_state IN ({', '.join(quote_literal(s) for s in states)})")
+    return "WHERE " + " AND ".join(conditions) if conditions else ""
+
+
+def filtered_dashboard_queries(where: str, limit: int = 10) -> dict:
+    return {
+        "kpis": FILTERED_KPI_SQL.format(where=where),
+        "monthly_revenue": FILTERED_MONTHLY_REVENUE_SQL.format(where=where),
+        "top_categories": FILTERED_TOP_CATEGORIES_SQL.format(where=where, limit=int(limit)),
+    }
+
+
+def precompute_answers(conn) -> dict:
+    """Runs every dashboard / demo query once so renders are a dict lookup."""
+    answers = {}
+    queries = [("kpis", exact_kpi_df), ("monthly_revenue", monthly_revenue_df), ("top_categories", top_categories_df)]
+    queries += [(label, lambda c, sql=sql: c.execute(sql).fetchdf()) for label, sql in DEMO_QUERIES.items()]
+    for name, run in queries:
+        with span("dashboard_query", query=name) as attrs:
+            answers[name] = run(conn)
+            attrs["rows"] = len(answers[name])
+    return answers
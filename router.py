@@ -0,0 +1,276 @@
+import math
+import re
+import threading
+from collections import Counter
+from datetime import datetime
+
+from storage import quote_literal
+
+# ---------------------------
+# Local intent router
+# ---------------------------
+# Most chat traffic is a variation of the sidebar demos: top-N categories,
+# the monthly trend, states by review score, payment share. The router
+# recognises "<metric> by <dimension>" questions with an optional N, sort
+# direction, time window and state filter, and fills a vetted template on
+# sales_rollup (the month-level cube of sales_enriched) — no Gemini round trip.
+# Order counts do not add up across cube cells (one order spans categories),
+# and the cube's sketches only estimate them, so they are counted exactly on
+# sales_enriched.
+# Anything it does not fully understand (other dimensions, day-level windows,
+# ratios, comparisons) is left to the LLM.
+DIMENSIONS = {
+    "category": r"\bcategor(?:y|ies)\b",
+    "customer_state": r"\bstates?\b|\bregions?\b",
+    "payment_type": r"\bpayment (?:methods?|types?)\b|\bpay(?:ment)?s? (?:by|with)\b|\bmethods? of payment\b",
+    "month": r"\bmonth(?:ly|s)?\b|\btrend\b|\bover time\b",
+}
+METRICS = {
+    "revenue": (r"\brevenue\b|\bsales\b|\bgmv\b", "SUM(revenue)"),
+    "orders": (r"\borders\b|\bnumber of orders\b|\border count\b", "COUNT(DISTINCT order_id)"),
+    "items": (r"\bitems\b|\bunits\b", "SUM(item_count)"),
+    "avg_review": (r"\breviews?\b|\bratings?\b|\bscores?\b|\bsatisfaction\b",
+                   "SUM(review_sum) / NULLIF(SUM(review_count), 0)"),
+    "payment_value": (r"\bpaid\b|\bpayment value\b|\bamount\b|\bshare\b", "SUM(payment_value)"),
+    "freight": (r"\bfreight\b|\bshipping\b", "SUM(freight)"),
+}
+DEFAULT_METRIC = {"payment_type": "payment_value"}
+# Words that mean the question needs something the templates do not offer.
+UNSUPPORTED = re.compile(
+    r"\b(city|cities|product|products|seller|sellers|customer|customers|deliver\w*|late|delay\w*|"
+    r"per order|average order|aov|compare|compared|versus|vs|growth|change|ratio|percent\w*|"
+    r"why|days?|weeks?|yesterday|today|between|and|or|except|excluding|without|"
+    r"installments?|status|cancel\w*|zip|photos?)\b",
+    re.IGNORECASE,
+)
+# Follow-ups depend on the previous turn, which only the LLM sees.
+FOLLOW_UP = re.compile(r"\b(now|same|instead|those|these|that|them|it|also|what about|how about)\b", re.IGNORECASE)
+NUMBER_WORDS = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7,
+                "eight": 8, "nine": 9, "ten": 10, "twenty": 20}
+_N = r"(\d+|" + "|".join(NUMBER_WORDS) + r")"
+
+
+def _number(text: str) -> int:
+    return int(text) if text.isdigit() else NUMBER_WORDS[text]
+
+
+def _shift_month(ts: datetime, months: int) -> str:
+    index = ts.year * 12 + ts.month - 1 + months
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+class RouterStats:
+    def __init__(self):
+        self.routed = Counter()
+        self.misses = 0
+        self.agree = 0
+        self.disagree = 0
+        self.shadow_errors = 0
+        self._lock = threading.Lock()
+
+    def record_route(self, intent):
+        with self._lock:
+            if intent is None:
+                self.misses += 1
+            else:
+                self.routed[intent] += 1
+
+    def record_check(self, outcome: str):
+        with self._lock:
+            if outcome == "agree":
+                self.agree += 1
+            elif outcome == "disagree":
+                self.disagree += 1
+            else:
+                self.shadow_errors += 1
+
+    def summary(self) -> dict:
+        with self._lock:
+            hits = sum(self.routed.values())
+            checked = self.agree + self.disagree
+            return {
+                "routed": hits,
+                "llm": self.misses,
+                "hit_rate": hits / (hits + self.misses) if hits + self.misses else 0.0,
+                "checked": checked,
+                "accuracy": self.agree / checked if checked else None,
+                "shadow_errors": self.shadow_errors,
+                "intents": dict(self.routed),
+            }
+
+
+class IntentRouter:
+    def __init__(self, conn, min_confidence: float = 0.75):
+        self.min_confidence = min_confidence
+        self.stats = RouterStats()
+        self.states = {r[0] for r in conn.execute(
+            "SELECT DISTINCT customer_state FROM sales_rollup WHERE customer_state IS NOT NULL").fetchall()}
+        self.max_ts = conn.execute("SELECT max_purchase_ts FROM sales_enriched_stats").fetchone()[0]
+
+    # ---------------------------
+    # Parameter extraction
+    # ---------------------------
+    def _window(self, q: str):
+        """Returns ((first_month, last_month or None), label), None when there is no window, or False when it is not month-level."""
+        if self.max_ts is None:
+            return None
+        m = re.search(rf"\b(?:last|past|previous) {_N} months?\b", q)
+        if m:
+            # Month granularity: the latest N calendar months, the latest (partial) one included.
+            start = _shift_month(self.max_ts, 1 - _number(m.group(1)))
+            return (start, None), f"since {start}"
+        if re.search(r"\b(?:last|previous) month\b", q):
+            month = _shift_month(self.max_ts, -1)
+            return (month, month), month
+        if re.search(r"\bthis month\b", q):
+            month = _shift_month(self.max_ts, 0)
+            return (month, month), month
+        m = re.search(rf"\b(?:last|past|previous) {_N} years?\b", q)
+        if m:
+            start = _shift_month(self.max_ts, 1 - 12 * _number(m.group(1)))
+            return (start, None), f"since {start}"
+        year = None
+        if re.search(r"\bthis year\b", q):
+            year = self.max_ts.year
+        elif re.search(r"\b(?:last|previous) year\b", q):
+            year = self.max_ts.year - 1
+        else:
+            m = re.search(r"\b(?:in|during|for) (20\d\d)\b", q)
+            year = int(m.group(1)) if m else None
+        if year:
+            return (f"{year}-01", f"{year}-12"), str(year)
+        if re.search(r"\b(?:last|past|this|previous|since|recent\w*)\b", q):
+            return False
+        return None
+
+    def _state(self, question: str):
+        found = {s for s in re.findall(r"\b([A-Z]{2})\b", question) if s in self.states}
+        found |= {s.upper() for s in re.findall(r"\b(?:in|from|for) ([a-z]{2})\b", question.lower())
+                  if s.upper() in self.states}
+        return found.pop() if len(found) == 1 else (False if found else None)
+
+    def _unparsed_filter(self, q: str) -> bool:
+        # "in Sao Paulo", "for electronics": a filter the templates would silently drop.
+        for word in re.findall(r"\b(?:in|from|for|during|of|with|at) (?:the )?(\w+)", q):
+            if not (word.upper() in self.states or re.fullmatch(r"20\d\d", word)
+                    or word in ("last", "past", "previous", "this", "each", "every", "all", "total", "terms")
+                    or any(re.fullmatch(p, word) for p in DIMENSIONS.values())
+                    or any(re.fullmatch(p, word) for p, _ in METRICS.values())):
+                return True
+        return False
+
+    def parse(self, question: str):
+        q = " ".join(question.lower().split())
+        if UNSUPPORTED.search(q) or FOLLOW_UP.search(q) or self._unparsed_filter(q):
+            return None
+        # "last 3 months" is a window, not a breakdown by month.
+        undated = re.sub(rf"\b(?:last|past|previous|this) (?:{_N} )?(?:months?|years?)\b", " ", q)
+        dims = [d for d, pattern in DIMENSIONS.items() if re.search(pattern, undated)]
+        state = self._state(question)
+        if state:
+            # "... in SP" is a filter, not a breakdown by state.
+            dims = [d for d in dims if d != "customer_state"] if len(dims) > 1 else dims
+        metrics = [m for m, (pattern, _) in METRICS.items() if re.search(pattern, q)]
+        if "payment_value" in metrics and len(metrics) > 1:
+            metrics.remove("payment_value")  # "share of revenue", "amount of orders"
+        if len(dims) != 1 or len(metrics) > 1 or state is False:
+            return None
+        window = self._window(q)
+        if window is False:
+            return None
+
+        dimension = dims[0]
+        metric = metrics[0] if metrics else DEFAULT_METRIC.get(dimension, "revenue")
+        confidence = 0.9 if metrics else 0.8
+        m = re.search(rf"\b(?:top|best|worst|bottom|lowest|highest|first) {_N}\b|\b{_N} (?:best|worst|top|biggest|largest|smallest)\b", q)
+        limit = _number(m.group(1) or m.group(2)) if m else None
+        ascending = bool(re.search(r"\b(?:worst|lowest|bottom|least|smallest|fewest)\b", q))
+        if dimension == "month":
+            if limit or ascending:
+                return None
+            order = "month"
+        else:
+            order = f"value {'ASC' if ascending else 'DESC'}"
+            limit = limit or (10 if dimension != "payment_type" else None)
+        return {
+            "dimension": dimension, "metric": metric, "limit": limit, "ascending": ascending,
+            "window": window[1] if window else None, "state": state or None,
+            "_months": window[0] if window else (None, None), "_order": order, "confidence": confidence,
+        }
+
+    # ---------------------------
+    # Templates
+    # ---------------------------
+    @staticmethod
+    def _conditions(params: dict) -> list:
+        dimension, (start, end) = params["dimension"], params["_months"]
+        if params["metric"] == "orders":
+            ts = "order_purchase_timestamp"
+            where = [f"{ts if dimension == 'month' else dimension} IS NOT NULL"]
+            where += [f"{ts} >= TIMESTAMP '{start}-01'"] if start else []
+            where += [f"{ts} < TIMESTAMP '{end}-01' + INTERVAL 1 MONTH"] if end else []
+        else:
+            where = [f"{dimension} IS NOT NULL"]
+            if start == end and start:
+                where.append(f"month = {quote_literal(start)}")
+            elif start and end:
+                where.append(f"month BETWEEN {quote_literal(start)} AND {quote_literal(end)}")
+            elif start:
+                where.append(f"month >= {quote_literal(start)}")
+        if params["state"]:
+            where.append(f"customer_state = {quote_literal(params['state'])}")
+        return where
+
+    @classmethod
+    def render(cls, params: dict) -> str:
+        dimension, expr = params["dimension"], METRICS[params["metric"]][1]
+        where = cls._conditions(params)
+        if params["metric"] == "avg_review" and dimension != "month":
+            having = "\nHAVING SUM(item_count) > 50"
+        else:
+            having = ""
+        if params["metric"] == "orders":
+            source = "sales_enriched"
+            column = "strftime(order_purchase_timestamp,'%Y-%m') AS month" if dimension == "month" else dimension
+        else:
+            source, column = "sales_rollup", dimension
+        sql = (f"SELECT {column}, {expr} AS {params['metric']}\n"
+               f"FROM {source}\n"
+               f"WHERE {' AND '.join(where)}\n"
+               f"GROUP BY {dimension}{having}\n"
+               f"ORDER BY {params['_order'].replace('value', params['metric'])}")
+        if params["limit"]:
+            sql += f"\nLIMIT {int(params['limit'])}"
+        return sql + ";"
+
+    def route(self, question: str):
+        """A routed answer {intent, params, sql, confidence}, or None to use the LLM."""
+        params = self.parse(question)
+        if params is None or params["confidence"] < self.min_confidence:
+            self.stats.record_route(None)
+            return None
+        intent = f"{params['metric']}_by_{params['dimension']}"
+        self.stats.record_route(intent)
+        public = {k: v for k, v in params.items() if not k.startswith("_") and v not in (None, False)}
+        return {"intent": intent, "params": public, "sql": self.render(params), "confidence": params["confidence"]}
+
+
+def results_agree(a, b, rel_tol: float = 0.01) -> bool:
+    """Shadow check: same rows, numbers within rel_tol, ignoring column names and row order."""
+    if a.num_rows != b.num_rows or a.num_columns != b.num_columns:
+        return False
+
+    def rows(table):
+        out = []
+        for row in zip(*(col.to_pylist() for col in table.columns)):
+            out.append(tuple(round(v, 6) if isinstance(v, float) else v for v in row))
+        return sorted(out, key=repr)
+
+    for ra, rb in zip(rows(a), rows(b)):
+        for va, vb in zip(ra, rb):
+            if isinstance(va, (int, float)) and isinstance(vb, (int, float)):
+                if not math.isclose(va, vb, rel_tol=rel_tol, abs_tol=1e-6):
+                    return False
+            elif va != vb:
+                return False
+    return True
@@ -0,0 +1,286 @@
+import hashlib
+import json
+import re
+
+from storage import (META_SCHEMA, dataset_version, delta_applies, ensure_derived_state, is_fresh, mark_built,
+                     quote_ident, relation_exists)
+
+# ---------------------------
+# Schema index + retriever
+# ---------------------------
+# Built once per dataset version and stored in maer.schema_index: every column
+# of every table with its type, approximate distinct count, a few top values
+# (low-cardinality text columns only), every value of the categorical columns
+# (states, statuses, payment types, categories) and a one-line description. For each
+# question the retriever scores columns against the question's words and
+# renders only the relevant tables/columns, best first, until the token
+# budget is spent. Nothing is truncated silently: a column either makes it in
+# or loses to a more relevant one.
+INDEX_VERSION = "2"
+TOP_VALUES_MAX_DISTINCT = 50
+TOP_VALUES = 5
+LITERAL_COLUMNS = {"customer_state", "seller_state", "order_status", "payment_type", "category",
+                   "product_category_name", "product_category_name_english"}
+LITERAL_VALUES_MAX_DISTINCT = 500
+PREFERRED_TABLES = {"sales_rollup": 3.0, "sales_enriched": 2.5, "sales_enriched_stats": 1.0}
+
+DESCRIPTIONS = {
+    "order_id": "order identifier",
+    "order_item_id": "item number within the order",
+    "customer_id": "customer key of one order",
+    "customer_unique_id": "person behind one or more customer_ids",
+    "customer_city": "customer city",
+    "customer_state": "customer state (2-letter code)",
+    "customer_zip_code_prefix": "customer zip code prefix",
+    "seller_id": "seller identifier",
+    "seller_city": "seller city",
+    "seller_state": "seller state (2-letter code)",
+    "product_id": "product identifier",
+    "product_category_name": "product category (Portuguese)",
+    "product_category_name_english": "product category (English)",
+    "category": "product category",
+    "price": "item price, i.e. revenue per item",
+    "freight_value": "shipping cost per item",
+    "freight": "summed shipping cost",
+    "revenue": "summed item price (sales)",
+    "item_count": "number of items sold",
+    "payment_type": "payment method",
+    "payment_value": "amount paid",
+    "payment_installments": "number of installments",
+    "payment_sequential": "payment sequence within the order",
+    "payment_count": "number of payments for the order",
+    "review_score": "review rating 1-5",
+    "review_sum": "summed review score (divide by review_count)",
+    "review_count": "number of reviews",
+    "order_status": "order status",
+    "order_purchase_timestamp": "purchase date/time",
+    "order_approved_at": "payment approval time",
+    "order_delivered_carrier_date": "handed to carrier",
+    "order_delivered_customer_date": "delivered to customer",
+    "order_estimated_delivery_date": "promised delivery date",
+    "shipping_limit_date": "seller shipping deadline",
+    "month": "month as 'YYYY-MM'",
+    "purchase_year": "purchase year (partition key)",
+    "purchase_month": "purchase month 1-12 (partition key)",
+    "order_sketch": "order_id sketch; use kmv_distinct(order_sketch) for distinct orders",
+    "city_sketch": "city sketch; use kmv_distinct(city_sketch) for distinct cities",
+    "max_purchase_ts": "latest purchase timestamp (\"now\" for this dataset)",
+    "min_purchase_ts": "earliest purchase timestamp",
+    "geolocation_lat": "latitude",
+    "geolocation_lng": "longitude",
+}
+
+SYNONYMS = {
+    "sales": ["revenue", "price"],
+    "revenue": ["price", "payment_value"],
+    "gmv": ["price", "revenue"],
+    "money": ["payment_value", "price"],
+    "spend": ["payment_value"],
+    "rating": ["review_score"],
+    "satisfaction": ["review_score"],
+    "stars": ["review_score"],
+    "shipping": ["freight_value", "freight"],
+    "delivery": ["order_delivered_customer_date", "order_estimated_delivery_date"],
+    "late": ["order_delivered_customer_date", "order_estimated_delivery_date"],
+    "region": ["customer_state"],
+    "where": ["customer_state", "customer_city"],
+    "when": ["order_purchase_timestamp", "month"],
+    "trend": ["month", "order_purchase_timestamp"],
+    "monthly": ["month"],
+    "month": ["order_purchase_timestamp"],
+    "week": ["order_purchase_timestamp"],
+    "year": ["order_purchase_timestamp", "month"],
+    "day": ["order_purchase_timestamp"],
+    "customers": ["customer_unique_id"],
+    "repeat": ["customer_unique_id"],
+    "installments": ["payment_installments"],
+    "method": ["payment_type"],
+}
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _words(text: str) -> set:
+    words = set()
+    for w in _WORD.findall((text or "").lower()):
+        words.add(w)
+        if len(w) > 4 and w.endswith("ies"):
+            words.add(w[:-3] + "y")
+        elif len(w) > 3 and w.endswith("s"):
+            words.add(w[:-1])
+    return words
+
+
+def _describe(name: str) -> str:
+    return DESCRIPTIONS.get(name, name.replace("_", " "))
+
+
+def _literal_values(conn, table: str, column: str, column_type: str, approx_unique) -> list:
+    if column not in LITERAL_COLUMNS or column_type != "VARCHAR" or not approx_unique \
+            or approx_unique > LITERAL_VALUES_MAX_DISTINCT:
+        return []
+    return [r[0] for r in conn.execute(
+        f"SELECT DISTINCT {quote_ident(column)} FROM {quote_ident(table)} "
+        f"WHERE {quote_ident(column)} IS NOT NULL ORDER BY 1"
+    ).fetchall()]
+
+
+def build_schema_index(conn):
+    """(Re)builds maer.schema_index when the dataset changed; returns the index as a list of tables."""
+    version = dataset_version(conn)
+    ensure_derived_state(conn)
+    exists = relation_exists(conn, "schema_index", META_SCHEMA)
+    if exists and is_fresh(conn, "schema_index", version, INDEX_VERSION):
+        return load_schema_index(conn)
+    if exists and delta_applies(conn, "schema_index", INDEX_VERSION):
+        # Appended rows: refresh the row counts and literal values. Distinct counts and
+        # top values are estimates for prompts and are recomputed on the next rebuild.
+        for (table,) in conn.execute(f"SELECT DISTINCT table_name FROM {META_SCHEMA}.schema_index").fetchall():
+            count = conn.execute(f"SELECT COUNT(*) FROM {quote_ident(table)}").fetchone()[0]
+            conn.execute(f"UPDATE {META_SCHEMA}.schema_index SET row_count = ? WHERE table_name = ?", [count, table])
+        for table, column, column_type, approx_unique in conn.execute(
+            f"SELECT table_name, column_name, column_type, distinct_count FROM {META_SCHEMA}.schema_index"
+        ).fetchall():
+            values = _literal_values(conn, table, column, column_type, approx_unique)
+            if values:
+                conn.execute(f"UPDATE {META_SCHEMA}.schema_index SET literal_values = ? "
+                             f"WHERE table_name = ? AND column_name = ?", [json.dumps(values), table, column])
+        mark_built(conn, "schema_index", version, INDEX_VERSION)
+        return load_schema_index(conn)
+
+    rows = []
+    tables = [r[0] for r in conn.execute(
+        "SELECT table_name FROM information_schema.tables "
+        "WHERE table_catalog = current_database() AND table_schema = 'main' ORDER BY table_name"
+    ).fetchall()]
+    for table in tables:
+        summary = conn.execute(f"SUMMARIZE {quote_ident(table)}").fetchall()
+        for row in summary:
+            column, column_type, approx_unique, count = row[0], row[1], row[4], row[10]
+            top = []
+            if column_type == "VARCHAR" and approx_unique and approx_unique <= TOP_VALUES_MAX_DISTINCT:
+                top = [r[0] for r in conn.execute(
+                    f"SELECT {quote_ident(column)} FROM {quote_ident(table)} WHERE {quote_ident(column)} IS NOT NULL "
+                    f"GROUP BY 1 ORDER BY COUNT(*) DESC LIMIT {TOP_VALUES}"
+                ).fetchall()]
+            literals = _literal_values(conn, table, column, column_type, approx_unique)
+            rows.append((table, column, column_type, approx_unique, count, json.dumps(top), json.dumps(literals),
+                         _describe(column)))
+
+    conn.execute(f"""
+        CREATE OR REPLACE TABLE {META_SCHEMA}.schema_index (
+            table_name VARCHAR, column_name VARCHAR, column_type VARCHAR, distinct_count BIGINT,
+            row_count BIGINT, top_values VARCHAR, literal_values VARCHAR, description VARCHAR
+        )
+    """)
+    if rows:
+        conn.executemany(f"INSERT INTO {META_SCHEMA}.schema_index VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    mark_built(conn, "schema_index", version, INDEX_VERSION)
+    return load_schema_index(conn)
+
+
+def load_schema_index(conn):
+    index = {}
+    for table, column, column_type, distinct, count, top, literals, description in conn.execute(
+        f"SELECT * FROM {META_SCHEMA}.schema_index ORDER BY rowid"
+    ).fetchall():
+        index.setdefault(table, {"name": table, "rows": count, "columns": []})["columns"].append({
+            "name": column, "type": column_type, "distinct": distinct,
+            "top": json.loads(top), "literals": json.loads(literals), "description": description,
+            "words": _words(f"{column} {description}"),
+        })
+    return list(index.values())
+
+
+def schema_version(index) -> str:
+    """Hash of table/column names and types only: data changes keep it, schema changes move it."""
+    shape = [(t["name"], [(c["name"], c["type"]) for c in t["columns"]]) for t in index]
+    return hashlib.sha256(json.dumps(shape).encode("utf-8")).hexdigest()[:16]
+
+
+def literal_values(index) -> tuple:
+    """Every known categorical value (states, statuses, payment types, categories), for exact matching."""
+    return tuple(sorted({v for t in index for c in t["columns"] for v in c["literals"]}))
+
+
+def _column_text(col: dict) -> str:
+    text = f"{col['name']} {col['type']}"
+    notes = [col["description"]] if col["description"] != col["name"].replace("_", " ") else []
+    if col["top"]:
+        notes.append("e.g. " + ", ".join(repr(v) for v in col["top"]))
+    elif col["distinct"] and col["type"] == "VARCHAR":
+        notes.append(f"~{col['distinct']:,} distinct")
+    return text + (f" -- {'; '.join(notes)}" if notes else "")
+
+
+def _mentions(text: str, value) -> bool:
+    value = str(value).lower()
+    return any(re.search(rf"(?<![a-z0-9]){re.escape(v)}(?![a-z0-9])", text)
+               for v in {value, value.replace("_", " ")} if len(v) > 1)
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def _word_weights(index) -> dict:
+    # Words found in many tables ("order", "id", "customer") say little about which table is meant.
+    tables_with = {}
+    for table in index:
+        for word in set().union(*(c["words"] for c in table["columns"])) if table["columns"] else ():
+            tables_with[word] = tables_with.get(word, 0) + 1
+    return {w: min(1.0, 2.0 / n) for w, n in tables_with.items()}
+
+
+def retrieve_schema(index, question: str, token_budget: int = 1200) -> str:
+    """
+    Schema text for one question: relevant tables and columns only, most
+    relevant first, within roughly token_budget tokens.
+    """
+    expanded = _words(question)
+    implied = {name for w in expanded for name in SYNONYMS.get(w, [])}
+    text = (question or "").lower()
+    weights = _word_weights(index)
+
+    def overlap(words):
+        return sum(weights.get(w, 1.0) for w in words & expanded)
+
+    matches, fillers, table_score = [], [], {}
+    for t_rank, table in enumerate(index):
+        bonus = PREFERRED_TABLES.get(table["name"], 0.0) + 0.5 * overlap(_words(table["name"]))
+        for c_rank, col in enumerate(table["columns"]):
+            score = 2.0 * overlap(_words(col["name"])) + 0.5 * overlap(col["words"])
+            if col["name"] in implied:
+                score += 2.0
+            if any(_mentions(text, v) for v in col["top"]):
+                score += 2.0
+            entry = (score + bonus, t_rank, c_rank, table["name"], col)
+            (matches if score >= 1.0 else fillers).append(entry)
+            table_score[table["name"]] = max(table_score.get(table["name"], 0.0), entry[0] if score >= 1.0 else bonus)
+
+    # Matching columns go first, best first. The remaining columns of tables that
+    # are already in (or preferred) only fill whatever budget is left.
+    matches.sort(key=lambda e: (-e[0], e[1], e[2]))
+    fillers.sort(key=lambda e: (-table_score[e[3]], e[1], e[2]))
+
+    chosen, used = {}, 0
+    for phase in (matches, fillers):
+        for _, t_rank, c_rank, name, col in phase:
+            if phase is fillers and name not in chosen and name not in PREFERRED_TABLES:
+                continue
+            line = _column_text(col)
+            cost = estimate_tokens(line) + 2 + (estimate_tokens(name) + 4 if name not in chosen else 0)
+            if used + cost > token_budget:
+                continue
+            chosen.setdefault(name, (t_rank, []))[1].append((c_rank, line))
+            used += cost
+
+    out = []
+    for name, (_, lines) in sorted(chosen.items(), key=lambda kv: (-table_score[kv[0]], kv[1][0])):
+        out.append(f"- {name}(\n    " + ",\n    ".join(line for _, line in sorted(lines)) + "\n  )")
+    others = [t["name"] for t in index if t["name"] not in chosen]
+    if others:
+        line = "Other tables: " + ", ".join(others)
+        if used + estimate_tokens(line) <= token_budget:
+            out.append(line)
+    return "\n".join(out)
@@ -0,0 +1,172 @@
+import hashlib
+import logging
+import math
+import re
+import threading
+import zlib
+from functools import lru_cache
+
+# ---------------------------
+# Semantic question cache
+# ---------------------------
+# Verified question → SQL pairs live in a persistent local Chroma collection.
+# A new question is embedded and matched against earlier ones for the same
+# schema version; above the similarity threshold the stored SQL is re-validated
+# and reused without a Gemini call. Entries whose SQL no longer validates are
+# evicted. The embedder is pluggable; the default is a hashed character n-gram
+# model that needs no download and no network.
+log = logging.getLogger("maer.semantic_cache")
+
+# Numbers, years, state codes and categorical values must match exactly: "top 5"
+# and "top 10", or "in sp" and "in rj", embed almost identically but need
+# different SQL. The categorical values come from the schema index.
+_LITERALS = re.compile(r"\b(\d+(?:\.\d+)?|[A-Z]{2})\b")
+# Lowercase state codes that are also English words only count after a preposition.
+_STATE_WORDS = {"am", "go", "to"}
+# So must direction, ordering and negation: "highest" and "lowest" differ by a
+# few characters. Synonyms share a tag so "top" still matches "highest".
+_POLARITY_TAGS = {
+    "top": "~high", "highest": "~high", "most": "~high", "best": "~high", "largest": "~high",
+    "biggest": "~high", "max": "~high", "maximum": "~high",
+    "bottom": "~low", "lowest": "~low", "least": "~low", "fewest": "~low", "worst": "~low",
+    "smallest": "~low", "min": "~low", "minimum": "~low",
+    "more": "~more", "greater": "~more", "above": "~more", "exceeding": "~more",
+    "less": "~less", "fewer": "~less", "below": "~less",
+    "first": "~first", "earliest": "~first", "oldest": "~first",
+    "last": "~last", "latest": "~last", "newest": "~last", "recent": "~last",
+    "late": "~late", "delayed": "~late", "overdue": "~late",
+    "on time": "~on_time", "on-time": "~on_time", "early": "~early",
+    "not": "~not", "no": "~not", "without": "~not", "never": "~not", "excluding": "~not", "except": "~not",
+    "asc": "~asc", "ascending": "~asc", "desc": "~desc", "descending": "~desc",
+}
+_POLARITY = re.compile(r"\b(on[ -]time|\w+n't|" + "|".join(k for k in _POLARITY_TAGS if " " not in k and "-" not in k)
+                       + r")\b", re.IGNORECASE)
+_STOP_WORDS = {"a", "an", "the", "is", "are", "was", "were", "what", "which", "show", "me", "list", "give",
+               "of", "in", "by", "per", "each", "for", "to", "do", "does", "did", "please", "and", "our"}
+
+
+class HashedNgramEmbedder:
+    """Character n-grams + words hashed into a fixed-size, L2-normalised vector."""
+
+    def __init__(self, dim: int = 512, ngram_range=(2, 4)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def _features(self, text: str):
+        text = " ".join(w for w in re.findall(r"[a-z0-9]+", text.lower()) if w not in _STOP_WORDS)
+        for word in text.split():
+            yield "w:" + word, 2.0
+        padded = f" {text} "
+        for n in range(self.ngram_range[0], self.ngram_range[1] + 1):
+            for i in range(len(padded) - n + 1):
+                yield padded[i:i + n], 1.0
+
+    def __call__(self, texts):
+        vectors = []
+        for text in texts:
+            vec = [0.0] * self.dim
+            for feature, weight in self._features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                vec[h % self.dim] += weight if h & 0x80000000 else -weight
+            norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+            vectors.append([v / norm for v in vec])
+        return vectors
+
+
+@lru_cache(maxsize=8)
+def _vocabulary_pattern(vocabulary: tuple):
+    spelled = {}
+    for value in vocabulary:
+        spelled.setdefault(str(value).lower().replace("_", " "), value)
+    if not spelled:
+        return None, spelled
+    alternatives = "|".join(re.escape(v) for v in sorted(spelled, key=len, reverse=True))
+    return re.compile(rf"(?<![a-z0-9])(?:(in|from|for) )?({alternatives})(?![a-z0-9])"), spelled
+
+
+def question_literals(question: str, vocabulary: tuple = ()) -> str:
+    """Everything two questions must share verbatim for one's SQL to answer the other.
+
+    vocabulary holds the dataset's categorical values (see schema_index.literal_values);
+    they are matched case-insensitively, with "_" read as a space.
+    """
+    literals = set(_LITERALS.findall(question or ""))
+    pattern, spelled = _vocabulary_pattern(tuple(vocabulary))
+    if pattern is not None:
+        for preposition, word in pattern.findall((question or "").lower().replace("_", " ")):
+            if preposition or word not in _STATE_WORDS:
+                literals.add(spelled[word])
+    for word in _POLARITY.findall(question or ""):
+        word = word.lower()
+        literals.add("~not" if word.endswith("n't") else _POLARITY_TAGS[word.replace("-", " ")])
+    return " ".join(sorted(literals))
+
+
+class SemanticCache:
+    def __init__(self, path: str, embedder=None, threshold: float = 0.9, collection: str = "questions"):
+        import chromadb
+
+        self.embedder = embedder or HashedNgramEmbedder()
+        self.threshold = threshold
+        self.client = chromadb.PersistentClient(path=path)
+        self.collection = self.client.get_or_create_collection(
+            collection, embedding_function=None, metadata={"hnsw:space": "cosine"})
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stores = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(question: str, schema_version: str) -> str:
+        normalized = " ".join((question or "").lower().split())
+        return hashlib.sha256(f"{schema_version}\x00{normalized}".encode("utf-8")).hexdigest()
+
+    def lookup(self, question: str, schema_version: str, vocabulary: tuple = ()):
+        """Returns (entry_id, sql, similarity) for the closest stored question, or None."""
+        try:
+            res = self.collection.query(
+                query_embeddings=self.embedder([question]), n_results=1,
+                where={"$and": [{"schema_version": schema_version},
+                                {"literals": question_literals(question, vocabulary)}]},
+                include=["metadatas", "distances"],
+            )
+        except Exception as e:
+            log.warning("Semantic cache lookup failed: %s", e)
+            res = {"ids": [[]]}
+        if res["ids"] and res["ids"][0]:
+            similarity = 1.0 - res["distances"][0][0]
+            if similarity >= self.threshold:
+                return res["ids"][0][0], res["metadatas"][0][0]["sql"], similarity
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def record_hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def store(self, question: str, sql: str, schema_version: str, vocabulary: tuple = ()):
+        self.collection.upsert(
+            ids=[self.key(question, schema_version)],
+            embeddings=self.embedder([question]),
+            documents=[question],
+            metadatas=[{"sql": sql, "schema_version": schema_version,
+                        "literals": question_literals(question, vocabulary)}],
+        )
+        with self._lock:
+            self.stores += 1
+
+    def evict(self, entry_id: str):
+        """Drops an entry whose SQL stopped validating (counted as a miss)."""
+        self.collection.delete(ids=[entry_id])
+        with self._lock:
+            self.evictions += 1
+            self.misses += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "stores": self.stores, "entries": self.collection.count(),
+                    "hit_rate": self.hits / lookups if lookups else 0.0}
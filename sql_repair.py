@@ -0,0 +1,240 @@
+import difflib
+import re
+import threading
+from collections import Counter
+
+# ---------------------------
+# Local SQL validation + repair
+# ---------------------------
+# Before a generated query runs it is EXPLAINed (parse + bind, no execution).
+# The usual failures are then fixed deterministically, one rule per round:
+#   - stray prose / a statement mangled by normalize_sql → re-extracted from the raw reply
+#   - unknown columns or tables → fuzzy-matched against the schema
+#   - missing or incomplete GROUP BY → GROUP BY ALL
+#   - other dialects' date functions (DATE_FORMAT, TO_CHAR, DATE_SUB, DATEADD, NOW, ...)
+# Only when no rule applies does the caller fall back to the LLM fix prompt.
+MAX_ROUNDS = 5
+MAX_TS = "(SELECT max_purchase_ts FROM sales_enriched_stats)"
+
+
+class RepairStats:
+    def __init__(self):
+        self.outcomes = Counter()
+        self.rules = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, outcome: str, rules=()):
+        with self._lock:
+            self.outcomes[outcome] += 1
+            self.rules.update(rules)
+
+    def summary(self) -> dict:
+        with self._lock:
+            repaired, llm = self.outcomes["repaired"], self.outcomes["llm_fallback"]
+            return {
+                "valid_first_try": self.outcomes["valid"],
+                "repaired_locally": repaired,
+                "llm_fallback": llm,
+                "local_repair_rate": repaired / (repaired + llm) if repaired + llm else 0.0,
+                "rules": dict(self.rules),
+            }
+
+
+def explain_error(cursor, sql: str):
+    try:
+        cursor.execute("EXPLAIN " + sql.strip().rstrip(";"))
+        return None
+    except Exception as e:
+        return str(e)
+
+
+def schema_names(cursor):
+    rows = cursor.execute(
+        "SELECT table_name, column_name FROM information_schema.columns "
+        "WHERE table_schema = 'main' AND table_catalog = current_database()"
+    ).fetchall()
+    return sorted({t for t, _ in rows}), sorted({c for _, c in rows})
+
+
+# ---------------------------
+# Helpers
+# ---------------------------
+def _closing_paren(text: str, open_idx: int) -> int:
+    depth, quote = 0, None
+    for i in range(open_idx, len(text)):
+        ch = text[i]
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in "'\"":
+            quote = ch
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+            if depth == 0:
+                return i
+    return -1
+
+
+def _split_args(text: str) -> list:
+    args, depth, quote, cur = [], 0, None, []
+    for ch in text:
+        if quote:
+            quote = None if ch == quote else quote
+        elif ch in "'\"":
+            quote = ch
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == "," and depth == 0:
+            args.append("".join(cur).strip())
+            cur = []
+            continue
+        cur.append(ch)
+    args.append("".join(cur).strip())
+    return args
+
+
+def _rewrite_calls(sql: str, name: str, rewrite) -> str:
+    """Replaces every call name(...) using rewrite(args) -> str (or None to keep it)."""
+    pattern = re.compile(rf"\b{name}\s*\(", re.IGNORECASE)
+    pos = 0
+    while True:
+        m = pattern.search(sql, pos)
+        if not m:
+            return sql
+        close = _closing_paren(sql, m.end() - 1)
+        if close < 0:
+            return sql
+        new = rewrite(_split_args(sql[m.end():close]))
+        if new is None:
+            pos = m.end()
+            continue
+        sql = sql[:m.start()] + new + sql[close + 1:]
+        pos = m.start() + len(new)
+
+
+def _replace_identifier(sql: str, old: str, new: str) -> str:
+    # Outside string literals only; quoted or bare identifiers.
+    parts = re.split(r"('(?:[^']|'')*')", sql)
+    pat = re.compile(rf'"{re.escape(old)}"|\b{re.escape(old)}\b', re.IGNORECASE)
+    return "".join(p if p.startswith("'") else pat.sub(new, p) for p in parts)
+
+
+# ---------------------------
+# Rules
+# ---------------------------
+def extract_statement(raw_text: str):
+    """Pulls the first full statement out of a raw LLM reply, prose and fences removed."""
+    text = raw_text.replace("```sql", "\n").replace("```", "\n")
+    lines = [l for l in text.splitlines() if not l.strip().startswith("#")]
+    text = "\n".join(lines)
+    m = re.search(r"\b(WITH|SELECT)\b", text, re.IGNORECASE)
+    if not m:
+        return None
+    stmt = text[m.start():]
+    end = re.search(r";|\n\s*\n(?=[A-Z][a-z]+\s)", stmt)
+    return (stmt[:end.start()] if end else stmt).strip() + ";"
+
+
+def fix_unknown_name(sql: str, error: str, tables, columns):
+    m = re.search(r'Referenced column "?([\w]+)"? not found', error)
+    if m:
+        match = difflib.get_close_matches(m.group(1).lower(), [c.lower() for c in columns], n=1, cutoff=0.6)
+        if match:
+            real = next(c for c in columns if c.lower() == match[0])
+            return _replace_identifier(sql, m.group(1), real)
+    m = re.search(r'Table with name "?([\w]+)"? does not exist', error)
+    if m:
+        hint = re.search(r'Did you mean "(?:[\w]+\.)*([\w]+)"', error)
+        if hint and hint.group(1) in tables:
+            match = [hint.group(1)]
+        else:
+            match = difflib.get_close_matches(m.group(1), tables, n=1, cutoff=0.6)
+        if match:
+            return _replace_identifier(sql, m.group(1), match[0])
+    return None
+
+
+def fix_group_by(sql: str, error: str):
+    if "must appear in the GROUP BY clause" not in error:
+        return None
+    body = sql.strip().rstrip(";")
+    if re.search(r"\bGROUP\s+BY\s+ALL\b", body, re.IGNORECASE):
+        return None
+    existing = re.search(r"\bGROUP\s+BY\b.*?(?=\bHAVING\b|\bORDER\s+BY\b|\bLIMIT\b|\bQUALIFY\b|$)",
+                         body, re.IGNORECASE | re.DOTALL)
+    if existing:
+        return body[:existing.start()] + "GROUP BY ALL " + body[existing.end():] + ";"
+    tail = re.search(r"\bHAVING\b|\bORDER\s+BY\b|\bLIMIT\b|\bQUALIFY\b", body, re.IGNORECASE)
+    cut = tail.start() if tail else len(body)
+    return body[:cut].rstrip() + "\nGROUP BY ALL\n" + body[cut:] + ";"
+
+
+def _pg_format(fmt: str) -> str:
+    for pg, duck in (("YYYY", "%Y"), ("MM", "%m"), ("DD", "%d"), ("HH24", "%H"), ("MI", "%M"), ("SS", "%S")):
+        fmt = fmt.replace(pg, duck)
+    return fmt
+
+
+def fix_date_dialect(sql: str, error: str):
+    if not re.search(r"Function with name|Catalog Error|Parser Error|No function matches", error):
+        return None
+    new = _rewrite_calls(sql, "DATE_FORMAT", lambda a: f"strftime({a[0]}, {a[1]})" if len(a) == 2 else None)
+    new = _rewrite_calls(new, "TO_CHAR", lambda a: f"strftime({a[0]}, {_pg_format(a[1])})" if len(a) == 2 else None)
+    new = _rewrite_calls(new, "DATE_SUB", lambda a: f"({a[0]} - {a[1]})" if len(a) == 2 else None)
+    new = _rewrite_calls(new, "DATE_ADD", lambda a: f"({a[0]} + {a[1]})" if len(a) == 2 else None)
+    new = _rewrite_calls(new, "DATEADD",
+                         lambda a: f"({a[2]} + INTERVAL ({a[1]}) {a[0].strip(chr(39))})" if len(a) == 3 else None)
+    new = _rewrite_calls(new, "STR_TO_DATE", lambda a: f"strptime({a[0]}, {a[1]})" if len(a) == 2 else None)
+    new = fix_system_time(new) or new
+    return new if new != sql else None
+
+
+def fix_system_time(sql: str):
+    """The data stops in 2018: "now" always means the latest order, never the wall clock."""
+    new = re.sub(r"\b(?:NOW|CURDATE|SYSDATE|GETDATE|TODAY)\s*\(\s*\)", MAX_TS, sql, flags=re.IGNORECASE)
+    new = re.sub(r"\bCURRENT_(?:DATE|TIMESTAMP)\b(?!\s*\()", MAX_TS, new, flags=re.IGNORECASE)
+    return new if new != sql else None
+
+
+def repair_sql(cursor, sql: str, raw_text: str = "", schema=None, rounds: int = MAX_ROUNDS):
+    """
+    Returns (sql, applied_rules, error). error is None when the final SQL
+    EXPLAINs cleanly; otherwise it is the last error no rule could fix.
+    """
+    tables, columns = schema or schema_names(cursor)
+    applied = []
+    # Valid SQL, wrong answer: fixed even when EXPLAIN would pass.
+    relative = fix_system_time(sql)
+    if relative:
+        sql = relative
+        applied.append("system_time")
+    error = explain_error(cursor, sql)
+    for _ in range(rounds):
+        if error is None:
+            break
+        candidates = [
+            ("date_dialect", fix_date_dialect(sql, error)),
+            ("unknown_name", fix_unknown_name(sql, error, tables, columns)),
+            ("group_by", fix_group_by(sql, error)),
+        ]
+        if "reextract" not in applied and raw_text:
+            reextracted = ("reextract", extract_statement(raw_text))
+            if "Parser Error" in error:
+                candidates.insert(0, reextracted)
+            else:
+                candidates.append(reextracted)
+        fixed = None
+        for rule, candidate in candidates:
+            if candidate and candidate != sql:
+                fixed = rule, candidate
+                break
+        if fixed is None:
+            break
+        applied.append(fixed[0])
+        sql = fixed[1]
+        error = explain_error(cursor, sql)
+    return sql, applied, error
@@ -0,0 +1,739 @@
+import csv
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+
+import duckdb
+
+# ---------------------------
+# Ingestion cache
+# ---------------------------
+# Raw CSVs are parsed once into a persistent DuckDB file. Column types are
+# inferred by read_csv_auto at ingest time and pinned in the stored table, so
+# queries never re-sniff the CSVs. A manifest keyed by size, mtime and sha256
+# decides which files need to be re-ingested on the next load.
+CACHE_DIR = ".maer_cache"
+META_SCHEMA = "maer"
+
+
+def quote_ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def quote_literal(value: str) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def cache_db_path(data_path: str, cache_dir: str = CACHE_DIR) -> str:
+    digest = hashlib.sha1(os.path.abspath(data_path).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(cache_dir, f"olist_{digest}.duckdb")
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _ensure_manifest(conn):
+    conn.execute(f"CREATE SCHEMA IF NOT EXISTS {META_SCHEMA}")
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {META_SCHEMA}.ingest_manifest (
+            table_name VARCHAR PRIMARY KEY,
+            file_name VARCHAR,
+            size BIGINT,
+            mtime_ns BIGINT,
+            sha256 VARCHAR,
+            ingested_at TIMESTAMP
+        )
+    """)
+
+
+def _manifest(conn) -> dict:
+    rows = conn.execute(
+        f"SELECT table_name, size, mtime_ns, sha256 FROM {META_SCHEMA}.ingest_manifest"
+    ).fetchall()
+    return {r[0]: {"size": r[1], "mtime_ns": r[2], "sha256": r[3]} for r in rows}
+
+
+def _upsert_manifest(conn, table, file_name, size, mtime_ns, sha):
+    conn.execute(
+        f"INSERT OR REPLACE INTO {META_SCHEMA}.ingest_manifest VALUES (?, ?, ?, ?, ?, now())",
+        [table, file_name, size, mtime_ns, sha],
+    )
+
+
+# ---------------------------
+# Incremental appends
+# ---------------------------
+# New order drops arrive either as rows appended to an existing CSV, or as a
+# new file named <table>__<anything>.csv next to the table's own CSV (e.g.
+# olist_orders_dataset__2018-09-01.csv). Only the new rows are read, rows whose
+# natural key is already stored are dropped, and the ids of the orders they
+# touch are collected in maer.delta_orders. Derived tables that were current
+# before the append (derived_state at maer.delta_state.base_version) then
+# rebuild just those orders / months instead of the whole history.
+DROP_SEPARATOR = "__"
+TABLE_KEYS = {
+    "olist_orders_dataset": ("order_id",),
+    "olist_order_items_dataset": ("order_id", "order_item_id"),
+    "olist_order_payments_dataset": ("order_id", "payment_sequential"),
+    "olist_order_reviews_dataset": ("review_id", "order_id"),
+    "olist_customers_dataset": ("customer_id",),
+    "olist_products_dataset": ("product_id",),
+    "olist_sellers_dataset": ("seller_id",),
+    "product_category_name_translation": ("product_category_name",),
+}
+# New rows in these tables change existing orders' derived rows: {table: SQL for the order ids}.
+AFFECTED_ORDERS_SQL = {
+    "olist_orders_dataset": "SELECT order_id FROM maer_delta",
+    "olist_order_items_dataset": "SELECT order_id FROM maer_delta",
+    "olist_order_payments_dataset": "SELECT order_id FROM maer_delta",
+    "olist_order_reviews_dataset": "SELECT order_id FROM maer_delta",
+    "olist_customers_dataset":
+        "SELECT order_id FROM olist_orders_dataset WHERE customer_id IN (SELECT customer_id FROM maer_delta)",
+    "olist_products_dataset":
+        "SELECT order_id FROM olist_order_items_dataset WHERE product_id IN (SELECT product_id FROM maer_delta)",
+}
+
+
+def _ensure_delta(conn):
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {META_SCHEMA}.delta_orders (order_id VARCHAR)")
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {META_SCHEMA}.delta_state (base_version VARCHAR)")
+
+
+def _start_delta(conn):
+    """Starts a new delta once every derived table has caught up with the current data."""
+    version = dataset_version(conn)
+    row = conn.execute(f"SELECT base_version FROM {META_SCHEMA}.delta_state").fetchone()
+    behind = conn.execute(
+        f"SELECT COUNT(*) FROM {META_SCHEMA}.derived_state WHERE source_version <> ?", [version]
+    ).fetchone()[0] if _has_derived_state(conn) else 0
+    if row is None or not behind:
+        _reset_delta(conn, version)
+
+
+def _reset_delta(conn, base_version=None):
+    """base_version=None disables incremental refresh until the next load (a table was rebuilt)."""
+    conn.execute(f"DELETE FROM {META_SCHEMA}.delta_orders")
+    conn.execute(f"DELETE FROM {META_SCHEMA}.delta_state")
+    if base_version is not None:
+        conn.execute(f"INSERT INTO {META_SCHEMA}.delta_state VALUES (?)", [base_version])
+
+
+def delta_base_version(conn):
+    """Dataset version the pending delta applies on top of, or None when only a full rebuild is safe."""
+    try:
+        row = conn.execute(f"SELECT base_version FROM {META_SCHEMA}.delta_state").fetchone()
+    except duckdb.CatalogException:
+        return None
+    return row[0] if row else None
+
+
+def _has_derived_state(conn) -> bool:
+    return conn.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = ? AND table_name = 'derived_state'",
+        [META_SCHEMA],
+    ).fetchone()[0] > 0
+
+
+def _hashes(path: str, prefix_len: int, chunk_size: int = 1 << 20):
+    """One read of the file: (sha256 of the first prefix_len bytes, sha256 of all of it, byte before the tail)."""
+    prefix, full = hashlib.sha256(), hashlib.sha256()
+    last, pos = b"", 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            if pos < prefix_len:
+                head = chunk[:prefix_len - pos]
+                prefix.update(head)
+                last = head[-1:] or last
+            full.update(chunk)
+            pos += len(chunk)
+    return prefix.hexdigest(), full.hexdigest(), last
+
+
+def _classify(path: str, prev, size: int):
+    """("new" | "same" | "append" | "changed", sha256) for a file whose size or mtime moved."""
+    if prev is None:
+        return "new", file_sha256(path)
+    prefix_sha, sha, last = _hashes(path, prev["size"])
+    if sha == prev["sha256"]:
+        return "same", sha
+    if size > prev["size"] and prefix_sha == prev["sha256"] and last == b"\n":
+        return "append", sha
+    return "changed", sha
+
+
+def _tail_csv(path: str, offset: int) -> str:
+    """Temp CSV with the file's header line followed by everything after offset."""
+    fd, tmp = tempfile.mkstemp(prefix="maer_tail_", suffix=".csv")
+    with open(path, "rb") as src, os.fdopen(fd, "wb") as out:
+        out.write(src.readline())
+        src.seek(offset)
+        shutil.copyfileobj(src, out, 1 << 20)
+    return tmp
+
+
+def append_csv_rows(conn, table: str, path: str, offset: int = 0) -> int:
+    """
+    Appends the rows of path (from byte offset, header kept) to table, typed
+    like the stored columns and minus rows whose key is already stored.
+    Records the order ids they affect. Returns the number of rows added.
+    """
+    columns = dict(conn.execute(
+        "SELECT column_name, data_type FROM information_schema.columns "
+        "WHERE table_schema = 'main' AND table_name = ? ORDER BY ordinal_position", [table]
+    ).fetchall())
+    with open(path, encoding="utf-8", newline="") as f:
+        header = next(csv.reader(f), [])
+    if sorted(header) != sorted(columns):
+        raise ValueError(f"{os.path.basename(path)}: columns {header} do not match table {table}")
+    types = "{" + ", ".join(f"{quote_literal(c)}: {quote_literal(columns[c])}" for c in header) + "}"
+    source = _tail_csv(path, offset) if offset else path
+    keys = [k for k in TABLE_KEYS.get(table, ()) if k in columns]
+    dedupe = ""
+    if keys:
+        dedupe = (
+            f" WHERE NOT EXISTS (SELECT 1 FROM {quote_ident(table)} t WHERE "
+            + " AND ".join(f"t.{quote_ident(k)} = d.{quote_ident(k)}" for k in keys) + ")"
+            + f" QUALIFY row_number() OVER (PARTITION BY {', '.join(quote_ident(k) for k in keys)}) = 1"
+        )
+    try:
+        conn.execute(
+            f"CREATE OR REPLACE TEMP TABLE maer_delta AS SELECT * FROM "
+            f"read_csv({quote_literal(source)}, HEADER=TRUE, columns={types}) d{dedupe}"
+        )
+    finally:
+        if source != path:
+            os.remove(source)
+    added = conn.execute("SELECT COUNT(*) FROM maer_delta").fetchone()[0]
+    if added:
+        conn.execute(f"INSERT INTO {quote_ident(table)} BY NAME SELECT * FROM maer_delta")
+        if table in AFFECTED_ORDERS_SQL:
+            conn.execute(f"INSERT INTO {META_SCHEMA}.delta_orders "
+                         f"SELECT DISTINCT order_id FROM ({AFFECTED_ORDERS_SQL[table]})")
+    conn.execute("DROP TABLE maer_delta")
+    return added
+
+
+def _load_table(conn, table: str, paths: list):
+    """Full (re)build of table: its own CSV, then each drop file deduplicated on top."""
+    conn.execute(
+        f"CREATE OR REPLACE TABLE {quote_ident(table)} AS "
+        f"SELECT * FROM read_csv_auto({quote_literal(paths[0])}, HEADER=TRUE)"
+    )
+    for path in paths[1:]:
+        append_csv_rows(conn, table, path)
+
+
+def ingest_csv_folder(conn, data_path: str) -> list:
+    """
+    Brings the stored tables in line with the CSVs in data_path.
+    - unchanged size + mtime: skipped without reading the file
+    - touched but identical content (same sha256): manifest refreshed only
+    - rows appended to a known CSV, or a new <table>__*.csv drop: only the
+      new rows are appended (deduplicated on the table's key)
+    - any other content change, or a drop file removed: table rebuilt
+    - CSV removed from the folder: table dropped
+    Returns the names of the tables that were rebuilt, appended to or dropped.
+    """
+    _ensure_manifest(conn)
+    _ensure_delta(conn)
+    _start_delta(conn)
+    manifest = _manifest(conn)
+    files = {os.path.splitext(f)[0]: f for f in sorted(os.listdir(data_path)) if f.endswith(".csv")}
+
+    def target(stem):
+        base = stem.split(DROP_SEPARATOR)[0]
+        return base if DROP_SEPARATOR in stem and base in files else stem
+
+    groups = {}
+    for stem in sorted(files):  # a table's own CSV sorts before its drops
+        groups.setdefault(target(stem), []).append(stem)
+    rebuilt, appended = [], []
+
+    for table, stems in groups.items():
+        removed_drops = [s for s in manifest if s not in files and DROP_SEPARATOR in s
+                         and s.split(DROP_SEPARATOR)[0] == table]
+        plan = {}
+        for stem in stems:
+            st_ = os.stat(os.path.join(data_path, files[stem]))
+            prev = manifest.get(stem)
+            if prev and prev["size"] == st_.st_size and prev["mtime_ns"] == st_.st_mtime_ns:
+                continue
+            kind, sha = _classify(os.path.join(data_path, files[stem]), prev, st_.st_size)
+            plan[stem] = (kind, sha, st_)
+        if not plan and not removed_drops:
+            continue
+        rebuild = (removed_drops or _relation_type(conn, table) is None
+                   or any(kind == "changed" for kind, _, _ in plan.values()))
+
+        conn.execute("BEGIN TRANSACTION")
+        try:
+            if rebuild:
+                _load_table(conn, table, [os.path.join(data_path, files[s]) for s in stems])
+                rebuilt.append(table)
+            else:
+                added = 0
+                for stem, (kind, _, _) in plan.items():
+                    if kind in ("new", "append"):
+                        offset = manifest[stem]["size"] if kind == "append" else 0
+                        added += append_csv_rows(conn, table, os.path.join(data_path, files[stem]), offset)
+                if added:
+                    appended.append(table)
+            for stem, (_, sha, st_) in plan.items():
+                _upsert_manifest(conn, stem, files[stem], st_.st_size, st_.st_mtime_ns, sha)
+            for stem in removed_drops:
+                conn.execute(f"DELETE FROM {META_SCHEMA}.ingest_manifest WHERE table_name = ?", [stem])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    for name in set(manifest) - set(files):
+        if DROP_SEPARATOR in name and name.split(DROP_SEPARATOR)[0] in files:
+            continue  # a removed drop file, handled with its table above
+        conn.execute(f"DROP TABLE IF EXISTS {quote_ident(name)}")
+        conn.execute(f"DELETE FROM {META_SCHEMA}.ingest_manifest WHERE table_name = ?", [name])
+        rebuilt.append(name)
+    if rebuilt:
+        _reset_delta(conn)
+    return rebuilt + appended
+
+
+def folder_signature(data_path: str) -> tuple:
+    """Cheap stat-only fingerprint of the CSV folder (no file contents are read)."""
+    out = []
+    for f in sorted(os.listdir(data_path)):
+        if f.endswith(".csv"):
+            st_ = os.stat(os.path.join(data_path, f))
+            out.append((f, st_.st_size, st_.st_mtime_ns))
+    return tuple(out)
+
+
+def dataset_version(conn) -> str:
+    """Fingerprint of the ingested files; changes whenever any table is re-ingested."""
+    rows = conn.execute(
+        f"SELECT table_name, sha256 FROM {META_SCHEMA}.ingest_manifest ORDER BY table_name"
+    ).fetchall()
+    return hashlib.sha256(repr(rows).encode("utf-8")).hexdigest()[:16]
+
+
+# ---------------------------
+# Derived tables
+# ---------------------------
+# In materialized mode sales_enriched is stored as a physical table sorted by
+# order_purchase_timestamp. DuckDB keeps min/max statistics per row group, so
+# date-range predicates skip every row group outside the requested window.
+
+#
+# Payments and reviews are first reduced to one row per order, so joining them
+# cannot fan out the item rows. An order's payment total is spread over its
+# items in proportion to price + freight, which keeps SUM(payment_value) equal
+# to what customers actually paid.
+ORDER_PAYMENTS_SUMMARY_SQL = """
+    SELECT order_id,
+           arg_max(payment_type, CAST(payment_value AS DOUBLE)) AS payment_type,
+           COUNT(*) AS payment_count,
+           MAX(payment_installments) AS payment_installments,
+           SUM(CAST(payment_value AS DOUBLE)) AS payment_value
+    FROM olist_order_payments_dataset
+    GROUP BY order_id
+"""
+
+ORDER_REVIEWS_SUMMARY_SQL = """
+    SELECT order_id,
+           AVG(CAST(review_score AS DOUBLE)) AS review_score,
+           COUNT(*) AS review_count
+    FROM olist_order_reviews_dataset
+    GROUP BY order_id
+"""
+
+SALES_ENRICHED_SQL = """
+    SELECT oi.order_id,oi.product_id,p.product_category_name AS category,
+           CAST(oi.price AS DOUBLE) AS price,CAST(oi.freight_value AS DOUBLE) AS freight_value,
+           o.order_status,o.order_purchase_timestamp,o.order_delivered_customer_date,
+           c.customer_city,c.customer_state,pay.payment_type,
+           pay.payment_value * COALESCE(
+               (CAST(oi.price AS DOUBLE) + CAST(oi.freight_value AS DOUBLE))
+               / NULLIF(SUM(CAST(oi.price AS DOUBLE) + CAST(oi.freight_value AS DOUBLE))
+                        OVER (PARTITION BY oi.order_id), 0),
+               1.0 / COUNT(*) OVER (PARTITION BY oi.order_id)
+           ) AS payment_value,
+           r.review_score
+    FROM olist_order_items_dataset oi
+    JOIN olist_orders_dataset o ON oi.order_id=o.order_id
+    LEFT JOIN olist_products_dataset p ON oi.product_id=p.product_id
+    LEFT JOIN olist_customers_dataset c ON o.customer_id=c.customer_id
+    LEFT JOIN order_payments_summary pay ON o.order_id=pay.order_id
+    LEFT JOIN order_reviews_summary r ON o.order_id=r.order_id
+"""
+
+
+def ensure_derived_state(conn):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {META_SCHEMA}.derived_state (
+            name VARCHAR PRIMARY KEY,
+            source_version VARCHAR,
+            definition_hash VARCHAR,
+            built_at TIMESTAMP
+        )
+    """)
+
+
+def is_fresh(conn, name: str, version: str, definition: str) -> bool:
+    row = conn.execute(
+        f"SELECT source_version, definition_hash FROM {META_SCHEMA}.derived_state WHERE name = ?",
+        [name],
+    ).fetchone()
+    return row == (version, hashlib.sha1(definition.encode("utf-8")).hexdigest())
+
+
+def mark_built(conn, name: str, version: str, definition: str):
+    conn.execute(
+        f"INSERT OR REPLACE INTO {META_SCHEMA}.derived_state VALUES (?, ?, ?, now())",
+        [name, version, hashlib.sha1(definition.encode("utf-8")).hexdigest()],
+    )
+
+
+DELTA_ORDERS = f"SELECT order_id FROM {META_SCHEMA}.delta_orders"
+
+
+def delta_applies(conn, name: str, definition: str) -> bool:
+    """True when name was current just before the pending delta, so refreshing the delta orders is enough."""
+    base = delta_base_version(conn)
+    return base is not None and is_fresh(conn, name, base, definition)
+
+
+def delta_purchase_filter(conn) -> str:
+    """
+    Predicate for the rows of the delta orders in a table with an
+    order_purchase_timestamp column; the timestamp bounds let scans of the
+    time-sorted tables skip row groups outside the delta.
+    """
+    lo, hi, has_null = conn.execute(f"""
+        SELECT MIN(order_purchase_timestamp), MAX(order_purchase_timestamp),
+               bool_or(order_purchase_timestamp IS NULL)
+        FROM olist_orders_dataset WHERE order_id IN ({DELTA_ORDERS})
+    """).fetchone()
+    bounds = []
+    if lo is not None:
+        bounds.append(f"order_purchase_timestamp BETWEEN {quote_literal(str(lo))} AND {quote_literal(str(hi))}")
+    if has_null:
+        bounds.append("order_purchase_timestamp IS NULL")
+    return f"order_id IN ({DELTA_ORDERS}) AND ({' OR '.join(bounds) or 'FALSE'})"
+
+
+def relation_exists(conn, name: str, schema: str = "main") -> bool:
+    return conn.execute(
+        "SELECT COUNT(*) FROM information_schema.tables "
+        "WHERE table_catalog = current_database() AND table_schema = ? AND table_name = ?",
+        [schema, name],
+    ).fetchone()[0] > 0
+
+
+def _relation_type(conn, name: str):
+    row = conn.execute(
+        "SELECT table_type FROM information_schema.tables "
+        "WHERE table_catalog = current_database() AND table_schema = 'main' AND table_name = ?",
+        [name],
+    ).fetchone()
+    return row[0] if row else None
+
+
+def _drop_relation(conn, name: str):
+    kind = _relation_type(conn, name)
+    if kind == "VIEW":
+        conn.execute(f"DROP VIEW {quote_ident(name)}")
+    elif kind is not None:
+        conn.execute(f"DROP TABLE {quote_ident(name)}")
+
+
+def create_order_summaries(conn):
+    version = dataset_version(conn)
+    ensure_derived_state(conn)
+    for name, sql in (("order_payments_summary", ORDER_PAYMENTS_SUMMARY_SQL),
+                      ("order_reviews_summary", ORDER_REVIEWS_SUMMARY_SQL)):
+        if _relation_type(conn, name) and is_fresh(conn, name, version, sql):
+            continue
+        if _relation_type(conn, name) and delta_applies(conn, name, sql):
+            conn.execute(f"DELETE FROM {name} WHERE order_id IN ({DELTA_ORDERS})")
+            conn.execute(f"INSERT INTO {name} SELECT * FROM ({sql}) WHERE order_id IN ({DELTA_ORDERS})")
+        else:
+            conn.execute(f"CREATE OR REPLACE TABLE {name} AS {sql} ORDER BY order_id")
+        mark_built(conn, name, version, sql)
+
+
+def check_sales_enriched(conn, delta_only: bool = False):
+    """Fails loudly if sales_enriched has more (or fewer) rows than there are order items."""
+    where, and_where = "", ""
+    if delta_only:
+        where = f"WHERE {delta_purchase_filter(conn)}"
+        and_where = f"AND oi.order_id IN ({DELTA_ORDERS})"
+    rows, items = conn.execute(f"""
+        SELECT (SELECT COUNT(*) FROM sales_enriched {where}),
+               (SELECT COUNT(*) FROM olist_order_items_dataset oi
+                WHERE EXISTS (SELECT 1 FROM olist_orders_dataset o WHERE o.order_id = oi.order_id) {and_where})
+    """).fetchone()
+    if rows != items:
+        raise RuntimeError(
+            f"sales_enriched has {rows:,} rows but there are {items:,} order items — join fan-out?"
+        )
+    return rows
+
+
+def create_sales_enriched(conn, materialize: bool = True, partition_by=None, partition_root=None):
+    version = dataset_version(conn)
+    ensure_derived_state(conn)
+    create_order_summaries(conn)
+    incremental = False
+    if partition_by:
+        incremental = _build_partitioned_sales(conn, version, partition_by, partition_root)
+    elif not materialize:
+        if _relation_type(conn, "sales_enriched") == "BASE TABLE":
+            _drop_relation(conn, "sales_enriched")
+        conn.execute(f"CREATE OR REPLACE VIEW sales_enriched AS {SALES_ENRICHED_SQL}")
+        conn.execute(f"DELETE FROM {META_SCHEMA}.derived_state WHERE name = 'sales_enriched'")
+    elif not (_relation_type(conn, "sales_enriched") == "BASE TABLE"
+              and is_fresh(conn, "sales_enriched", version, SALES_ENRICHED_SQL)):
+        if (_relation_type(conn, "sales_enriched") == "BASE TABLE"
+                and delta_applies(conn, "sales_enriched", SALES_ENRICHED_SQL)):
+            # Drops are mostly new orders, so rows appended in time order keep the
+            # table close to sorted and zone maps stay selective.
+            conn.execute(f"DELETE FROM sales_enriched WHERE {delta_purchase_filter(conn)}")
+            conn.execute(
+                f"INSERT INTO sales_enriched SELECT * FROM ({SALES_ENRICHED_SQL}) "
+                f"WHERE order_id IN ({DELTA_ORDERS}) ORDER BY order_purchase_timestamp"
+            )
+            incremental = True
+        else:
+            _drop_relation(conn, "sales_enriched")
+            conn.execute(
+                f"CREATE TABLE sales_enriched AS {SALES_ENRICHED_SQL} "
+                "ORDER BY order_purchase_timestamp"
+            )
+        mark_built(conn, "sales_enriched", version, SALES_ENRICHED_SQL)
+
+    # Precomputed scalar for the "relative to the latest order" date rules, so
+    # prompts never need a MAX() over the whole join.
+    if incremental:
+        # Delta orders keep their purchase timestamps, so the bounds only widen.
+        conn.execute(f"""
+            CREATE OR REPLACE TABLE sales_enriched_stats AS
+            SELECT greatest(s.max_purchase_ts, d.max_ts) AS max_purchase_ts,
+                   least(s.min_purchase_ts, d.min_ts) AS min_purchase_ts,
+                   (SELECT COUNT(*) FROM sales_enriched) AS row_count
+            FROM sales_enriched_stats s,
+                 (SELECT MAX(order_purchase_timestamp) AS max_ts, MIN(order_purchase_timestamp) AS min_ts
+                  FROM olist_orders_dataset WHERE order_id IN ({DELTA_ORDERS})) d
+        """)
+    else:
+        conn.execute("""
+            CREATE OR REPLACE TABLE sales_enriched_stats AS
+            SELECT MAX(order_purchase_timestamp) AS max_purchase_ts,
+                   MIN(order_purchase_timestamp) AS min_purchase_ts,
+                   COUNT(*) AS row_count
+            FROM sales_enriched
+        """)
+    check_sales_enriched(conn, delta_only=incremental)
+    if not partition_by and partition_root and os.path.isdir(partition_root):
+        shutil.rmtree(partition_root)  # layout switched back to a table / view
+
+
+# ---------------------------
+# Partitioned layout
+# ---------------------------
+# Optionally sales_enriched is written as Hive-partitioned Parquet next to the
+# database file (<root>/purchase_year=2018/purchase_month=3[/customer_state=SP]/)
+# and exposed as a view over read_parquet(hive_partitioning). Filters on the
+# partition columns skip whole files; add_partition_filters() derives them from
+# constant bounds on order_purchase_timestamp so date-range queries prune too.
+PARTITION_COLUMNS = {
+    "month": ("purchase_year", "purchase_month"),
+    "month_state": ("purchase_year", "purchase_month", "customer_state"),
+}
+PARTITIONED_SALES_SQL = f"""
+    SELECT *, year(order_purchase_timestamp) AS purchase_year,
+           month(order_purchase_timestamp) AS purchase_month
+    FROM ({SALES_ENRICHED_SQL})
+"""
+HIVE_NULL = "__HIVE_DEFAULT_PARTITION__"
+
+
+def sales_partition_dir(data_path: str, cache_dir: str = CACHE_DIR) -> str:
+    return os.path.splitext(cache_db_path(data_path, cache_dir))[0] + "_sales"
+
+
+def _copy_partitions(conn, root: str, columns: tuple, where: str = "", append: bool = False):
+    conn.execute(
+        f"COPY (SELECT * FROM ({PARTITIONED_SALES_SQL}) {where} ORDER BY order_purchase_timestamp) "
+        f"TO {quote_literal(root)} (FORMAT PARQUET, PARTITION_BY ({', '.join(columns)})"
+        f"{', APPEND' if append else ''})"
+    )
+
+
+def _build_partitioned_sales(conn, version: str, partition_by: str, root: str) -> bool:
+    """(Re)writes the Parquet behind the sales_enriched view; True when only the delta's months were rewritten."""
+    columns = PARTITION_COLUMNS[partition_by]
+    definition = PARTITIONED_SALES_SQL + repr(columns) + root
+    is_view = _relation_type(conn, "sales_enriched") == "VIEW"
+    if is_view and is_fresh(conn, "sales_enriched", version, definition):
+        return False
+    incremental = is_view and os.path.isdir(root) and delta_applies(conn, "sales_enriched", definition)
+    if incremental:
+        # Whole months are rewritten: drop their directories, then append them again.
+        months = conn.execute(f"""
+            SELECT DISTINCT year(order_purchase_timestamp), month(order_purchase_timestamp)
+            FROM olist_orders_dataset WHERE order_id IN ({DELTA_ORDERS})
+        """).fetchall()
+        ranges = []
+        for year, month in months:
+            shutil.rmtree(os.path.join(root, f"purchase_year={HIVE_NULL if year is None else year}",
+                                       f"purchase_month={HIVE_NULL if month is None else month}"),
+                          ignore_errors=True)
+            ranges.append("order_purchase_timestamp IS NULL" if year is None else
+                          f"(order_purchase_timestamp >= TIMESTAMP '{year}-{month:02d}-01' AND "
+                          f"order_purchase_timestamp < TIMESTAMP '{year}-{month:02d}-01' + INTERVAL 1 MONTH)")
+        if ranges:
+            _copy_partitions(conn, root, columns, f"WHERE {' OR '.join(ranges)}", append=True)
+    else:
+        _drop_relation(conn, "sales_enriched")
+        shutil.rmtree(root, ignore_errors=True)
+        _copy_partitions(conn, root, columns)
+    types = ", ".join(f"{quote_literal(c)}: {'VARCHAR' if c == 'customer_state' else 'INTEGER'}" for c in columns)
+    conn.execute(
+        f"CREATE OR REPLACE VIEW sales_enriched AS SELECT * FROM read_parquet("
+        f"{quote_literal(os.path.join(root, '**', '*.parquet'))}, hive_partitioning = true, hive_types = {{{types}}})"
+    )
+    mark_built(conn, "sales_enriched", version, definition)
+    return incremental
+
+
+_TS_COMPARISON = re.compile(
+    r'(?<![\w."])((?:\w+\.|"[^"]+"\.)?)"?order_purchase_timestamp"?\s*(>=|<=|>|<|BETWEEN\b)\s*', re.IGNORECASE
+)
+_EXPRESSION_END = re.compile(
+    r"\b(?:AND|OR|GROUP|ORDER|LIMIT|HAVING|WINDOW|QUALIFY|UNION|EXCEPT|INTERSECT|THEN|WHEN|ELSE|END)\b|[,;]",
+    re.IGNORECASE,
+)
+
+
+def _expression_end(sql: str, start: int) -> int:
+    depth, quote, i = 0, None, start
+    while i < len(sql):
+        ch = sql[i]
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in "'\"":
+            quote = ch
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            if depth == 0:
+                break
+            depth -= 1
+        elif depth == 0 and _EXPRESSION_END.match(sql, i):
+            break
+        i += 1
+    return i
+
+
+def _constant_timestamp(cursor, expr: str):
+    if not expr or re.search(r"\bSELECT\b", expr, re.IGNORECASE):
+        return None
+    try:
+        return cursor.execute(f"SELECT CAST(({expr}) AS TIMESTAMP)").fetchone()[0]
+    except duckdb.Error:
+        return None  # not a constant (e.g. another column)
+
+
+def add_partition_filters(cursor, sql: str) -> str:
+    """
+    For every order_purchase_timestamp comparison with a constant bound, adds
+    the implied bound on the (purchase_year, purchase_month) partition key,
+    so the scan of a partitioned sales_enriched reads only matching months.
+    Returns sql unchanged when nothing applies or the result does not bind.
+    """
+    out, pos = [], 0
+    for m in _TS_COMPARISON.finditer(sql):
+        if m.start() < pos or sql.count("'", 0, m.start()) % 2:
+            continue
+        qualifier, op = m.group(1), m.group(2).upper()
+        end = _expression_end(sql, m.end())
+        low = high = _constant_timestamp(cursor, sql[m.end():end].strip())
+        if low is not None and op == "BETWEEN":
+            if sql[end:end + 3].upper() != "AND":
+                continue
+            second = _expression_end(sql, end + 3)
+            high = _constant_timestamp(cursor, sql[end + 3:second].strip())
+            end = second
+        if low is None or high is None:
+            continue
+        key = f"({qualifier}purchase_year, {qualifier}purchase_month)"
+        if op in (">", ">="):
+            implied = f"{key} >= ({low.year}, {low.month})"
+        elif op == "BETWEEN":
+            implied = f"{key} BETWEEN ({low.year}, {low.month}) AND ({high.year}, {high.month})"
+        else:
+            # "< first instant of a month" excludes that month's partition.
+            exclusive = op == "<" and high == high.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+            implied = f"{key} {'<' if exclusive else '<='} ({high.year}, {high.month})"
+        condition = sql[m.start():end].rstrip()
+        out += [sql[pos:m.start()], f"({condition} AND {implied})"]
+        pos = m.start() + len(condition)
+    if not out:
+        return sql
+    rewritten = "".join(out) + sql[pos:]
+    try:
+        cursor.execute("EXPLAIN " + rewritten.strip().rstrip(";"))
+    except duckdb.Error:
+        return sql
+    return rewritten
+
+
+# ---------------------------
+# Data loading
+# ---------------------------
+def duckdb_config(memory_limit=None, threads=None, temp_directory=None, max_temp_directory_size=None,
+                  out_of_core: bool = False, cache_dir: str = CACHE_DIR) -> dict:
+    """
+    Connection settings for the database file. The out-of-core profile gives
+    DuckDB a spill directory and lets it drop insertion order, so joins, sorts
+    and aggregations that outgrow memory_limit page to disk instead of failing.
+    """
+    config = {}
+    if memory_limit:
+        config["memory_limit"] = str(memory_limit)
+    if threads:
+        config["threads"] = int(threads)
+    if out_of_core or temp_directory:
+        config["temp_directory"] = temp_directory or os.path.join(cache_dir, "spill")
+    if max_temp_directory_size:
+        config["max_temp_directory_size"] = str(max_temp_directory_size)
+    if out_of_core:
+        # Results without ORDER BY may come back in any order; this is what lets
+        # large CREATE TABLE AS / COPY statements stream instead of buffering.
+        config["preserve_insertion_order"] = False
+    return config
+
+
+def load_data_into_duckdb(data_path="data/olist", cache_dir=CACHE_DIR, materialize=True, config=None,
+                          partition_by=None):
+    """partition_by: None (a table, or a view when not materialize), "month" or "month_state"."""
+    os.makedirs(cache_dir, exist_ok=True)
+    # Settings apply from the first statement, so ingestion itself runs within the limits too.
+    conn = duckdb.connect(database=cache_db_path(data_path, cache_dir), config=config or {})
+    ingest_csv_folder(conn, data_path)
+    create_sales_enriched(conn, materialize, partition_by, sales_partition_dir(data_path, cache_dir))
+    try:
+        conn.execute("CHECKPOINT")
+    except duckdb.TransactionException:
+        # A reload while an older engine's sessions still hold open reads on this
+        # database: the WAL is checkpointed later, by DuckDB or the next load.
+        pass
+    return conn
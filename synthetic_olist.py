@@ -0,0 +1,300 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+# ---------------------------
+# Synthetic Olist generator
+# ---------------------------
+# Writes the nine olist_* CSVs (same file names and columns as the Kaggle
+# release) at any scale factor. 1x is about the size of the real data (~99k
+# orders, ~113k items); 10x and 100x scale orders, customers, products and
+# sellers linearly. Skew is kept where the app looks: São Paulo dominates the
+# states, categories/products/sellers follow a power law, ~90% of orders have
+# one item, credit card is ~3/4 of payments, most reviews are 5 stars, and
+# volume grows from late 2016 to mid 2018. Output depends only on
+# (scale, seed): every chunk draws from its own seeded generator. Geolocation
+# is thinned (one row per zip prefix) because the app never joins it.
+BASE_ORDERS = 99_441
+BASE_PRODUCTS = 32_951
+BASE_SELLERS = 3_095
+CHUNK_ORDERS = 250_000
+START = np.datetime64("2016-09-04T00:00:00")
+END = np.datetime64("2018-09-03T00:00:00")
+
+STATES = {
+    "SP": 0.42, "RJ": 0.13, "MG": 0.117, "RS": 0.055, "PR": 0.051, "SC": 0.037, "BA": 0.034, "DF": 0.022,
+    "ES": 0.02, "GO": 0.02, "PE": 0.017, "CE": 0.013, "PA": 0.01, "MT": 0.009, "MA": 0.0075, "MS": 0.0072,
+    "PB": 0.0054, "PI": 0.005, "RN": 0.0049, "AL": 0.0041, "SE": 0.0034, "TO": 0.0028, "RO": 0.0025,
+    "AM": 0.0015, "AC": 0.0008, "AP": 0.0007, "RR": 0.0005,
+}
+CITIES = {
+    "SP": ["sao paulo", "campinas", "guarulhos", "sao bernardo do campo", "santo andre", "osasco",
+           "santos", "sorocaba", "ribeirao preto", "jundiai", "sao jose dos campos", "barueri"],
+    "RJ": ["rio de janeiro", "niteroi", "sao goncalo", "duque de caxias", "nova iguacu", "petropolis"],
+    "MG": ["belo horizonte", "contagem", "juiz de fora", "uberlandia", "betim", "montes claros"],
+    "RS": ["porto alegre", "caxias do sul", "canoas", "pelotas"],
+    "PR": ["curitiba", "londrina", "maringa", "ponta grossa"],
+    "SC": ["florianopolis", "joinville", "blumenau"],
+    "BA": ["salvador", "feira de santana", "vitoria da conquista"],
+    "DF": ["brasilia"], "ES": ["vitoria", "vila velha", "serra"], "GO": ["goiania", "anapolis"],
+    "PE": ["recife", "jaboatao dos guararapes"], "CE": ["fortaleza"], "PA": ["belem"], "MT": ["cuiaba"],
+    "MA": ["sao luis"], "MS": ["campo grande"], "PB": ["joao pessoa"], "PI": ["teresina"], "RN": ["natal"],
+    "AL": ["maceio"], "SE": ["aracaju"], "TO": ["palmas"], "RO": ["porto velho"], "AM": ["manaus"],
+    "AC": ["rio branco"], "AP": ["macapa"], "RR": ["boa vista"],
+}
+CATEGORIES = [
+    ("cama_mesa_banho", "bed_bath_table"), ("beleza_saude", "health_beauty"),
+    ("esporte_lazer", "sports_leisure"), ("moveis_decoracao", "furniture_decor"),
+    ("informatica_acessorios", "computers_accessories"), ("utilidades_domesticas", "housewares"),
+    ("relogios_presentes", "watches_gifts"), ("telefonia", "telephony"),
+    ("ferramentas_jardim", "garden_tools"), ("automotivo", "auto"), ("brinquedos", "toys"),
+    ("cool_stuff", "cool_stuff"), ("perfumaria", "perfumery"), ("bebes", "baby"),
+    ("eletronicos", "electronics"), ("papelaria", "stationery"),
+    ("fashion_bolsas_e_acessorios", "fashion_bags_accessories"), ("pet_shop", "pet_shop"),
+    ("moveis_escritorio", "office_furniture"), ("consoles_games", "consoles_games"),
+    ("malas_acessorios", "luggage_accessories"), ("construcao_ferramentas_construcao", "construction_tools_construction"),
+    ("eletrodomesticos", "home_appliances"), ("instrumentos_musicais", "musical_instruments"),
+    ("eletroportateis", "small_appliances"), ("casa_construcao", "home_construction"),
+    ("livros_interesse_geral", "books_general_interest"), ("alimentos", "food"),
+    ("moveis_sala", "furniture_living_room"), ("casa_conforto", "home_confort"),
+]
+PAYMENT_TYPES = (["credit_card", "boleto", "voucher", "debit_card"], [0.74, 0.19, 0.055, 0.015])
+ORDER_STATUS = (["delivered", "shipped", "canceled", "unavailable", "invoiced", "processing", "created", "approved"],
+                [0.9702, 0.0111, 0.0063, 0.0061, 0.0032, 0.003, 0.00005, 0.00005])
+REVIEW_SCORES = ([1, 2, 3, 4, 5], [0.115, 0.032, 0.082, 0.193, 0.578])
+ITEMS_PER_ORDER = ([1, 2, 3, 4, 5, 6], [0.9, 0.075, 0.015, 0.005, 0.003, 0.002])
+
+TABLES = {
+    "olist_customers_dataset": ["customer_id", "customer_unique_id", "customer_zip_code_prefix",
+                                "customer_city", "customer_state"],
+    "olist_orders_dataset": ["order_id", "customer_id", "order_status", "order_purchase_timestamp",
+                             "order_approved_at", "order_delivered_carrier_date",
+                             "order_delivered_customer_date", "order_estimated_delivery_date"],
+    "olist_order_items_dataset": ["order_id", "order_item_id", "product_id", "seller_id",
+                                  "shipping_limit_date", "price", "freight_value"],
+    "olist_order_payments_dataset": ["order_id", "payment_sequential", "payment_type",
+                                     "payment_installments", "payment_value"],
+    "olist_order_reviews_dataset": ["review_id", "order_id", "review_score", "review_comment_title",
+                                    "review_comment_message", "review_creation_date", "review_answer_timestamp"],
+    "olist_products_dataset": ["product_id", "product_category_name", "product_name_lenght",
+                               "product_description_lenght", "product_photos_qty", "product_weight_g",
+                               "product_length_cm", "product_height_cm", "product_width_cm"],
+    "olist_sellers_dataset": ["seller_id", "seller_zip_code_prefix", "seller_city", "seller_state"],
+    "olist_geolocation_dataset": ["geolocation_zip_code_prefix", "geolocation_lat", "geolocation_lng",
+                                  "geolocation_city", "geolocation_state"],
+    "product_category_name_translation": ["product_category_name", "product_category_name_english"],
+}
+
+
+def _rng(seed: int, table: str, chunk: int = 0):
+    return np.random.default_rng([seed, sum(map(ord, table)), chunk])
+
+
+def _ids(prefix: int, index: np.ndarray) -> np.ndarray:
+    # 32 hex chars like the real md5 ids, unique per (prefix, index).
+    mixed = (index.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)) ^ np.uint64(prefix * 0x85EBCA77)
+    return np.char.add(np.char.mod("%016x", mixed), np.char.mod("%016x", index.astype(np.uint64) + np.uint64(prefix)))
+
+
+def _power_law(rng, n_choices: int, size: int, exponent: float = 0.9) -> np.ndarray:
+    weights = 1.0 / np.arange(1, n_choices + 1) ** exponent
+    cdf = np.cumsum(weights / weights.sum())
+    return np.minimum(np.searchsorted(cdf, rng.random(size)), n_choices - 1)
+
+
+def _choice(rng, options, size):
+    values, probs = options
+    probs = np.asarray(probs, dtype=float)
+    return np.asarray(values)[rng.choice(len(values), size=size, p=probs / probs.sum())]
+
+
+def _ts(values: np.ndarray) -> pa.Array:
+    return pa.array(values.astype("datetime64[s]"), type=pa.timestamp("s"))
+
+
+def _place(rng, size):
+    states = _choice(rng, (list(STATES), list(STATES.values())), size)
+    cities = np.empty(size, dtype=object)
+    for state in np.unique(states):
+        mask = states == state
+        names = CITIES[state]
+        cities[mask] = np.asarray(names, dtype=object)[_power_law(rng, len(names), int(mask.sum()), 1.2)]
+    zips = np.char.mod("%05d", rng.integers(1000, 99990, size))
+    return states, cities, zips
+
+
+class _Writers:
+    def __init__(self, out_dir: str):
+        self.out_dir = out_dir
+        self.writers = {}
+        self.rows = {}
+
+    def write(self, name: str, columns: dict):
+        table = pa.table({col: columns[col] for col in TABLES[name]})
+        if name not in self.writers:
+            path = os.path.join(self.out_dir, name + ".csv")
+            self.writers[name] = pacsv.CSVWriter(path, table.schema)
+            self.rows[name] = 0
+        self.writers[name].write_table(table)
+        self.rows[name] += table.num_rows
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+
+def generate(out_dir: str, scale: float = 1.0, seed: int = 42) -> dict:
+    """Writes the CSVs into out_dir; returns row counts per file."""
+    os.makedirs(out_dir, exist_ok=True)
+    n_orders = max(1, int(BASE_ORDERS * scale))
+    n_products = max(1, int(BASE_PRODUCTS * scale))
+    n_sellers = max(1, int(BASE_SELLERS * scale))
+    n_unique_customers = int(n_orders * 0.966)
+    out = _Writers(out_dir)
+    try:
+        # Dimension tables.
+        out.write("product_category_name_translation", {
+            "product_category_name": [pt for pt, _ in CATEGORIES],
+            "product_category_name_english": [en for _, en in CATEGORIES],
+        })
+
+        rng = _rng(seed, "products")
+        category_idx = _power_law(rng, len(CATEGORIES), n_products, 0.8)
+        categories = np.asarray([pt for pt, _ in CATEGORIES], dtype=object)[category_idx]
+        categories[rng.random(n_products) < 0.0185] = None
+        product_price = np.clip(rng.lognormal(4.3, 0.95, n_products), 0.85, 6735.0).round(2)
+        out.write("olist_products_dataset", {
+            "product_id": _ids(1, np.arange(n_products)),
+            "product_category_name": pa.array(categories, type=pa.string()),
+            "product_name_lenght": rng.integers(5, 77, n_products),
+            "product_description_lenght": rng.integers(4, 3993, n_products),
+            "product_photos_qty": 1 + rng.poisson(1.2, n_products),
+            "product_weight_g": np.clip(rng.lognormal(6.6, 1.2, n_products), 50, 40425).astype(int),
+            "product_length_cm": rng.integers(7, 105, n_products),
+            "product_height_cm": rng.integers(2, 105, n_products),
+            "product_width_cm": rng.integers(6, 118, n_products),
+        })
+
+        rng = _rng(seed, "sellers")
+        states, cities, zips = _place(rng, n_sellers)
+        out.write("olist_sellers_dataset", {
+            "seller_id": _ids(2, np.arange(n_sellers)),
+            "seller_zip_code_prefix": zips, "seller_city": cities, "seller_state": states,
+        })
+
+        rng = _rng(seed, "geolocation")
+        n_geo = max(1, int(20_000 * scale))
+        states, cities, zips = _place(rng, n_geo)
+        out.write("olist_geolocation_dataset", {
+            "geolocation_zip_code_prefix": zips,
+            "geolocation_lat": rng.uniform(-33.7, 5.2, n_geo).round(6),
+            "geolocation_lng": rng.uniform(-73.9, -34.8, n_geo).round(6),
+            "geolocation_city": cities, "geolocation_state": states,
+        })
+
+        # Fact tables, in chunks of orders so memory stays flat at 100x.
+        span = (END - START) / np.timedelta64(1, "s")
+        for chunk, first in enumerate(range(0, n_orders, CHUNK_ORDERS)):
+            rng = _rng(seed, "orders", chunk)
+            idx = np.arange(first, min(first + CHUNK_ORDERS, n_orders))
+            n = len(idx)
+            order_ids = _ids(3, idx)
+            customer_ids = _ids(4, idx)
+
+            unique = np.where(idx < n_unique_customers, idx, rng.integers(0, n_unique_customers, n))
+            states, cities, zips = _place(rng, n)
+            out.write("olist_customers_dataset", {
+                "customer_id": customer_ids, "customer_unique_id": _ids(5, unique),
+                "customer_zip_code_prefix": zips, "customer_city": cities, "customer_state": states,
+            })
+
+            # Volume ramps up over time (beta-shaped), like the real store's growth.
+            purchase = START + (rng.beta(2.2, 1.1, n) * span).astype("timedelta64[s]")
+            status = _choice(rng, ORDER_STATUS, n)
+            approved = purchase + rng.integers(600, 2 * 86400, n).astype("timedelta64[s]")
+            carrier = approved + (rng.lognormal(0.9, 0.7, n) * 86400).astype("timedelta64[s]")
+            delivered = carrier + (rng.lognormal(2.0, 0.6, n) * 86400).astype("timedelta64[s]")
+            estimated = (purchase + (rng.normal(24, 6, n).clip(5, 60) * 86400).astype("timedelta64[s]")
+                         ).astype("datetime64[D]")
+            is_delivered = status == "delivered"
+            shipped = np.isin(status, ["delivered", "shipped"])
+            out.write("olist_orders_dataset", {
+                "order_id": order_ids, "customer_id": customer_ids, "order_status": status,
+                "order_purchase_timestamp": _ts(purchase),
+                "order_approved_at": _ts(approved),
+                "order_delivered_carrier_date": pa.array(np.where(shipped, carrier, np.datetime64("NaT")).astype("datetime64[s]"),
+                                                         type=pa.timestamp("s"), from_pandas=True),
+                "order_delivered_customer_date": pa.array(np.where(is_delivered, delivered, np.datetime64("NaT")).astype("datetime64[s]"),
+                                                          type=pa.timestamp("s"), from_pandas=True),
+                "order_estimated_delivery_date": _ts(estimated),
+            })
+
+            items_per_order = _choice(rng, ITEMS_PER_ORDER, n)
+            item_order = np.repeat(np.arange(n), items_per_order)
+            item_seq = np.arange(len(item_order)) - np.repeat(np.cumsum(items_per_order) - items_per_order, items_per_order) + 1
+            products = _power_law(rng, n_products, len(item_order), 0.9)
+            price = product_price[products]
+            freight = np.clip(rng.lognormal(2.8, 0.55, len(item_order)), 0.0, 410.0).round(2)
+            out.write("olist_order_items_dataset", {
+                "order_id": order_ids[item_order], "order_item_id": item_seq,
+                "product_id": _ids(1, products), "seller_id": _ids(2, _power_law(rng, n_sellers, len(item_order), 1.0)),
+                "shipping_limit_date": _ts(purchase[item_order] + np.timedelta64(6, "D")),
+                "price": price, "freight_value": freight,
+            })
+
+            # Payments: one per order, sometimes topped up with vouchers; they add up to the order total.
+            order_total = np.bincount(item_order, weights=price + freight, minlength=n)
+            n_pay = 1 + (rng.random(n) < 0.03) + (rng.random(n) < 0.01)
+            pay_order = np.repeat(np.arange(n), n_pay)
+            pay_seq = np.arange(len(pay_order)) - np.repeat(np.cumsum(n_pay) - n_pay, n_pay) + 1
+            voucher_share = rng.uniform(0.05, 0.4, len(pay_order))
+            extra = pay_seq > 1
+            pay_value = np.where(extra, order_total[pay_order] * voucher_share, 0.0)
+            voucher_sum = np.bincount(pay_order, weights=pay_value, minlength=n)
+            pay_value = np.where(extra, pay_value, order_total[pay_order] - voucher_sum[pay_order]).round(2)
+            pay_type = np.where(extra, "voucher", _choice(rng, PAYMENT_TYPES, len(pay_order)))
+            installments = np.where(pay_type == "credit_card",
+                                    _choice(rng, (list(range(1, 11)), [.5, .12, .1, .07, .05, .04, .03, .03, .02, .04]),
+                                            len(pay_order)), 1)
+            out.write("olist_order_payments_dataset", {
+                "order_id": order_ids[pay_order], "payment_sequential": pay_seq, "payment_type": pay_type,
+                "payment_installments": installments, "payment_value": pay_value,
+            })
+
+            reviewed = rng.random(n) < 0.992
+            r_idx = np.flatnonzero(reviewed)
+            late = is_delivered[r_idx] & (delivered[r_idx].astype("datetime64[D]") > estimated[r_idx])
+            scores = _choice(rng, REVIEW_SCORES, len(r_idx))
+            scores = np.where(late & (rng.random(len(r_idx)) < 0.5), 1, scores)
+            created = np.where(is_delivered[r_idx], delivered[r_idx], estimated[r_idx]).astype("datetime64[D]") + 1
+            out.write("olist_order_reviews_dataset", {
+                "review_id": _ids(6, idx[r_idx]), "order_id": order_ids[r_idx], "review_score": scores,
+                "review_comment_title": pa.nulls(len(r_idx), pa.string()),
+                "review_comment_message": pa.nulls(len(r_idx), pa.string()),
+                "review_creation_date": _ts(created),
+                "review_answer_timestamp": _ts(created + rng.integers(3600, 5 * 86400, len(r_idx)).astype("timedelta64[s]")),
+            })
+    finally:
+        out.close()
+    return dict(out.rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic Olist dataset.")
+    parser.add_argument("out_dir")
+    parser.add_argument("--scale", type=float, default=1.0, help="1 ≈ the Kaggle release; 10, 100, ...")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    t0 = time.perf_counter()
+    rows = generate(args.out_dir, args.scale, args.seed)
+    for name, count in sorted(rows.items()):
+        print(f"{name:40s} {count:>12,}")
+    print(f"done in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
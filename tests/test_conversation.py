@@ -0,0 +1,28 @@
+import pyarrow as pa
+
+from conversation import ConversationMemory
+
+
+def ask(memory, n, sql_padding=""):
+    memory.begin_turn(f"Revenue by state for category {n}?")
+    memory.record_sql(f"SELECT customer_state, SUM(price) AS revenue FROM sales_enriched "
+                      f"WHERE category = 'c{n}' {sql_padding}GROUP BY 1 ORDER BY revenue DESC")
+    memory.record_result(pa.table({"customer_state": ["SP", "RJ"], "revenue": [10.0, 5.0]}))
+    memory.record_insight("SP leads by a wide margin. RJ follows.")
+
+
+def test_rendered_memory_stays_within_budget():
+    memory = ConversationMemory(token_budget=300)
+    for n in range(40):
+        ask(memory, n)
+        assert memory.stats()["tokens"] <= 300
+    assert memory.summary and "category = 'c39'" in memory.render()
+
+
+def test_long_turn_keeps_its_sql_and_drops_digests():
+    memory = ConversationMemory(token_budget=200)
+    for n in range(5):
+        ask(memory, n)
+    ask(memory, 5, "AND price > 0 " * 40)
+    assert memory.turns[-1]["sql"] in memory.render()
+    assert not memory.summary
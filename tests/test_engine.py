@@ -0,0 +1,36 @@
+import os
+import shutil
+
+from engine import SharedEngine
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "olist")
+ORDERS = "SELECT COUNT(*) AS n FROM olist_orders_dataset"
+
+
+def test_reload_while_old_engine_is_in_use(tmp_path):
+    data, cache = tmp_path / "data", str(tmp_path / "cache")
+    shutil.copytree(FIXTURES, data)
+    old = SharedEngine(str(data), cache)
+    session = old.cursor()
+    # What the router and inline_max_purchase_ts do on every chat turn: a result left open.
+    session.execute("SELECT max_purchase_ts FROM sales_enriched_stats").fetchone()
+    assert old.query_arrow(session, ORDERS).column("n")[0].as_py() == 99
+
+    # An appended row changes the folder signature, and the app builds a second engine on the same file.
+    with open(data / "olist_orders_dataset.csv", encoding="utf-8") as f:
+        f.readline()
+        first = f.readline()
+    with open(data / "olist_orders_dataset.csv", "a", encoding="utf-8") as f:
+        f.write(first.replace('"0', '"f', 1))
+    new = SharedEngine(str(data), cache)
+    try:
+        assert new.version != old.version
+        assert new.query_arrow(new.cursor(), ORDERS).column("n")[0].as_py() == 100
+        # Sessions still on the old engine must not get its cached pre-reload answer.
+        assert old.query_arrow(session, ORDERS).column("n")[0].as_py() == 100
+        # Nor must a third load fail while both engines have sessions mid-read.
+        new.cursor().execute("SELECT max_purchase_ts FROM sales_enriched_stats").fetchone()
+        SharedEngine(str(data), cache).conn.close()
+    finally:
+        new.conn.close()
+        old.conn.close()
@@ -0,0 +1,102 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from gemini import GeminiClient, StreamInterrupted
+from llm_cache import ResponseCache
+
+SQL_REPLY = ["# top categories\n", "SELECT category, SUM(price) AS total\n", "FROM sales_enriched GROUP BY 1\n",
+             "ORDER BY total DESC LIMIT 5;\n", "-- trailing explanation the caller never needs\n"]
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """Answers like the Gemini REST API; the prompt picks the behaviour."""
+    protocol_version = "HTTP/1.1"
+    ports = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        StandIn.ports.append(self.client_address[1])
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        prompt = body["contents"][0]["parts"][0]["text"]
+        if "streamGenerateContent" not in self.path:
+            data = json.dumps({"candidates": [{"content": {"parts": [{"text": "reply to " + prompt}]}}]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        # Server-sent events, one HTTP chunk per event, like the real endpoint.
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, text in enumerate(SQL_REPLY):
+            if prompt == "break" and i == 2:
+                # Drop the connection part-way, without the terminating chunk.
+                self.close_connection = True
+                return
+            event = f"data: {json.dumps({'candidates': [{'content': {'parts': [{'text': text}]}}]})}\r\n\r\n".encode()
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(event), event))
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+@pytest.fixture
+def server():
+    StandIn.ports = []
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{srv.server_address[1]}"
+    srv.shutdown()
+    srv.server_close()
+
+
+@pytest.fixture
+def client(server, tmp_path):
+    return GeminiClient("key", "stand-in", server, cache=ResponseCache(str(tmp_path / "llm.sqlite")),
+                        max_retries=0)
+
+
+def test_requests_reuse_one_pooled_connection(client):
+    assert client.generate("one") == "reply to one"
+    assert client.generate("two") == "reply to two"
+    assert len(StandIn.ports) == 2 and len(set(StandIn.ports)) == 1
+
+
+def test_stream_yields_chunks_and_caches_the_full_reply(client):
+    assert list(client.stream("full")) == SQL_REPLY
+    assert client.cache.get("stand-in", "full") == "".join(SQL_REPLY)
+    assert list(client.stream("full")) == ["".join(SQL_REPLY)]
+    assert len(StandIn.ports) == 1
+
+
+def test_early_stop_after_complete_statement_caches_what_was_read(client):
+    text = ""
+    for chunk in client.stream("early"):
+        text += chunk
+        if text.rstrip().endswith(";"):
+            break
+    assert client.cache.get("stand-in", "early") == "".join(SQL_REPLY[:4])
+
+
+def test_early_stop_before_statement_is_complete_is_not_cached(client):
+    stream = client.stream("partial")
+    next(stream)
+    next(stream)
+    stream.close()
+    assert client.cache.get("stand-in", "partial") is None
+
+
+def test_mid_stream_failure_raises_and_is_not_cached(client):
+    received = []
+    with pytest.raises(StreamInterrupted):
+        for chunk in client.stream("break"):
+            received.append(chunk)
+    assert received == SQL_REPLY[:2]
+    assert client.cache.get("stand-in", "break") is None
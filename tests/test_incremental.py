@@ -0,0 +1,140 @@
+import csv
+import os
+import shutil
+
+import pytest
+
+import rollup
+from engine import SharedEngine
+from rollup import KPI_SQL
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "olist")
+CUT = "2018-05-01"  # orders purchased from here on arrive later, as appends and drop files
+ORDER_TABLES = ("olist_orders_dataset", "olist_order_items_dataset", "olist_order_payments_dataset",
+                "olist_order_reviews_dataset")
+CHECKS = [
+    "SELECT COUNT(*) FROM olist_orders_dataset",
+    "SELECT COUNT(*) FROM olist_order_items_dataset",
+    "SELECT COUNT(*) FROM olist_order_payments_dataset",
+    "SELECT COUNT(*) FROM olist_order_reviews_dataset",
+    "SELECT COUNT(*), round(SUM(payment_value), 4), round(SUM(price), 4), round(AVG(review_score), 6) FROM sales_enriched",
+    "SELECT * FROM sales_enriched_stats",
+    "SELECT month, category, customer_state, payment_type, item_count, round(revenue, 4), round(payment_value, 4), "
+    "review_count, len(order_sketch) FROM sales_rollup ORDER BY ALL",
+    f"SELECT round(total_orders, 6), round(total_revenue, 4), unique_customers, round(avg_rating, 6) FROM ({KPI_SQL})",
+    "SELECT table_name, column_name, row_count FROM maer.schema_index ORDER BY ALL",
+    "SELECT * FROM order_payments_summary ORDER BY ALL",
+    "SELECT * FROM order_reviews_summary ORDER BY ALL",
+]
+
+
+def read_csv(table):
+    with open(os.path.join(FIXTURES, table + ".csv"), newline="", encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    return rows[0], rows[1:]
+
+
+def write_csv(path, header, rows, mode="w"):
+    with open(path, mode, newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        if header:
+            writer.writerow(header)
+        writer.writerows(rows)
+
+
+def split_by_purchase(work):
+    """Writes the fixture tables into work without the orders from CUT on. Returns {table: (header, old, new)}."""
+    header, orders = read_csv("olist_orders_dataset")
+    ts = header.index("order_purchase_timestamp")
+    late = {r[0] for r in orders if r[ts] >= CUT}
+    split = {}
+    for name in os.listdir(FIXTURES):
+        shutil.copy(os.path.join(FIXTURES, name), work)
+    for table in ORDER_TABLES:
+        header, rows = read_csv(table)
+        key = header.index("order_id")
+        split[table] = (header, [r for r in rows if r[key] not in late], [r for r in rows if r[key] in late])
+        write_csv(os.path.join(work, table + ".csv"), split[table][0], split[table][1])
+    return split
+
+
+def snapshot(engine):
+    return [engine.conn.execute(sql).fetchall() for sql in CHECKS]
+
+
+@pytest.fixture(scope="module")
+def full_rebuild(tmp_path_factory):
+    """snapshot() of a from-scratch load of every fixture CSV, per partition layout."""
+    snapshots = {}
+
+    def build(partition_by=None):
+        if partition_by not in snapshots:
+            engine = SharedEngine(FIXTURES, str(tmp_path_factory.mktemp("full_cache")), partition_by=partition_by)
+            try:
+                snapshots[partition_by] = snapshot(engine)
+            finally:
+                engine.conn.close()
+        return snapshots[partition_by]
+
+    return build
+
+
+@pytest.fixture
+def delta_calls(monkeypatch):
+    calls = []
+    original = rollup.delta_applies
+
+    def spy(conn, name, definition):
+        calls.append((name, original(conn, name, definition)))
+        return calls[-1][1]
+
+    monkeypatch.setattr(rollup, "delta_applies", spy)
+    return calls
+
+
+@pytest.mark.parametrize("partition_by", [None, "month"])
+def test_appends_and_drop_files_match_a_full_rebuild(tmp_path, full_rebuild, delta_calls, partition_by):
+    work, cache = tmp_path / "data", str(tmp_path / "cache")
+    work.mkdir()
+    split = split_by_purchase(work)
+    SharedEngine(str(work), cache, partition_by=partition_by).conn.close()
+
+    # Orders and reviews grow in place; items and payments arrive as drop files. Both repeat some old rows.
+    for table in ("olist_orders_dataset", "olist_order_reviews_dataset"):
+        header, old, new = split[table]
+        write_csv(work / f"{table}.csv", None, new + old[:3], mode="a")
+    for table in ("olist_order_items_dataset", "olist_order_payments_dataset"):
+        header, old, new = split[table]
+        write_csv(work / f"{table}__2018-05.csv", header, new + old[:3] + new[:2])
+    delta_calls.clear()
+
+    engine = SharedEngine(str(work), cache, partition_by=partition_by)
+    try:
+        assert ("sales_rollup", True) in delta_calls
+        assert snapshot(engine) == full_rebuild(partition_by)
+    finally:
+        engine.conn.close()
+
+
+def test_removed_drop_file_rebuilds_the_table(tmp_path, full_rebuild):
+    work, cache = tmp_path / "data", str(tmp_path / "cache")
+    work.mkdir()
+    split = split_by_purchase(work)
+    header, old, new = split["olist_order_payments_dataset"]
+    write_csv(work / "olist_order_payments_dataset.csv", header, old)
+    write_csv(work / "olist_order_payments_dataset__late.csv", header, new)
+    for table in ("olist_orders_dataset", "olist_order_items_dataset", "olist_order_reviews_dataset"):
+        header, old, new = split[table]
+        write_csv(work / f"{table}.csv", header, old + new)
+    SharedEngine(str(work), cache).conn.close()
+
+    # The drop's rows move into the main CSV: a drop file disappearing forces a rebuild, not an append.
+    os.remove(work / "olist_order_payments_dataset__late.csv")
+    header, old, new = split["olist_order_payments_dataset"]
+    write_csv(work / "olist_order_payments_dataset.csv", header, new + old)
+
+    engine = SharedEngine(str(work), cache)
+    try:
+        assert snapshot(engine) == full_rebuild()
+    finally:
+        engine.conn.close()
@@ -0,0 +1,78 @@
+import os
+import re
+
+import pytest
+
+from engine import SharedEngine
+from storage import add_partition_filters
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "olist")
+KEY = "(purchase_year, purchase_month)"
+COUNT = "SELECT COUNT(*), round(SUM(price), 4) FROM sales_enriched"
+
+# (sql, partition condition the rewrite must add, or None when it must leave sql alone)
+CASES = [
+    (f"{COUNT} WHERE order_purchase_timestamp >= '2018-03-15'", f"{KEY} >= (2018, 3)"),
+    (f"{COUNT} WHERE order_purchase_timestamp > TIMESTAMP '2018-03-31 23:59:59'", f"{KEY} >= (2018, 3)"),
+    (f"{COUNT} WHERE order_purchase_timestamp < TIMESTAMP '2017-06-01'", f"{KEY} < (2017, 6)"),
+    (f"{COUNT} WHERE order_purchase_timestamp < DATE '2017-06-15'", f"{KEY} <= (2017, 6)"),
+    (f"{COUNT} WHERE order_purchase_timestamp <= '2017-06-01'", f"{KEY} <= (2017, 6)"),
+    (f"{COUNT} WHERE order_purchase_timestamp BETWEEN '2017-01-15' AND TIMESTAMP '2017-02-01' - INTERVAL 1 SECOND",
+     f"{KEY} BETWEEN (2017, 1) AND (2017, 1)"),
+    (f"{COUNT} WHERE NOT order_purchase_timestamp >= DATE '2017-06-01'", f"{KEY} >= (2017, 6)"),
+    (f"{COUNT} se WHERE se.order_purchase_timestamp >= '2018-01-01' AND se.customer_state = 'SP'",
+     "(se.purchase_year, se.purchase_month) >= (2018, 1)"),
+    (f'{COUNT} WHERE "order_purchase_timestamp" < TIMESTAMP \'2017-01-01\'', f"{KEY} < (2017, 1)"),
+    (f'{COUNT} "se" WHERE "se"."ORDER_PURCHASE_TIMESTAMP" >= DATE \'2018-02-01\'',
+     '("se".purchase_year, "se".purchase_month) >= (2018, 2)'),
+    (f"{COUNT} WHERE order_purchase_timestamp >= TIMESTAMP '2017-11-20' + INTERVAL 15 DAY", f"{KEY} >= (2017, 12)"),
+    (f"{COUNT} WHERE order_purchase_timestamp >= DATE_TRUNC('month', TIMESTAMP '2018-08-15') - INTERVAL 1 MONTH "
+     f"AND order_purchase_timestamp < DATE_TRUNC('month', TIMESTAMP '2018-08-15')", f"{KEY} < (2018, 8)"),
+    (f"{COUNT} WHERE order_purchase_timestamp >= order_delivered_customer_date - INTERVAL 30 DAY", None),
+    (f"{COUNT} WHERE order_purchase_timestamp >= (SELECT max_purchase_ts FROM sales_enriched_stats) - INTERVAL 3 MONTH",
+     None),
+    (f"{COUNT} WHERE customer_state <> 'order_purchase_timestamp >= 2018'", None),
+    (f"{COUNT} s JOIN olist_orders_dataset o USING (order_id) WHERE o.order_purchase_timestamp >= '2018-01-01'", None),
+]
+
+
+@pytest.fixture(scope="module")
+def engines(tmp_path_factory):
+    plain = SharedEngine(FIXTURES, str(tmp_path_factory.mktemp("plain")))
+    partitioned = SharedEngine(FIXTURES, str(tmp_path_factory.mktemp("partitioned")), partition_by="month_state")
+    try:
+        yield plain.cursor(), partitioned.cursor()
+    finally:
+        plain.conn.close()
+        partitioned.conn.close()
+
+
+@pytest.mark.parametrize("sql,implied", CASES)
+def test_partition_filters(engines, sql, implied):
+    plain, partitioned = engines
+    rewritten = add_partition_filters(partitioned, sql)
+    if implied is None:
+        assert rewritten == sql
+    else:
+        assert implied in rewritten
+    # Pruning must never change the answer.
+    assert partitioned.execute(rewritten).fetchall() == plain.execute(sql).fetchall()
+
+
+def files_scanned(cursor, sql):
+    profile = cursor.execute("EXPLAIN ANALYZE " + sql).fetchall()[0][1]
+    m = re.search(r"Scanning Files:[\s│]*(\d+)/(\d+)", profile)
+    if m is None:
+        pytest.skip("this DuckDB's profile does not report scanned files")
+    return int(m.group(1)), int(m.group(2))
+
+
+def test_filters_prune_partitions(engines):
+    _, partitioned = engines
+    sql = f"{COUNT} WHERE order_purchase_timestamp >= TIMESTAMP '2018-08-01' AND customer_state = 'SP'"
+    read, total = files_scanned(partitioned, add_partition_filters(partitioned, sql))
+    assert read < files_scanned(partitioned, sql)[0] < total
+    months = partitioned.execute(
+        "SELECT COUNT(DISTINCT (purchase_year, purchase_month)) FROM sales_enriched "
+        "WHERE order_purchase_timestamp >= TIMESTAMP '2018-08-01' AND customer_state = 'SP'").fetchone()[0]
+    assert read == months
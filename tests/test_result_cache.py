@@ -0,0 +1,13 @@
+from result_cache import canonicalize_sql
+
+
+def test_case_and_whitespace_are_ignored_outside_literals():
+    assert canonicalize_sql("SELECT  category\nFROM Sales_Rollup;") == canonicalize_sql("select category from sales_rollup")
+    assert canonicalize_sql("SELECT 'SP'") != canonicalize_sql("SELECT 'sp'")
+
+
+def test_dollar_quoted_strings_are_kept_verbatim():
+    assert canonicalize_sql("SELECT $$SP$$") == "select $$SP$$"
+    assert canonicalize_sql("SELECT $$SP$$") != canonicalize_sql("SELECT $$sp$$")
+    assert canonicalize_sql("SELECT($tag$It's  -- $$ Here$tag$)") == "select($tag$It's  -- $$ Here$tag$)"
+    assert canonicalize_sql("SELECT upper($$A  B$$) AS X") == "select upper($$A  B$$) as x"
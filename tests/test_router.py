@@ -0,0 +1,81 @@
+import math
+
+import pytest
+
+import synthetic_olist
+from engine import SharedEngine
+
+# Each routed template is checked against exact SQL on sales_enriched, built
+# here from the parsed parameters without the router's own rendering.
+QUESTIONS = [
+    "number of orders by category",
+    "orders by state",
+    "orders per month in 2017",
+    "worst 3 states by orders last year",
+    "orders by payment type last 3 months",
+    "top 5 categories by revenue",
+    "monthly revenue trend",
+    "best states by average review score",
+    "payment methods share",
+    "freight by state in 2018",
+    "items by category in SP",
+]
+EXACT = {
+    "revenue": "SUM(price)",
+    "orders": "COUNT(DISTINCT order_id)",
+    "items": "COUNT(*)",
+    "avg_review": "AVG(review_score)",
+    "payment_value": "SUM(payment_value)",
+    "freight": "SUM(freight_value)",
+}
+MONTH = "strftime(order_purchase_timestamp, '%Y-%m')"
+
+
+def exact_sql(params):
+    dimension = MONTH if params["dimension"] == "month" else params["dimension"]
+    where = [f"{dimension} IS NOT NULL"]
+    window = params.get("window")
+    if window and window.startswith("since "):
+        where.append(f"{MONTH} >= '{window[6:]}'")
+    elif window and len(window) == 4:
+        where.append(f"{MONTH} LIKE '{window}-%'")
+    elif window:
+        where.append(f"{MONTH} = '{window}'")
+    if params.get("state"):
+        where.append(f"customer_state = '{params['state']}'")
+    having = " HAVING COUNT(*) > 50" if params["metric"] == "avg_review" and params["dimension"] != "month" else ""
+    return (f"SELECT {dimension}, {EXACT[params['metric']]} FROM sales_enriched "
+            f"WHERE {' AND '.join(where)} GROUP BY 1{having}")
+
+
+@pytest.fixture(scope="module")
+def engine(tmp_path_factory):
+    # ~10k orders: past the sketch size, so an estimated count would show.
+    data = tmp_path_factory.mktemp("olist")
+    synthetic_olist.generate(str(data), 0.1, 42)
+    engine = SharedEngine(str(data), str(tmp_path_factory.mktemp("cache")))
+    yield engine
+    engine.conn.close()
+
+
+@pytest.mark.parametrize("question", QUESTIONS)
+def test_template_matches_exact_sql(engine, question):
+    route = engine.router.route(question)
+    assert route is not None
+    params = route["params"]
+    routed = engine.conn.execute(route["sql"]).fetchall()
+    exact = dict(engine.conn.execute(exact_sql(params)).fetchall())
+    for key, value in routed:
+        assert math.isclose(value, exact[key], rel_tol=1e-9), (key, value, exact[key])
+    if params["dimension"] == "month":
+        assert [k for k, _ in routed] == sorted(exact)
+        return
+    # Ties may pick different keys under a LIMIT, but the ranked values must be the same.
+    ranked = sorted(exact.values(), reverse=not params.get("ascending"))
+    assert [v for _, v in routed] == pytest.approx(ranked[:len(routed)], rel=1e-9)
+    assert len(routed) == min(params.get("limit") or len(exact), len(exact))
+
+
+def test_order_counts_are_whole_numbers(engine):
+    routed = engine.conn.execute(engine.router.route("number of orders by category")["sql"]).fetchall()
+    assert all(isinstance(n, int) for _, n in routed)
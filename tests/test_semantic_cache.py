@@ -0,0 +1,102 @@
+import os
+
+import pytest
+
+from semantic_cache import HashedNgramEmbedder, SemanticCache, question_literals
+
+THREE_MONTHS = "over the last three months?"
+
+# Each pair embeds above the default 0.9 threshold but needs different SQL.
+OPPOSITE_PAIRS = [
+    (f"Which product categories had the highest total revenue {THREE_MONTHS}",
+     f"Which product categories had the lowest total revenue {THREE_MONTHS}"),
+    (f"Which product categories had the most cancelled orders {THREE_MONTHS}",
+     f"Which product categories had the fewest cancelled orders {THREE_MONTHS}"),
+    (f"What share of orders from customers in each state were delivered late {THREE_MONTHS}",
+     f"What share of orders from customers in each state were delivered on time {THREE_MONTHS}"),
+    ("Which sellers have orders in SP with a freight value above 20?",
+     "Which sellers don't have orders in SP with a freight value above 20?"),
+    ("List the ten categories by revenue in ascending order",
+     "List the ten categories by revenue in descending order"),
+]
+
+# Same, but told apart only by a value from the data, in whatever case the user typed it.
+VALUE_PAIRS = [
+    (f"How many orders came from customers located in sp {THREE_MONTHS}",
+     f"How many orders came from customers located in rj {THREE_MONTHS}"),
+    (f"How many orders with status delivered were placed {THREE_MONTHS}",
+     f"How many orders with status canceled were placed {THREE_MONTHS}"),
+    ("Total revenue from credit_card payments in health beauty",
+     "Total revenue from boleto payments in health beauty"),
+]
+VOCABULARY = ("RJ", "SP", "TO", "boleto", "canceled", "credit_card", "delivered", "health_beauty")
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "olist")
+
+
+def similarity(a, b):
+    x, y = HashedNgramEmbedder()([a, b])
+    return sum(i * j for i, j in zip(x, y))
+
+
+@pytest.mark.parametrize("first,second", OPPOSITE_PAIRS)
+def test_opposite_questions_have_different_literals(first, second):
+    assert question_literals(first) != question_literals(second)
+
+
+def test_synonyms_share_literals():
+    assert question_literals("top 5 categories by revenue") == question_literals("the 5 highest categories by revenue")
+    assert question_literals("orders not delivered") == question_literals("orders that weren't delivered")
+    assert question_literals("orders delivered on-time") == question_literals("orders delivered on time")
+
+
+
+@pytest.mark.parametrize("first,second", VALUE_PAIRS)
+def test_questions_with_different_values_have_different_literals(first, second):
+    assert question_literals(first, VOCABULARY) != question_literals(second, VOCABULARY)
+
+
+def test_values_match_case_insensitively():
+    assert question_literals("revenue in sp", VOCABULARY) == question_literals("revenue in SP", VOCABULARY)
+    assert question_literals("paid by Credit Card", VOCABULARY) == question_literals("paid by credit_card", VOCABULARY)
+    # "to" is a state code (Tocantins) only where it reads as one.
+    assert question_literals("revenue to date", VOCABULARY) == ""
+    assert question_literals("revenue from to", VOCABULARY) == "TO"
+
+
+def test_vocabulary_comes_from_the_schema_index(tmp_path):
+    from engine import SharedEngine
+
+    engine = SharedEngine(FIXTURES, str(tmp_path))
+    try:
+        assert {"SP", "delivered", "credit_card"} <= set(engine.literal_values)
+        assert any(c["literals"] for t in engine.schema_index for c in t["columns"] if c["name"] == "category")
+    finally:
+        engine.conn.close()
+
+
+@pytest.mark.parametrize("first,second", VALUE_PAIRS[:2])
+def test_lookup_misses_question_about_another_value(tmp_path, first, second):
+    pytest.importorskip("chromadb")
+    assert similarity(first, second) >= 0.9
+    cache = SemanticCache(str(tmp_path))
+    cache.store(first, "SELECT 1", "v1", VOCABULARY)
+    assert cache.lookup(second, "v1", VOCABULARY) is None
+    assert cache.lookup(first.replace(" sp ", " SP "), "v1", VOCABULARY)[1] == "SELECT 1"
+
+
+@pytest.mark.parametrize("first,second", OPPOSITE_PAIRS[:3])
+def test_lookup_misses_opposite_question(tmp_path, first, second):
+    pytest.importorskip("chromadb")
+    assert similarity(first, second) >= 0.9
+    cache = SemanticCache(str(tmp_path))
+    cache.store(first, "SELECT 1", "v1")
+    assert cache.lookup(second, "v1") is None
+    assert cache.lookup(first, "v1")[1] == "SELECT 1"
+
+
+def test_lookup_hits_paraphrase_with_same_polarity(tmp_path):
+    pytest.importorskip("chromadb")
+    cache = SemanticCache(str(tmp_path))
+    cache.store(f"Which product categories had the highest total revenue {THREE_MONTHS}", "SELECT 1", "v1")
+    hit = cache.lookup(f"Which product categories had the top total revenue {THREE_MONTHS}", "v1")
+    assert hit is not None and hit[1] == "SELECT 1"
@@ -0,0 +1,166 @@
+import bisect
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ---------------------------
+# Tracing
+# ---------------------------
+# Lightweight spans around the stages of a request: LLM calls, SQL cleanup,
+# execution, Arrow fetch, insight generation, dashboard queries. Each span
+# carries its duration, its parent (so a chat turn can be reassembled) and
+# size attributes such as prompt/response characters and row counts. Finished
+# spans go to the "maer.tracing" logger as one JSON object per line — the app
+# attaches a rotating file handler — and into in-process histograms that are
+# exposed in Prometheus text format.
+log = logging.getLogger("maer.tracing")
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+_current = contextvars.ContextVar("maer_span", default=None)
+# Size attributes that are also summed into Prometheus counters.
+_TOTALED = ("chars", "rows", "bytes")
+
+
+class _Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.recent = deque(maxlen=500)
+        self.totals = defaultdict(float)
+
+
+class Tracer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = defaultdict(_Histogram)
+        self._ids = 0
+
+    def _next_id(self) -> str:
+        with self._lock:
+            self._ids += 1
+            return f"{os.getpid():x}-{self._ids:x}"
+
+    def finish(self, name: str, duration_s: float, attrs: dict, trace_id: str, span_id: str, parent_id):
+        with self._lock:
+            h = self._histograms[name]
+            h.counts[bisect.bisect_left(BUCKETS, duration_s)] += 1
+            h.sum += duration_s
+            h.recent.append(duration_s)
+            for key, value in attrs.items():
+                if key.endswith(_TOTALED) and isinstance(value, (int, float)):
+                    h.totals[key] += value
+        if log.isEnabledFor(logging.INFO):
+            log.info(json.dumps({"ts": time.time(), "span": name, "trace": trace_id, "id": span_id,
+                                 "parent": parent_id, "ms": round(duration_s * 1000, 3), **attrs},
+                                default=str))
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """Times the block. Yields the attribute dict so the block can add sizes and counts."""
+        parent = _current.get()
+        span_id = self._next_id()
+        trace_id = parent[0] if parent else span_id
+        token = _current.set((trace_id, span_id))
+        t0 = time.perf_counter()
+        try:
+            yield attrs
+        except BaseException as e:
+            attrs["error"] = type(e).__name__
+            raise
+        finally:
+            _current.reset(token)
+            self.finish(name, time.perf_counter() - t0, attrs, trace_id, span_id, parent[1] if parent else None)
+
+    def record(self, name: str, duration_s: float, **attrs):
+        """A span measured elsewhere (e.g. on a worker thread), attached to the current trace."""
+        parent = _current.get()
+        span_id = self._next_id()
+        self.finish(name, duration_s, attrs, parent[0] if parent else span_id, span_id,
+                    parent[1] if parent else None)
+
+    def summary(self) -> dict:
+        """{span: {count, p50_ms, p95_ms}} over the most recent samples of each span."""
+        out = {}
+        with self._lock:
+            for name, h in sorted(self._histograms.items()):
+                recent = sorted(h.recent)
+                if recent:
+                    out[name] = {"count": sum(h.counts),
+                                 "p50_ms": recent[len(recent) // 2] * 1000,
+                                 "p95_ms": recent[min(len(recent) - 1, int(len(recent) * 0.95))] * 1000}
+        return out
+
+    def prometheus_text(self) -> str:
+        lines = ["# HELP maer_span_duration_seconds Duration of traced stages.",
+                 "# TYPE maer_span_duration_seconds histogram"]
+        totals = []
+        with self._lock:
+            for name, h in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ("+Inf",), h.counts):
+                    cumulative += count
+                    lines.append(f'maer_span_duration_seconds_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'maer_span_duration_seconds_sum{{span="{name}"}} {h.sum:.6f}')
+                lines.append(f'maer_span_duration_seconds_count{{span="{name}"}} {cumulative}')
+                totals += [(name, key, value) for key, value in sorted(h.totals.items())]
+        lines += ["# HELP maer_span_attribute_total Sum of numeric span attributes (characters, rows).",
+                  "# TYPE maer_span_attribute_total counter"]
+        lines += [f'maer_span_attribute_total{{span="{name}",attribute="{key}"}} {value:g}'
+                  for name, key, value in totals]
+        return "\n".join(lines) + "\n"
+
+
+tracer = Tracer()
+span = tracer.span
+record = tracer.record
+
+
+def traced(name: str):
+    """Decorator form of span() for functions without size attributes."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with tracer.span(name):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+def in_current_trace(fn):
+    """Binds fn to the caller's trace, for work handed to a thread pool (safe to call concurrently)."""
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def inner(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+    return inner
+
+
+def serve_metrics(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serves tracer.prometheus_text() at /metrics from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = tracer.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="maer-metrics", daemon=True).start()
+    return server